@@ -0,0 +1,120 @@
+"""
+批量分析指标
+
+按 (乡镇, 水果类型, 月份) 计算 KPI、排名与趋势预测，口径与页面保持一致：
+KPI 同页面的核心指标与企业版高级指标，综合威胁指数同企业版智能决策，趋势预测同深度分析中的线性趋势。
+分组聚合均由 views 的汇总立方体上卷得到。本模块不依赖 Streamlit，可被页面与批处理任务共同调用。
+"""
+
+import numpy as np
+import pandas as pd
+
+from views import build_cube, rollup
+
+KPI_KEYS = ["乡镇", "水果类型", "月份"]
+KPI_METRICS = {
+    "经济损失(元)": "sum",
+    "防治成本(元)": "sum",
+    "严重程度": "mean",
+    "月均发生频次": "mean",
+    "记录数": "count",
+}
+THREAT_METRICS = {"严重程度": "mean", "月均发生频次": "mean", "经济损失(元)": "sum", "防治成本(元)": "sum"}
+FORECAST_MONTHS = list(range(1, 13))
+
+
+def kpi_table(cube):
+    """
+    各 (乡镇, 水果类型, 月份) 的 KPI
+
+    参数:
+        cube: views.build_cube 的输出
+    """
+    kpis = rollup(cube, KPI_KEYS, KPI_METRICS)
+    loss, cost = kpis["经济损失(元)"], kpis["防治成本(元)"]
+    kpis["投资回报率"] = loss / cost.where(cost > 0)
+    kpis["防治潜在收益(元)"] = loss - cost
+    kpis["防治效率(%)"] = (loss - cost) / loss.where(loss > 0) * 100
+    return kpis
+
+
+def rank_towns(kpis):
+    """同一水果、同一月份内各乡镇按经济损失排名（需要全县的 KPI，分片计算后合并再排名）"""
+    kpis = kpis.copy()
+    kpis["损失排名"] = (
+        kpis.groupby(["水果类型", "月份"], observed=True)["经济损失(元)"]
+        .rank(ascending=False, method="min")
+        .astype(int)
+    )
+    return kpis
+
+
+def threat_ranking(cube, by=("乡镇",)):
+    """
+    按综合威胁指数对病虫害排名（指数中的损失与成本在 by 分组内归一化）
+
+    返回:
+        DataFrame，包含 by 列、病虫害类型、威胁指标、综合威胁指数与组内排名
+    """
+    by = list(by)
+    threats = rollup(cube, by + ["病虫害类型"], THREAT_METRICS)
+    grouped = threats.groupby(by, observed=True)
+    max_loss = grouped["经济损失(元)"].transform("max")
+    max_cost = grouped["防治成本(元)"].transform("max")
+    threats["综合威胁指数"] = (
+        threats["严重程度"] * 0.3
+        + threats["月均发生频次"] * 0.2
+        + (threats["经济损失(元)"] / max_loss.where(max_loss > 0)).fillna(0) * 0.3
+        + (threats["防治成本(元)"] / max_cost.where(max_cost > 0)).fillna(0) * 0.2
+    )
+    threats["威胁排名"] = (
+        threats.groupby(by, observed=True)["综合威胁指数"].rank(ascending=False, method="min").astype(int)
+    )
+    return threats.sort_values(by + ["威胁排名"]).reset_index(drop=True)
+
+
+def _linear_fit(x, y, groups):
+    """按组最小二乘拟合 y = a + b·x；只有一个观测月份的组取均值作为水平趋势"""
+    frame = pd.DataFrame({"组": groups, "x": x, "y": y, "xx": x * x, "xy": x * y})
+    sums = frame.groupby("组").agg(n=("x", "size"), sx=("x", "sum"), sy=("y", "sum"),
+                                   sxx=("xx", "sum"), sxy=("xy", "sum"))
+    denominator = sums["n"] * sums["sxx"] - sums["sx"] ** 2
+    slope = ((sums["n"] * sums["sxy"] - sums["sx"] * sums["sy"]) / denominator.where(denominator > 0)).fillna(0.0)
+    intercept = (sums["sy"] - slope * sums["sx"]) / sums["n"]
+    return intercept, slope
+
+
+def trend_forecast(cube, keys=("乡镇", "水果类型"), months=FORECAST_MONTHS):
+    """
+    各组按月份的线性趋势预测（严重程度取月均值，经济损失取月合计）
+
+    返回:
+        DataFrame：keys 列、月份、严重程度与经济损失的实际值（未观测月份为空）与预测值
+    """
+    keys = list(keys)
+    monthly = rollup(cube, keys + ["月份"], {"严重程度": "mean", "经济损失(元)": "sum"})
+    codes = monthly.groupby(keys, observed=True).ngroup().to_numpy()
+    groups = monthly[keys].astype(str).groupby(codes).first()
+    x = monthly["月份"].to_numpy(dtype=float)
+
+    positions = np.repeat(np.arange(len(groups)), len(months))
+    forecast = groups.iloc[positions].reset_index(drop=True)
+    forecast["月份"] = np.tile(months, len(groups))
+    month_values = forecast["月份"].to_numpy(dtype=float)
+    for column, label in [("严重程度", "严重程度预测"), ("经济损失(元)", "经济损失预测(元)")]:
+        intercept, slope = _linear_fit(x, monthly[column].to_numpy(dtype=float), codes)
+        forecast[label] = intercept.to_numpy()[positions] + slope.to_numpy()[positions] * month_values
+    forecast["严重程度预测"] = forecast["严重程度预测"].clip(1, 5)
+    forecast["经济损失预测(元)"] = forecast["经济损失预测(元)"].clip(lower=0)
+
+    actual = monthly.astype({key: str for key in keys}).rename(
+        columns={"严重程度": "严重程度实际", "经济损失(元)": "经济损失实际(元)"}
+    )
+    forecast = forecast.merge(actual, on=keys + ["月份"], how="left")
+    return forecast[keys + ["月份", "严重程度实际", "严重程度预测", "经济损失实际(元)", "经济损失预测(元)"]]
+
+
+def summarize(observations):
+    """一次计算立方体并返回 (kpis, threats, forecasts)；kpis 未含跨乡镇排名，见 rank_towns"""
+    cube = build_cube(observations)
+    return kpi_table(cube), threat_ranking(cube), trend_forecast(cube)
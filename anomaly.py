@@ -0,0 +1,179 @@
+"""
+市场价格与销量异常检测
+
+对每个序列（水果类型、市场/区域等维度的组合）计算滚动稳健 z 分数：
+z = 0.6745 × (当前值 − 窗口中位数) / 窗口绝对中位差(MAD)，|z| 超过阈值即标记为异常。
+可选先按季节周期扣除各序列的季节中位数，在季节残差上检测。参照窗口较短时窗口内的 MAD 可能接近 0，
+可用 scale_floor 将尺度下限设为序列整体稳健尺度的一定比例，避免平稳片段中的微小波动得到极大的 z 分数。
+
+所有序列先整理为 [序列 × 时间] 的二维数组，滚动窗口通过 sliding_window_view 在整块数组上
+一次计算（按序列分块以控制内存），不对单个序列做 Python 循环，可扩展到多水果、多市场的日度价格。
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+MAD_SCALE = 0.6745          # 正态分布下 MAD 与标准差的换算系数
+MEAN_AD_SCALE = 0.7979      # MAD 为 0 时退化为平均绝对偏差的换算系数
+DEFAULT_THRESHOLD = 3.5
+CHUNK_CELLS = 4_000_000     # 每块窗口数组的最大元素数
+
+
+def _to_matrices(frame, time_col, series_keys, value_cols):
+    """一次透视整理为各指标的 [序列 × 时间] 数组；缺失的时间点为 NaN"""
+    wide = frame.pivot_table(index=series_keys, columns=time_col, values=value_cols,
+                             aggfunc="mean", observed=True, dropna=False)
+    times = wide.columns.get_level_values(1).unique()
+    wide = wide.reindex(pd.MultiIndex.from_product([value_cols, times]), axis=1)
+    return wide.index, times, {col: wide[col].to_numpy(dtype=float) for col in value_cols}
+
+
+def seasonal_residuals(values, period):
+    """扣除每个序列按周期相位的季节中位数"""
+    n_series, n_times = values.shape
+    n_cycles = -(-n_times // period)
+    padded = np.full((n_series, n_cycles * period), np.nan)
+    padded[:, :n_times] = values
+    cycles = padded.reshape(n_series, n_cycles, period)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 某相位全为 NaN
+        profile = np.nanmedian(cycles, axis=1)
+    return values - np.tile(profile, n_cycles)[:, :n_times]
+
+
+def _sorted_median(values, count):
+    """沿最后一维的中位数；values 已升序排列且 NaN 在末尾，count 为每行非 NaN 个数"""
+    lower = np.clip((count - 1) // 2, 0, None)[..., None]
+    upper = np.clip(count // 2, 0, None)[..., None]
+    median = (np.take_along_axis(values, lower, -1) + np.take_along_axis(values, upper, -1))[..., 0] / 2
+    return np.where(count > 0, median, np.nan)
+
+
+def _window_stats(values, window, center):
+    """
+    每个点的参照窗口中位数与尺度；参照窗口不含当前点
+
+    center=False 时取当前点之前的 window 个点（适合实时预警），
+    center=True 时取前后各 window//2 个点（适合历史回顾，首尾点也能检测）
+    """
+    n_series, n_times = values.shape
+    if center:
+        half = window // 2
+        padded = np.pad(values, ((0, 0), (half, half)), constant_values=np.nan)
+        span = 2 * half + 1
+        keep = np.r_[np.arange(half), np.arange(half + 1, span)]  # 去掉中心点
+    else:
+        padded = np.pad(values, ((0, 0), (window, 0)), constant_values=np.nan)
+        span = window + 1
+        keep = np.arange(window)  # 去掉最后一个点（当前点）
+
+    median = np.full(values.shape, np.nan)
+    scale = np.full(values.shape, np.nan)
+    count = np.zeros(values.shape, dtype=int)
+    rows_per_chunk = max(1, CHUNK_CELLS // max(1, n_times * span))
+    # 排序后按个数取中位数，比 nanmedian 快一个数量级（NaN 排在末尾）
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 全 NaN 窗口的均值
+        for start in range(0, n_series, rows_per_chunk):
+            stop = min(n_series, start + rows_per_chunk)
+            windows = np.sort(sliding_window_view(padded[start:stop], span, axis=1)[:, :, keep], axis=2)
+            n = np.sum(~np.isnan(windows), axis=2)
+            med = _sorted_median(windows, n)
+            deviation = np.sort(np.abs(windows - med[:, :, None]), axis=2)
+            mad = _sorted_median(deviation, n)
+            mean_ad = np.nanmean(deviation, axis=2)
+            median[start:stop] = med
+            scale[start:stop] = np.where(mad > 0, mad / MAD_SCALE, mean_ad / MEAN_AD_SCALE)
+            count[start:stop] = n
+    return median, scale, count
+
+
+def series_scale(values):
+    """每个序列整体的稳健尺度（MAD 换算为标准差，MAD 为 0 时退化为平均绝对偏差）"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 全 NaN 序列
+        deviation = np.abs(values - np.nanmedian(values, axis=1, keepdims=True))
+        mad = np.nanmedian(deviation, axis=1)
+        mean_ad = np.nanmean(deviation, axis=1)
+    return np.where(mad > 0, mad / MAD_SCALE, mean_ad / MEAN_AD_SCALE)
+
+
+def robust_zscores(values, window=7, min_periods=3, center=False, seasonal_period=None, scale_floor=None):
+    """
+    [序列 × 时间] 数组的滚动稳健 z 分数
+
+    参数:
+        scale_floor: 窗口尺度的下限，为序列整体稳健尺度（series_scale）的比例；None 表示不设下限
+
+    返回:
+        (z, baseline)：baseline 为参照窗口中位数（有季节项时为季节中位数 + 残差中位数）
+    """
+    values = np.asarray(values, dtype=float)
+    seasonal = np.zeros_like(values)
+    if seasonal_period:
+        residual = seasonal_residuals(values, seasonal_period)
+        seasonal = values - residual
+        values = residual
+    median, scale, count = _window_stats(values, window, center)
+    if scale_floor:
+        scale = np.fmax(scale, scale_floor * series_scale(values)[:, None])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (values - median) / scale
+    # 参照窗口完全平坦时，偏离即视为无穷大异常
+    z = np.where((scale == 0) & (values != median), np.sign(values - median) * np.inf, z)
+    z = np.where((scale == 0) & (values == median), 0.0, z)
+    z[(count < min_periods) | np.isnan(values)] = np.nan
+    return z, median + seasonal
+
+
+def detect_anomalies(frame, time_col, series_keys, value_cols, window=7, min_periods=3,
+                     threshold=DEFAULT_THRESHOLD, center=False, seasonal_period=None, scale_floor=None):
+    """
+    对所有序列与指标检测异常
+
+    参数:
+        frame: 长表，每行为一个序列在一个时间点的观测
+        time_col: 时间列（日期或月份）；窗口按时间点位置滑动，缺失时间点不参与计算
+        series_keys: 序列维度列，如 ["水果类型"] 或 ["水果类型", "市场"]
+        value_cols: 需要检测的指标列，如 ["价格(元/公斤)", "销量(吨)"]
+        scale_floor: 窗口尺度下限（序列整体稳健尺度的比例），见 robust_zscores
+
+    返回:
+        长表：series_keys、时间、指标、实际值、基准值、稳健z分数、是否异常、异常方向
+    """
+    series_keys, value_cols = list(series_keys), list(value_cols)
+    if frame.empty or not value_cols:
+        return pd.DataFrame()
+    index, times, matrices = _to_matrices(frame, time_col, series_keys, value_cols)
+    results = []
+    for value_col, values in matrices.items():
+        z, baseline = robust_zscores(values, window, min_periods, center, seasonal_period, scale_floor)
+        n_series, n_times = values.shape
+        keys = index.to_frame(index=False).astype(str) if len(series_keys) > 1 else \
+            pd.DataFrame({series_keys[0]: index.astype(str)})
+        result = keys.iloc[np.repeat(np.arange(n_series), n_times)].reset_index(drop=True)
+        result[time_col] = np.tile(np.asarray(times), n_series)
+        result["指标"] = value_col
+        result["实际值"] = values.reshape(-1)
+        result["基准值"] = baseline.reshape(-1)
+        result["稳健z分数"] = z.reshape(-1)
+        results.append(result[~np.isnan(result["实际值"])])
+
+    result = pd.concat(results, ignore_index=True)
+    result["是否异常"] = result["稳健z分数"].abs() > threshold
+    result["异常方向"] = np.where(result["稳健z分数"] > 0, "飙升", "骤降")
+    result.loc[~result["是否异常"], "异常方向"] = ""
+    return result
+
+
+def anomaly_alerts(anomalies):
+    """异常预警列表：按偏离程度从大到小排序"""
+    if anomalies.empty:
+        return anomalies
+    alerts = anomalies[anomalies["是否异常"]].copy()
+    alerts["偏离幅度(%)"] = (alerts["实际值"] / alerts["基准值"].where(alerts["基准值"] != 0) - 1) * 100
+    order = alerts["稳健z分数"].abs().sort_values(ascending=False).index
+    return alerts.loc[order].reset_index(drop=True)
@@ -1,17 +1,37 @@
 import streamlit as st
 import folium
-import random
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from folium import Marker
 from folium.plugins import MarkerCluster, HeatMap
-from streamlit_folium import st_folium
+from streamlit_folium import generate_leaflet_string, st_folium
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import io
+import os
 import base64
+import logging
+import threading
+import time
+
+from datasets import SIMULATED_NOTES, SNAPSHOT_TABLES, fruit_diseases, fruit_economic_value, lushan_towns, open_snapshots, open_store, solution_db
+from simulation import build_scenario_table, run_monte_carlo
+from schema import memory_report
+from optimizer import NO_TREATMENT, build_options, optimize_allocation
+from weather import compute_risk, generate_weather, load_weather, risk_alerts
+from distribution import DEFAULT_MARKETS, build_arcs, solve_distribution
+from views import CUBE_KEYS, clip_filters, materialize, project, rollup
+from batch import DEFAULT_BATCH_DIR, load_latest
+from anomaly import DEFAULT_THRESHOLD, anomaly_alerts, detect_anomalies
+from sketches import SketchAccumulator, histogram, quantiles, select
+from market_analytics import ADJUSTED_LOSS_COLUMN, MARKET_INDICATORS, market_adjusted_losses, market_impact
+from workbook import submit_workbook
+from tiles import (DEFAULT_ATTRIBUTION, DEFAULT_MBTILES_PATH, DEFAULT_TILE_HOST, DEFAULT_TILE_PORT, DEFAULT_TILE_URL,
+                   LOOPBACK_HOSTS, MBTiles, browser_host, localize_assets, probe_server, server_url,
+                   start_background_server, tile_url)
+
+logger = logging.getLogger(__name__)
 
 # 设置页面配置
 st.set_page_config(
@@ -22,214 +42,97 @@ st.set_page_config(
 )
 
 # --------------------------
-# 数据生成函数（共享）
+# 持久化存储
 # --------------------------
 
-# 设置随机种子以确保数据可重现
-random.seed(42)
-np.random.seed(42)
-
-# 鲁山县主要乡镇及经纬度
-lushan_towns = {
-    "鲁阳镇": (33.74, 112.82),
-    "下汤镇": (33.60, 112.75),
-    "梁洼镇": (33.78, 112.93),
-    "张官营镇": (33.68, 113.05),
-    "尧山镇": (33.50, 112.58),
-    "瓦屋镇": (33.70, 112.65),
-    "赵村镇": (33.62, 112.60),
-    "四棵树乡": (33.55, 112.68)
-}
+@st.cache_resource
+def get_store():
+    """所有会话共享的数据存储；首次启动时写入生成的数据，重启后直接读取"""
+    return open_store()
 
-# 水果类型与对应常见病虫害及经济价值
-fruit_diseases = {
-    "桃": ["褐腐病", "蚜虫", "桃小食心虫"],
-    "苹果": ["炭疽病", "红蜘蛛", "白粉病"],
-    "葡萄": ["霜霉病", "灰霉病", "透翅蛾"],
-    "梨": ["黑星病", "梨木虱", "蚜虫"]
-}
+store = get_store()
 
-# 水果经济价值（元/公斤）
-fruit_economic_value = {
-    "桃": 8.5,
-    "苹果": 6.2,
-    "葡萄": 12.8,
-    "梨": 5.6
-}
+# --------------------------
+# 数据视图缓存（以数据版本为键）
+# --------------------------
 
-# 解决方案数据库
-solution_db = {
-    "褐腐病": {
-        "症状": "果实出现褐色腐烂，表面有灰色霉层",
-        "防治经验": "1. 冬季清园，烧毁病果；2. 花期喷50%多菌灵500倍液；3. 果实成熟期套袋（鲁阳镇果农实测有效）",
-        "AI推荐方案": "基于历史数据分析，建议在3-4月花期前进行预防性施药，效果提升35%",
-        "防治成本": "中等（200-300元/亩）",
-        "效果评估": "85%有效率",
-        "投资回报率": "3.2:1",
-        "环保等级": "⭐️⭐️⭐️☆"
-    },
-    "蚜虫": {
-        "症状": "叶片卷曲，虫体聚集在叶背",
-        "防治经验": "1. 挂黄板诱杀；2. 释放天敌瓢虫；3. 蚜虫爆发期用10%吡虫啉2000倍液（下汤镇桃园推荐）",
-        "AI推荐方案": "智能监测+生物防治组合，减少化学农药使用40%",
-        "防治成本": "低（100-150元/亩）",
-        "效果评估": "92%有效率",
-        "投资回报率": "4.5:1",
-        "环保等级": "⭐️⭐️⭐️⭐️"
-    },
-    "桃小食心虫": {
-        "症状": "果实表面有针孔，果肉内有虫道",
-        "防治经验": "1. 地面覆盖地膜阻止成虫出土；2. 性诱剂诱杀雄虫；3. 卵期喷20%氯虫苯甲酰胺（张官营镇经验）",
-        "AI推荐方案": "性信息素迷向技术+精准施药时机预测",
-        "防治成本": "中等偏高（300-400元/亩）",
-        "效果评估": "88%有效率",
-        "投资回报率": "2.8:1",
-        "环保等级": "⭐️⭐️⭐️⭐️☆"
-    },
-    "炭疽病": {
-        "症状": "果实出现褐色凹陷斑，有轮纹状小黑点",
-        "防治经验": "1. 及时摘除病果；2. 雨季前喷70%甲基托布津800倍液；3. 增施有机肥提高抗性（尧山镇苹果园）",
-        "AI推荐方案": "基于气象数据的预警系统，提前7天预警防控",
-        "防治成本": "中等（180-250元/亩）",
-        "效果评估": "90%有效率",
-        "投资回报率": "3.5:1",
-        "环保等级": "⭐️⭐️⭐️☆"
-    },
-    "霜霉病": {
-        "症状": "叶片背面有白色霉层，正面发黄",
-        "防治经验": "1. 合理修剪保证通风；2. 发病初期喷58%甲霜灵锰锌500倍液；3. 避免傍晚浇水（瓦屋镇葡萄园）",
-        "AI推荐方案": "微气候监测+精准施药，降低用药量30%",
-        "防治成本": "中等（220-280元/亩）",
-        "效果评估": "87%有效率",
-        "投资回报率": "3.0:1",
-        "环保等级": "⭐️⭐️⭐️⭐️"
-    },
-}
+VERSION_OPTIONS = ["基础版 (免费)", "专业版 (199元/月)", "企业版 (999元/月)"]
 
-@st.cache_data(ttl=3600)  # 缓存1小时
-def generate_simulated_data():
-    data = []
-    dates = [datetime(2024, 1, 1) + timedelta(days=30*i) for i in range(12)]
-    
-    for town, (lat, lon) in lushan_towns.items():
-        fruits = random.sample(list(fruit_diseases.keys()), k=random.randint(2, 3))
-        for fruit in fruits:
-            diseases = random.sample(fruit_diseases[fruit], k=random.randint(1, 2))
-            for disease in diseases:
-                for date in dates:
-                    base_freq = random.randint(1, 10)
-                    base_severity = random.randint(1, 5)
-                    
-                    seasonal_factor = 1 + 0.3 * np.sin(2 * np.pi * date.month / 12)
-                    freq = max(1, int(base_freq * seasonal_factor))
-                    severity = max(1, min(5, int(base_severity * seasonal_factor)))
-                    
-                    area_affected = random.uniform(0.1, 0.3)
-                    yield_loss = severity * 0.05 + random.uniform(0.05, 0.15)
-                    economic_loss = area_affected * yield_loss * fruit_economic_value[fruit] * 10000
-                    
-                    data.append({
-                        "日期": date,
-                        "月份": date.month,
-                        "乡镇": town,
-                        "纬度": lat + random.uniform(-0.03, 0.03),
-                        "经度": lon + random.uniform(-0.03, 0.03),
-                        "水果类型": fruit,
-                        "病虫害类型": disease,
-                        "月均发生频次": freq,
-                        "严重程度": severity,
-                        "经济损失(元)": economic_loss,
-                        "防治成本(元)": economic_loss * random.uniform(0.1, 0.3)
-                    })
-    return pd.DataFrame(data)
+# 页面中使用的分组聚合，由物化视图的立方体上卷得到
+MONTHLY_TREND_METRICS = {"月均发生频次": "mean", "严重程度": "mean", "经济损失(元)": "sum"}
+SEVERITY_LOSS_METRICS = {"严重程度": "mean", "经济损失(元)": "sum"}
+THREAT_METRICS = {"严重程度": "mean", "月均发生频次": "mean", "经济损失(元)": "sum", "防治成本(元)": "sum"}
+DEFAULT_SIMULATION_DRAWS = 5000
 
-# --------------------------
-# 新增：市场数据生成函数
-# --------------------------
+@st.cache_data(show_spinner=False)
+def available_months(data_version):
+    """数据中出现的月份"""
+    return store.distinct("observations", "月份")
 
-@st.cache_data(ttl=3600)
-def generate_market_data():
-    """生成模拟市场数据"""
-    # 生成过去12个月的数据
-    dates = [datetime(2024, 1, 1) + timedelta(days=30*i) for i in range(12)]
-    fruits = list(fruit_diseases.keys())
-    towns = list(lushan_towns.keys())
-    
-    market_data = []
-    
-    for date in dates:
-        for fruit in fruits:
-            # 基础价格（元/公斤）
-            base_price = fruit_economic_value[fruit]
-            
-            # 季节性价格波动
-            seasonal_factor = 1 + 0.4 * np.sin(2 * np.pi * date.month / 12)
-            current_price = base_price * seasonal_factor * random.uniform(0.9, 1.1)
-            
-            # 销量（吨）
-            base_sales = random.randint(50, 200)
-            sales = base_sales * seasonal_factor * random.uniform(0.8, 1.2)
-            
-            # 产量（吨）
-            base_yield = random.randint(100, 500)
-            yield_amount = base_yield * random.uniform(0.7, 1.3)
-            
-            # 市场需求指数
-            demand_index = random.uniform(0.5, 1.5)
-            
-            # 库存水平
-            inventory_level = random.uniform(0.2, 0.8)
-            
-            market_data.append({
-                "日期": date,
-                "月份": date.month,
-                "水果类型": fruit,
-                "价格(元/公斤)": round(current_price, 2),
-                "销量(吨)": round(sales, 2),
-                "产量(吨)": round(yield_amount, 2),
-                "市场需求指数": round(demand_index, 2),
-                "库存水平": round(inventory_level, 2)
-            })
-    
-    return pd.DataFrame(market_data)
+def tier_options(version, data_version):
+    """各版本的筛选范围：(最多乡镇数, 最多水果数, 最多病虫害数, 可选月份)"""
+    if "基础版" in version:
+        return 3, 2, 2, [3, 4, 5, 6]  # 只显示春季月份
+    elif "专业版" in version:
+        return 6, 3, 3, available_months(data_version)
+    else:  # 企业版
+        return len(lushan_towns), len(fruit_diseases), len(solution_db), available_months(data_version)
 
-@st.cache_data(ttl=3600)
-def generate_regional_market_data():
-    """生成区域市场数据"""
-    fruits = list(fruit_diseases.keys())
-    towns = list(lushan_towns.keys())
-    
-    regional_data = []
-    
-    for town in towns:
-        for fruit in fruits:
-            # 区域产量（吨）
-            yield_amount = random.randint(50, 300)
-            
-            # 区域品质等级（1-5星）
-            quality_grade = random.randint(3, 5)
-            
-            # 区域市场份额
-            market_share = random.uniform(0.05, 0.25)
-            
-            # 运输成本（元/公斤）
-            transport_cost = random.uniform(0.5, 2.0)
-            
-            regional_data.append({
-                "乡镇": town,
-                "水果类型": fruit,
-                "区域产量(吨)": yield_amount,
-                "品质等级": quality_grade,
-                "市场份额": round(market_share, 3),
-                "运输成本(元/公斤)": round(transport_cost, 2)
-            })
-    
-    return pd.DataFrame(regional_data)
+def tier_scope(version, data_version):
+    """各版本的可见数据范围：{维度列: 允许值}；企业版不限"""
+    if "企业版" in version:
+        return {}
+    max_towns, max_fruits, _, months_options = tier_options(version, data_version)
+    fruits = list(fruit_diseases.keys())[:max_fruits]
+    return {
+        "月份": months_options,
+        "乡镇": list(lushan_towns.keys())[:max_towns],
+        "水果类型": fruits,
+        "病虫害类型": diseases_for(fruits, len(solution_db)),
+    }
+
+def diseases_for(fruits, max_diseases):
+    """所选水果对应的病虫害（保持注册表顺序，保证各进程默认选项一致）"""
+    available_diseases = []
+    for fruit in fruits:
+        available_diseases.extend(fruit_diseases.get(fruit, []))
+    return list(dict.fromkeys(available_diseases))[:max_diseases]
+
+def default_filters(version, data_version):
+    """各版本侧边栏的默认筛选条件：(月份, 乡镇, 水果类型, 病虫害类型)"""
+    max_towns, max_fruits, max_diseases, months_options = tier_options(version, data_version)
+    fruits = list(fruit_diseases.keys())[:max_fruits][:1]
+    return (
+        months_options[:2],
+        list(lushan_towns.keys())[:max_towns][:2],
+        fruits,
+        diseases_for(fruits, max_diseases)[:1],
+    )
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def materialize_views(data_version, months, towns, fruits, diseases):
+    """按筛选条件计算一次完整结果（明细与汇总立方体），各版本共享；数据版本不变时缓存一直有效"""
+    return materialize(
+        store.query_observations(months, towns, fruits, diseases),
+        store.query_market(months, fruits),
+        store.query_regional_market(towns, fruits),
+    )
 
-# 生成数据
-df = generate_simulated_data()
-market_df = generate_market_data()
-regional_market_df = generate_regional_market_data()
+def tier_views(data_version, version, filters):
+    """
+    某个版本可见的视图：从完整结果按版本范围投影，不再查询存储
+
+    返回:
+        (裁剪后的筛选条件, 视图)；筛选条件已在版本范围内时直接复用完整结果
+    """
+    views = materialize_views(data_version, *filters)
+    clipped = clip_filters(filters, tier_scope(version, data_version))
+    if clipped == tuple(filters):
+        return clipped, views
+    return clipped, project(views, clipped, filters)
+
+# 页面缓存键：只包含观测、市场与区域市场表的版本，传感器读数写入不会使页面缓存失效
+data_version = store.version()
 
 # --------------------------
 # 版本选择侧边栏
@@ -238,7 +141,7 @@ regional_market_df = generate_regional_market_data()
 st.sidebar.markdown("## 🌱 智慧植保平台")
 version = st.sidebar.selectbox(
     "选择版本",
-    ["基础版 (免费)", "专业版 (199元/月)", "企业版 (999元/月)"],
+    VERSION_OPTIONS,
     index=0
 )
 
@@ -246,82 +149,119 @@ st.sidebar.markdown("---")
 st.sidebar.markdown("### 📊 数据筛选")
 
 # 根据版本限制筛选选项
-if "基础版" in version:
-    max_towns = 3
-    max_fruits = 2
-    max_diseases = 2
-    months_options = [3, 4, 5, 6]  # 只显示春季月份
-elif "专业版" in version:
-    max_towns = 6
-    max_fruits = 3
-    max_diseases = 3
-    months_options = sorted(df["月份"].unique())
-else:  # 企业版
-    max_towns = len(lushan_towns)
-    max_fruits = len(fruit_diseases)
-    max_diseases = len(solution_db)
-    months_options = sorted(df["月份"].unique())
+max_towns, max_fruits, max_diseases, months_options = tier_options(version, data_version)
+
+# 批量应用模式：筛选控件放入表单，修改不会立即重跑，点击「应用筛选」后统一生效
+filter_form_mode = st.sidebar.toggle(
+    "批量应用筛选",
+    value=False,
+    help="开启后修改筛选条件不会立即刷新页面，点击「应用筛选」后一次性生效"
+)
+filter_container = st.sidebar.form("filter_form") if filter_form_mode else st.sidebar
 
 # 筛选条件
-selected_months = st.sidebar.multiselect(
+selected_months = filter_container.multiselect(
     "选择月份",
     options=months_options,
     default=months_options[:2] if months_options else []
 )
 
 available_towns = list(lushan_towns.keys())[:max_towns]
-selected_towns = st.sidebar.multiselect(
+selected_towns = filter_container.multiselect(
     "选择乡镇",
     options=available_towns,
     default=available_towns[:2] if available_towns else []
 )
 
 available_fruits = list(fruit_diseases.keys())[:max_fruits]
-selected_fruits = st.sidebar.multiselect(
+selected_fruits = filter_container.multiselect(
     "选择水果类型",
     options=available_fruits,
     default=available_fruits[:1] if available_fruits else []
 )
 
 # 根据选择的水果类型确定可选的病虫害
-available_diseases = []
-for fruit in selected_fruits:
-    available_diseases.extend(fruit_diseases.get(fruit, []))
-available_diseases = list(set(available_diseases))[:max_diseases]
-
-selected_diseases = st.sidebar.multiselect(
-    "选择病虫害类型",
-    options=available_diseases,
-    default=available_diseases[:1] if available_diseases else []
-)
+available_diseases = diseases_for(selected_fruits, max_diseases)
+if filter_form_mode:
+    # 表单提交前所选水果不会更新，病虫害选项取版本内全部水果，提交后再按所选水果过滤
+    form_diseases = diseases_for(available_fruits, len(solution_db))
+    selected_diseases = filter_container.multiselect(
+        "选择病虫害类型",
+        options=form_diseases,
+        default=available_diseases[:1] if available_diseases else []
+    )
+    filter_container.form_submit_button("应用筛选", use_container_width=True)
+    selected_diseases = [d for d in selected_diseases if d in available_diseases]
+else:
+    selected_diseases = filter_container.multiselect(
+        "选择病虫害类型",
+        options=available_diseases,
+        default=available_diseases[:1] if available_diseases else []
+    )
 
-# 根据筛选条件过滤数据
-filtered_df = df[
-    (df["月份"].isin(selected_months)) &
-    (df["乡镇"].isin(selected_towns)) &
-    (df["水果类型"].isin(selected_fruits)) &
-    (df["病虫害类型"].isin(selected_diseases))
-]
-
-# 过滤市场数据
-filtered_market_df = market_df[
-    (market_df["月份"].isin(selected_months)) &
-    (market_df["水果类型"].isin(selected_fruits))
-]
-
-filtered_regional_market_df = regional_market_df[
-    (regional_market_df["乡镇"].isin(selected_towns)) &
-    (regional_market_df["水果类型"].isin(selected_fruits))
-]
+# 根据筛选条件过滤数据（在数据库中按索引筛选，结果按数据版本缓存）
+selected_filters, tiered_views = tier_views(
+    data_version, version, (selected_months, selected_towns, selected_fruits, selected_diseases)
+)
+filtered_df = tiered_views["observations"]
+filtered_market_df = tiered_views["market"]
+filtered_regional_market_df = tiered_views["regional"]
 
 # --------------------------
 # 通用函数
 # --------------------------
 
-def create_basic_map(filtered_df):
-    """创建基础地图"""
+def aggregate_filtered(group_by, metrics):
+    """按当前筛选条件分组聚合（由物化视图的立方体上卷）"""
+    return rollup(tiered_views["cube"], group_by, metrics)
+
+# 地图弹窗模式：lazy 时标记只携带编号，点击后才渲染详情；eager 时每个标记内嵌完整弹窗 HTML
+MAP_POPUP_MODE = os.environ.get("SPP_MAP_POPUPS", "lazy")
+MARKER_ID_PREFIX = " #"
+
+@st.cache_resource(show_spinner=False)
+def offline_basemap(mbtiles_path, port):
+    """
+    配置了 SPP_MBTILES_PATH 时在后台启动瓦片服务（每个进程一次），返回离线底图参数
+
+    同时把地图脚本与样式改为瓦片服务提供的本地副本（python tiles.py assets 下载）；
+    端口被占用且占用者不是瓦片服务时记录警告并返回 None（使用在线底图）
+    """
+    if not mbtiles_path or not os.path.exists(mbtiles_path):
+        return None
+    metadata = MBTiles(mbtiles_path, readonly=True).metadata()
+    try:
+        start_background_server(mbtiles_path, DEFAULT_TILE_HOST, port)
+    except OSError as exc:
+        # 端口已被占用：可能是其他进程（如 python tiles.py serve）已提供瓦片服务，先确认
+        served = probe_server(DEFAULT_TILE_HOST, port)
+        if served is None:
+            logger.warning("瓦片服务端口 %s 被其他程序占用（%s），改用在线底图", port, exc)
+            return None
+        if served != metadata:
+            logger.warning("端口 %s 上的瓦片服务提供的不是 %s，底图可能与预期不一致", port, mbtiles_path)
+    host = browser_host(DEFAULT_TILE_HOST, st.get_option("browser.serverAddress"))
+    if not DEFAULT_TILE_URL and host in LOOPBACK_HOSTS:
+        logger.warning("离线底图地址指向本机（%s），其他机器上的浏览器无法加载；"
+                       "远程访问时设置 SPP_TILE_HOST 与 SPP_TILE_URL", host)
+    remote = localize_assets(server_url(host, port))
+    if remote:
+        logger.warning("地图脚本与样式 %s 没有本地副本，仍从外网加载（运行 python tiles.py assets 下载）",
+                       "、".join(remote))
+    options = {"tiles": tile_url(port, metadata.get("format", "png"), host),
+               "attr": metadata.get("attribution", DEFAULT_ATTRIBUTION)}
+    if "maxzoom" in metadata:
+        options["max_zoom"] = int(metadata["maxzoom"])
+    return options
+
+def basemap_options():
+    """folium.Map 的底图参数：优先本地 MBTiles 离线底图，否则使用在线 CartoDB 底图"""
+    return offline_basemap(DEFAULT_MBTILES_PATH, DEFAULT_TILE_PORT) or {"tiles": "CartoDB positron"}
+
+def create_basic_map(filtered_df, lazy_popups=False):
+    """创建基础地图；lazy_popups=True 时标记只带 "乡镇·病虫害 #编号" 提示，不内嵌弹窗"""
     lushan_center = (33.64, 112.81)
-    m = folium.Map(location=lushan_center, zoom_start=10, tiles="CartoDB positron")
+    m = folium.Map(location=lushan_center, zoom_start=10, **basemap_options())
     
     disease_colors = {
         "褐腐病": "red", "蚜虫": "green", "桃小食心虫": "purple",
@@ -333,15 +273,14 @@ def create_basic_map(filtered_df):
     marker_cluster = MarkerCluster().add_to(m)
     for idx, row in filtered_df.iterrows():
         disease = row["病虫害类型"]
-        solution = solution_db.get(disease, {
-            "症状": "暂无数据", 
-            "防治经验": "暂无本地经验",
-            "AI推荐方案": "数据收集中",
-            "防治成本": "待评估",
-            "效果评估": "待评估",
-            "投资回报率": "待计算",
-            "环保等级": "待评估"
-        })
+        icon = folium.Icon(color=disease_colors.get(disease, "gray"), icon="leaf")
+        if lazy_popups:
+            Marker(
+                location=[row["纬度"], row["经度"]],
+                tooltip=f"{row['乡镇']}·{disease}{MARKER_ID_PREFIX}{idx}",
+                icon=icon
+            ).add_to(marker_cluster)
+            continue
         
         popup_content = f"""
         <div style="width: 250px;">
@@ -355,14 +294,14 @@ def create_basic_map(filtered_df):
         Marker(
             location=[row["纬度"], row["经度"]],
             popup=folium.Popup(popup_content, max_width=300),
-            icon=folium.Icon(color=disease_colors.get(disease, "gray"), icon="leaf")
+            icon=icon
         ).add_to(marker_cluster)
     
     return m
 
-def create_advanced_map(filtered_df):
+def create_advanced_map(filtered_df, lazy_popups=False):
     """创建高级地图（含热力图）"""
-    m = create_basic_map(filtered_df)
+    m = create_basic_map(filtered_df, lazy_popups)
     
     # 添加热力图
     heat_data = [[row["纬度"], row["经度"], row["严重程度"]] for idx, row in filtered_df.iterrows()]
@@ -371,6 +310,254 @@ def create_advanced_map(filtered_df):
     
     return m
 
+WEATHER_PATH = os.environ.get("SPP_WEATHER_PATH", "")
+
+@st.cache_data(show_spinner="正在计算气象风险...")
+def load_weather_risk(weather_path, weather_mtime):
+    """逐日病虫害气象风险面（按气象文件路径与修改时间缓存）"""
+    if weather_path:
+        dates, towns, fields = load_weather(weather_path, lushan_towns)
+    else:
+        dates, towns, fields = generate_weather(lushan_towns)
+    return compute_risk(dates, towns, fields)
+
+def weather_risk():
+    """读取本地气象文件（SPP_WEATHER_PATH）计算风险；未配置时使用模拟气象数据"""
+    mtime = os.path.getmtime(WEATHER_PATH) if WEATHER_PATH else None
+    return load_weather_risk(WEATHER_PATH, mtime)
+
+def create_risk_map(day_risk):
+    """创建单日风险地图：各乡镇按所选病虫害中的最高风险着色"""
+    m = folium.Map(location=(33.64, 112.81), zoom_start=10, **basemap_options())
+    colors = {"高": "red", "中": "orange", "低": "green"}
+    for town, town_risk in day_risk.groupby("乡镇", observed=True):
+        top = town_risk.sort_values("风险指数", ascending=False)
+        worst = top.iloc[0]
+        details = "<br>".join(
+            f"{row['病虫害类型']}: {row['风险指数']:.2f}（{row['风险等级']}）" for _, row in top.iterrows()
+        )
+        folium.CircleMarker(
+            location=lushan_towns[town],
+            radius=8 + 22 * float(worst["风险指数"]),
+            color=colors[worst["风险等级"]],
+            fill=True,
+            fill_opacity=0.6,
+            tooltip=f"{town} · 积温 {worst['有效积温(℃·日)']:.0f}℃·日",
+            popup=folium.Popup(f"<b>{town}</b><br>{details}", max_width=250),
+        ).add_to(m)
+    return m
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def cached_map(data_version, kind, months, towns, fruits, diseases, lazy_popups=False):
+    """按数据版本与筛选条件缓存地图对象（kind 为 basic 或 advanced）"""
+    filtered = materialize_views(data_version, months, towns, fruits, diseases)["observations"]
+    create = create_basic_map if kind == "basic" else create_advanced_map
+    return create(filtered, lazy_popups)
+
+@st.cache_resource
+def map_render_lock():
+    """缓存的地图对象由各会话共享，st_folium 渲染时会修改地图对象，需串行渲染"""
+    return threading.Lock()
+
+def map_payload_bytes(m):
+    """地图经 st_folium 发送到浏览器的 Leaflet 脚本字节数"""
+    with map_render_lock():
+        return len(generate_leaflet_string(m).encode("utf-8"))
+
+@st.cache_data(show_spinner=False)
+def map_payload_report(data_version, months, towns, fruits, diseases):
+    """当前筛选条件下内嵌弹窗与按需弹窗两种模式的地图载荷对比"""
+    rows = []
+    for kind, label in [("basic", "基础地图"), ("advanced", "高级地图")]:
+        eager = map_payload_bytes(cached_map(data_version, kind, months, towns, fruits, diseases, False))
+        lazy = map_payload_bytes(cached_map(data_version, kind, months, towns, fruits, diseases, True))
+        rows.append({"地图": label, "内嵌弹窗(KB)": eager / 1024, "按需弹窗(KB)": lazy / 1024,
+                     "减少(%)": (1 - lazy / eager) * 100 if eager else 0.0})
+    return pd.DataFrame(rows)
+
+def display_marker_details(kind, marker_id):
+    """按需渲染被点击标记的详情（高级地图附带防治方案）"""
+    observations = materialize_views(data_version, *selected_filters)["observations"]
+    if marker_id not in observations.index:
+        return
+    row = observations.loc[marker_id]
+    disease = row["病虫害类型"]
+    st.markdown(
+        f"**📍 {row['乡镇']} - {disease}** · {row['水果类型']} · "
+        f"严重程度 {'★' * int(row['严重程度'])} · 月均频次 {row['月均发生频次']}次"
+    )
+    solution = solution_db.get(disease)
+    if kind == "advanced" and solution:
+        st.markdown(f"""
+        - **症状**: {solution['症状']}
+        - **本地经验**: {solution['防治经验']}
+        - **AI推荐**: {solution['AI推荐方案']}
+        - **防治成本**: {solution['防治成本']} · **效果**: {solution['效果评估']} · **投资回报率**: {solution['投资回报率']}
+        """)
+
+@st.fragment
+def show_cached_map(kind, width, height):
+    """显示当前筛选条件下的缓存地图；按需弹窗模式下点击标记只重跑本片段并渲染详情"""
+    lazy = MAP_POPUP_MODE == "lazy"
+    m = cached_map(data_version, kind, *selected_filters, lazy)
+    with map_render_lock():
+        result = st_folium(
+            m, width=width, height=height, key=f"map_{kind}",
+            returned_objects=["last_object_clicked_tooltip"] if lazy else []
+        )
+    if not lazy:
+        return
+    clicked = (result or {}).get("last_object_clicked_tooltip")
+    if clicked and MARKER_ID_PREFIX in clicked:
+        display_marker_details(kind, int(clicked.rsplit(MARKER_ID_PREFIX, 1)[1]))
+    else:
+        st.caption("点击地图标记查看详情")
+
+@st.cache_data(show_spinner="正在运行蒙特卡洛情景模拟...")
+def simulate_control_scenarios(filtered_df, n_draws):
+    """蒙特卡洛模拟防治情景（筛选条件不变时直接复用缓存结果）"""
+    cells = build_scenario_table(filtered_df, solution_db, fruit_economic_value)
+    return run_monte_carlo(cells, n_draws=n_draws)
+
+@st.cache_data(show_spinner=False)
+def optimize_budget(filtered_df, budget):
+    """在预算内为各乡镇病虫害选择防治方案，使挽回损失最大"""
+    cells, options = build_options(filtered_df, solution_db)
+    return optimize_allocation(cells, options, budget)
+
+@st.cache_data(show_spinner="正在求解产销调运方案...")
+def optimize_distribution(regional_df, market_df, markets):
+    """在乡镇产量与市场需求约束下求解运输成本最优的调运方案"""
+    supply, markets, arcs = build_arcs(regional_df, market_df, markets, lushan_towns)
+    return solve_distribution(supply, markets, arcs)
+
+@st.cache_data(show_spinner=False)
+def table_memory_report(data_version):
+    """各数据表默认类型与紧凑类型的内存占用对比"""
+    tables = ["observations", "market_prices", "regional_market"]
+    return memory_report({table: store.load_table(table) for table in tables})
+
+@st.cache_data(show_spinner=False)
+def batch_results(data_version, latest_mtime):
+    """读取与当前数据版本一致的最近一次批处理结果（latest.json 更新后自动重新读取）"""
+    return load_latest(DEFAULT_BATCH_DIR, data_version)
+
+# 市场图表所用的月度聚合口径
+MARKET_TREND_METRICS = {
+    "价格(元/公斤)": "mean",
+    "销量(吨)": "sum",
+    "产量(吨)": "sum",
+    "市场需求指数": "mean",
+    "库存水平": "mean",
+}
+
+# 市场异常检测参数：前后各三个月为参照窗口，窗口尺度不低于该序列整体稳健尺度，避免短窗口 MAD 过小
+ANOMALY_WINDOW = 7
+ANOMALY_MIN_PERIODS = 4
+ANOMALY_SCALE_FLOOR = 1.0
+
+@st.cache_data(show_spinner=False)
+def market_anomalies(data_version):
+    """
+    全部历史上各水果逐月价格、销量等指标的稳健 z 分数异常检测（每个数据版本只计算一次）
+
+    检测在完整的逐月序列上进行，不受页面月份筛选影响：未选中的月份仍作为相邻月份的参照
+    """
+    market = store.load_table("market_prices")
+    year_month = market["日期"].dt.to_period("M").rename("年月")
+    monthly = market.groupby([year_month, "水果类型"], observed=True).agg(MARKET_TREND_METRICS).reset_index()
+    anomalies = detect_anomalies(monthly, "年月", ["水果类型"], list(MARKET_TREND_METRICS),
+                                 window=ANOMALY_WINDOW, min_periods=ANOMALY_MIN_PERIODS, center=True,
+                                 scale_floor=ANOMALY_SCALE_FLOOR)
+    if not anomalies.empty:
+        anomalies.insert(1, "月份", anomalies["年月"].dt.month)
+    return anomalies
+
+def visible_anomalies():
+    """当前筛选条件（已按版本范围裁剪）中的月份与水果的异常检测结果"""
+    anomalies = market_anomalies(data_version)
+    if anomalies.empty:
+        return anomalies
+    months, _, fruits, _ = selected_filters
+    return anomalies[anomalies["月份"].isin(months) & anomalies["水果类型"].isin(fruits)]
+
+def annotate_anomalies(fig, anomalies, metrics):
+    """在趋势图上用红色叉号标注异常点"""
+    flagged = anomalies[anomalies["是否异常"] & anomalies["指标"].isin(metrics)]
+    if flagged.empty:
+        return fig
+    fig.add_trace(go.Scatter(
+        x=flagged["月份"], y=flagged["实际值"], mode="markers", name="异常波动",
+        marker=dict(symbol="x", size=12, color="red", line=dict(width=2)),
+        customdata=flagged[["水果类型", "指标", "异常方向", "基准值", "稳健z分数"]],
+        hovertemplate="%{customdata[0]} %{customdata[1]}<br>%{x}月 %{customdata[2]}: %{y:.2f}"
+                      "（基准 %{customdata[3]:.2f}，z=%{customdata[4]:.1f}）<extra></extra>",
+    ))
+    return fig
+
+@st.cache_data(show_spinner=False)
+def market_impact_tables(data_version):
+    """全县价格系数与病虫害压力-市场指标滞后相关（每个数据版本只计算一次）"""
+    return market_impact(store.load_table("observations"), store.load_table("market_prices"), fruit_economic_value)
+
+def market_adjusted_filtered(group_by):
+    """当前筛选条件下按市场价格调整的经济损失（立方体上卷后乘以价格系数，无需扫描明细）"""
+    factors, _ = market_impact_tables(data_version)
+    return market_adjusted_losses(tiered_views["cube"], factors, group_by)
+
+def display_market_anomaly_alerts(anomalies):
+    """市场异常波动预警列表"""
+    st.subheader("🚨 市场异常波动预警")
+    alerts = anomaly_alerts(anomalies)
+    if alerts.empty:
+        st.success("未发现价格或销量的异常波动")
+        return
+    st.warning(f"发现 {len(alerts)} 处异常波动（稳健z分数绝对值超过 {DEFAULT_THRESHOLD}）")
+    st.dataframe(
+        alerts[["月份", "水果类型", "指标", "异常方向", "实际值", "基准值", "偏离幅度(%)", "稳健z分数"]].round(2),
+        use_container_width=True, hide_index=True
+    )
+
+def latest_batch_results():
+    latest_path = os.path.join(DEFAULT_BATCH_DIR, "latest.json")
+    latest_mtime = os.path.getmtime(latest_path) if os.path.exists(latest_path) else 0
+    return batch_results(data_version, latest_mtime)
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def open_snapshot_store(snapshot_source_version):
+    """历史快照存储；观测或市场表版本变化时提交当前数据的新版本（由预热线程提前完成）"""
+    return open_snapshots(store)
+
+def get_snapshots():
+    """当前数据对应的历史快照存储；传感器读数与区域市场表的变化不会触发重新提交"""
+    return open_snapshot_store(store.version(SNAPSHOT_TABLES))
+
+YOY_METRICS = {"经济损失(元)": "sum", "防治成本(元)": "sum", "严重程度": "mean", "月均发生频次": "mean"}
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def season_comparison(snapshot_version, season, baseline, as_of, months, towns, fruits, diseases):
+    """两个年度在相同筛选条件下的同比汇总与逐月对比"""
+    snapshots = get_snapshots()
+    filters = dict(zip(CUBE_KEYS, (months, towns, fruits, diseases)))
+    totals = snapshots.year_over_year("observations", [], YOY_METRICS, season, baseline, as_of, filters)
+    monthly = snapshots.aggregate("observations", ["月份"], YOY_METRICS, [baseline, season], as_of, filters)
+    return totals, monthly
+
+@st.cache_resource
+def sketch_accumulator():
+    """全县观测的增量草图（各会话共享，新版本只合并新增的观测行）"""
+    return SketchAccumulator(), threading.Lock()
+
+@st.cache_data(show_spinner=False)
+def cube_sketches(data_version):
+    """全县每个立方体单元的分位数草图（每个数据版本只合并一次新增行，筛选时按单元合并）"""
+    accumulator, lock = sketch_accumulator()
+    with lock:
+        return accumulator.update(lambda offset: store.load_rows("observations", offset))
+
+def filtered_sketches():
+    return select(cube_sketches(data_version), dict(zip(CUBE_KEYS, selected_filters)))
+
 def display_kpi_metrics(filtered_df, version_level):
     """显示KPI指标"""
     if not filtered_df.empty:
@@ -453,6 +640,489 @@ def display_market_kpi_metrics(filtered_market_df):
                 delta="旺盛" if avg_demand > 1.2 else "平稳" if avg_demand > 0.8 else "疲软"
             )
 
+# --------------------------
+# 缓存预热
+# --------------------------
+
+WARMUP_POLL_SECONDS = 30
+
+def warm_caches(data_version):
+    """预先计算各版本默认筛选条件下的物化视图、地图、情景模拟与市场分析，以及全县级的草图与联动分析"""
+    for version_option in VERSION_OPTIONS:
+        filters = default_filters(version_option, data_version)
+        clipped, views = tier_views(data_version, version_option, filters)
+        filtered = views["observations"]
+        if filtered.empty:
+            continue
+        # 与 show_cached_map 相同的缓存键，页面首次渲染直接命中
+        lazy = MAP_POPUP_MODE == "lazy"
+        cached_map(data_version, "basic" if "基础版" in version_option else "advanced", *clipped, lazy)
+        if "企业版" in version_option:
+            simulate_control_scenarios(filtered, DEFAULT_SIMULATION_DRAWS)
+            map_payload_report(data_version, *clipped)
+    table_memory_report(data_version)
+    cube_sketches(data_version)
+    market_impact_tables(data_version)
+    market_anomalies(data_version)
+    get_snapshots()
+    weather_risk()
+
+def _warm_on_version_change(warmed_version):
+    """后台线程：数据版本变化后立即重新预热，使用户请求不落在冷缓存上；预热出错时记录日志并在下一轮重试"""
+    while True:
+        time.sleep(WARMUP_POLL_SECONDS)
+        try:
+            current_version = store.version()
+            if current_version != warmed_version:
+                warm_caches(current_version)
+                warmed_version = current_version
+        except Exception:
+            logger.exception("缓存预热失败，%d 秒后重试", WARMUP_POLL_SECONDS)
+
+@st.cache_resource
+def start_cache_warmer():
+    """进程启动时同步预热一次，并启动后台预热线程（每个进程只执行一次）"""
+    warmed_version = store.version()
+    try:
+        warm_caches(warmed_version)
+    except Exception:
+        # 预热失败不影响页面：用户请求按需计算，后台线程下一轮重试
+        logger.exception("启动时缓存预热失败")
+        warmed_version = None
+    thread = threading.Thread(
+        target=_warm_on_version_change, args=(warmed_version,), daemon=True, name="cache-warmer"
+    )
+    thread.start()
+    return thread
+
+start_cache_warmer()
+
+# --------------------------
+# 局部重跑片段
+# --------------------------
+# 片段内的控件交互只重跑所在片段，不会重新执行筛选、地图与其他图表
+
+@st.fragment
+def disease_action_buttons(disease):
+    """病虫害行动建议按钮（点击只重跑本片段）"""
+    col_a, col_b, col_c = st.columns(3)
+    with col_a:
+        if st.button(f"📞 紧急专家会诊", key=f"expert_{disease}"):
+            st.success(f"已启动{disease}紧急专家会诊流程!")
+    with col_b:
+        if st.button(f"🛒 批量采购物资", key=f"bulk_{disease}"):
+            st.info(f"跳转到{disease}防治物资批量采购页面")
+    with col_c:
+        if st.button(f"📋 生成防治方案", key=f"plan_{disease}"):
+            st.info(f"生成{disease}定制化综合防治方案")
+
+@st.fragment
+def scenario_simulation_section():
+    """防治情景模拟（调整模拟次数只重跑本片段）"""
+    n_draws = st.select_slider("模拟次数", options=[1000, 2000, 5000, 10000, 20000], value=DEFAULT_SIMULATION_DRAWS)
+    simulation = simulate_control_scenarios(filtered_df, n_draws)
+    summary = simulation["summary"]
+    
+    if summary:
+        confidence = f"{summary['置信水平']*100:.0f}%"
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            low, mid, high = summary["未防治损失"]
+            st.metric("未防治损失(中位数)", f"¥{mid:,.0f}", f"{confidence}区间 ¥{low:,.0f}~¥{high:,.0f}", delta_color="off")
+        with col2:
+            low, mid, high = summary["防治后损失"]
+            st.metric("防治后损失(中位数)", f"¥{mid:,.0f}", f"{confidence}区间 ¥{low:,.0f}~¥{high:,.0f}", delta_color="off")
+        with col3:
+            low, mid, high = summary["投资回报率"]
+            st.metric("投资回报率(中位数)", f"{mid:.1f}:1", f"{confidence}区间 {low:.1f}~{high:.1f}", delta_color="off")
+        with col4:
+            st.metric("防治盈利概率", f"{summary['盈利概率']*100:.1f}%", f"{summary['模拟次数']:,}次模拟", delta_color="off")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            loss_dist = simulation["county"].melt(
+                value_vars=["未防治损失", "防治后损失"], var_name="情景", value_name="经济损失(元)"
+            )
+            fig = px.histogram(loss_dist, x="经济损失(元)", color="情景", barmode="overlay",
+                               nbins=60, title="全县经济损失分布")
+            st.plotly_chart(fig, use_container_width=True)
+        with col2:
+            fig = px.histogram(simulation["county"], x="投资回报率", nbins=60,
+                               title="全县防治投资回报率分布")
+            st.plotly_chart(fig, use_container_width=True)
+        
+        st.markdown(f"**各乡镇病虫害模拟结果（{confidence}置信区间）**")
+        st.dataframe(simulation["cells"].round(2), use_container_width=True)
+
+@st.fragment
+def budget_allocation_section():
+    """防治预算优化分配（调整预算只重跑本片段）"""
+    standard_cost = float(filtered_df["防治成本(元)"].sum())
+    budget = st.number_input(
+        "防治预算(元)", min_value=0.0, value=float(round(standard_cost * 0.5, -2)), step=1000.0
+    )
+    allocation, plan = optimize_budget(filtered_df, budget)
+    st.caption(
+        "方案成本按方案库防治成本区间的下限/中值/上限单价（元/亩）计算，防治面积由观测防治成本按中值单价折算；"
+        "方案库只给出标准方案的有效率，经济防治按其 60%、强化防治按再消除一半剩余损失估算。"
+    )
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("已用预算", f"¥{plan['已用预算']:,.0f}", f"预算 ¥{plan['预算']:,.0f}", delta_color="off")
+    with col2:
+        st.metric("可挽回损失", f"¥{plan['挽回损失']:,.0f}", f"理论上界 ¥{plan['上界']:,.0f}", delta_color="off")
+    with col3:
+        budget_roi = plan["挽回损失"] / plan["已用预算"] if plan["已用预算"] > 0 else 0
+        st.metric("预算回报率", f"{budget_roi:.1f}:1")
+    with col4:
+        st.metric("防治单元", f"{plan['防治单元数']}/{len(allocation)}", "乡镇×病虫害", delta_color="off")
+    
+    treated = allocation[allocation["方案"] != NO_TREATMENT]
+    if not treated.empty:
+        fig = px.bar(treated, x="乡镇", y="投入成本", color="病虫害类型",
+                     hover_data=["方案", "挽回损失"], title="各乡镇防治预算分配")
+        st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(
+        allocation.sort_values("挽回损失", ascending=False).round(0),
+        use_container_width=True
+    )
+
+WORKBOOK_POLL_SECONDS = 1.0
+
+@st.fragment(run_every=WORKBOOK_POLL_SECONDS)
+def workbook_export_progress():
+    """生成中的工作簿进度（只在任务未完成时渲染，定时重跑只读取任务进度）；完成后整页重跑一次，停止轮询"""
+    job = st.session_state.get("workbook_job")
+    if job is None or job["future"].done():
+        st.rerun()
+    done, total = job["progress"]
+    st.progress(done / total if total else 0.0, text=f"正在后台生成 Excel 工作簿... 明细 {done:,}/{total:,} 行")
+
+def workbook_export_status(export_key):
+    """后台生成的 Excel 工作簿状态：未完成时显示定时刷新的进度，完成后提供下载"""
+    job = st.session_state.get("workbook_job")
+    if job is None or job["key"] != export_key:
+        return
+    future = job["future"]
+    if not future.done():
+        workbook_export_progress()
+        return
+    if future.exception() is not None:
+        st.error(f"Excel 工作簿生成失败: {future.exception()}")
+        return
+    st.download_button(
+        label="下载Excel文件",
+        data=future.result(),
+        file_name=f"病虫害数据_{datetime.now().strftime('%Y%m%d')}.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+    st.caption("工作簿含按乡镇、病虫害、月份与市场的汇总表及原生图表，明细在最后的工作表中")
+
+@st.fragment
+def data_export_section():
+    """数据导出（选择格式、生成文件只重跑本片段）"""
+    export_format = st.selectbox("选择导出格式", ["CSV", "Excel", "JSON"])
+    export_key = (data_version, selected_filters)
+    
+    if st.button("生成导出文件"):
+        if export_format == "CSV":
+            csv = filtered_df.to_csv(index=False)
+            st.download_button(
+                label="下载CSV文件",
+                data=csv,
+                file_name=f"病虫害数据_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv"
+            )
+        elif export_format == "Excel":
+            job = st.session_state.get("workbook_job")
+            if job is None or job["key"] != export_key or (job["future"].done() and job["future"].exception()):
+                progress = [0, len(filtered_df)]
+                def report(done, total):
+                    progress[:] = [done, total]
+                st.session_state["workbook_job"] = {
+                    "key": export_key,
+                    "progress": progress,
+                    "future": submit_workbook(filtered_df, filtered_market_df, tiered_views["cube"], report),
+                }
+
+    if export_format == "Excel":
+        workbook_export_status(export_key)
+
+@st.fragment
+def api_key_section():
+    """API密钥生成按钮（点击只重跑本片段）"""
+    if st.button("生成API密钥"):
+        st.success("API密钥已生成: sk_ent_xxxxxxxxxxxxxxxx")
+
+@st.fragment
+def custom_report_section():
+    """定制报告（报告选项与生成按钮只重跑本片段）"""
+    report_type = st.selectbox("选择报告类型", 
+                             ["月度分析报告", "季度总结报告", "年度综合报告", "专项防治报告"])
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("**报告内容定制**")
+        include_trend = st.checkbox("包含趋势分析", value=True)
+        include_economic = st.checkbox("包含经济分析", value=True)
+        include_recommendations = st.checkbox("包含防治建议", value=True)
+        include_comparison = st.checkbox("包含区域对比", value=True)
+        include_market = st.checkbox("包含市场分析", value=True)
+    
+    with col2:
+        st.markdown("**报告格式设置**")
+        report_style = st.selectbox("报告风格", ["简洁版", "详细版", "学术版", "商业版"])
+        include_charts = st.checkbox("包含图表", value=True)
+        include_data = st.checkbox("包含原始数据", value=False)
+    
+    if st.button("🖨️ 生成定制报告"):
+        with st.spinner("正在生成定制报告..."):
+            # 模拟报告生成过程
+            progress_bar = st.progress(0)
+            for i in range(100):
+                progress_bar.progress(i + 1)
+            
+            st.success("✅ 定制报告生成完成！")
+            
+            # 模拟报告内容预览
+            st.markdown(f"""
+            ### 📋 {report_type} - 预览
+            
+            **报告摘要**:
+            - 分析时段: {selected_months}月
+            - 覆盖区域: {', '.join(selected_towns)}
+            - 主要作物: {', '.join(selected_fruits)}
+            - 重点关注病虫害: {', '.join(selected_diseases)}
+            
+            **核心发现**:
+            1. 预计总经济损失: ¥{filtered_df['经济损失(元)'].sum():,.0f}
+            2. 平均病虫害严重程度: {filtered_df['严重程度'].mean():.1f}/5.0
+            3. 防治投资回报率: {(filtered_df['经济损失(元)'].sum() / filtered_df['防治成本(元)'].sum()):.1f}:1
+            
+            **市场分析**:
+            - 平均市场价格: ¥{filtered_market_df['价格(元/公斤)'].mean():.2f}/公斤
+            - 总销量: {filtered_market_df['销量(吨)'].sum():.1f}吨
+            - 总产量: {filtered_market_df['产量(吨)'].sum():.1f}吨
+            
+            **主要建议**:
+            - 优先防治: {selected_diseases[0] if selected_diseases else 'N/A'}
+            - 重点区域: {selected_towns[0] if selected_towns else 'N/A'}
+            - 最佳防治时机: 建议在{min(selected_months) if selected_months else 'N/A'}月前完成防治准备
+            """)
+            
+            # 创建模拟PDF下载
+            report_content = f"""
+            {report_type}
+            生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            
+            报告摘要:
+            - 分析时段: {selected_months}月
+            - 覆盖区域: {', '.join(selected_towns)}
+            - 主要作物: {', '.join(selected_fruits)}
+            - 重点关注病虫害: {', '.join(selected_diseases)}
+            
+            核心发现:
+            1. 预计总经济损失: ¥{filtered_df['经济损失(元)'].sum():,.0f}
+            2. 平均病虫害严重程度: {filtered_df['严重程度'].mean():.1f}/5.0
+            3. 防治投资回报率: {(filtered_df['经济损失(元)'].sum() / filtered_df['防治成本(元)'].sum()):.1f}:1
+            
+            市场分析:
+            - 平均市场价格: ¥{filtered_market_df['价格(元/公斤)'].mean():.2f}/公斤
+            - 总销量: {filtered_market_df['销量(吨)'].sum():.1f}吨
+            - 总产量: {filtered_market_df['产量(吨)'].sum():.1f}吨
+            """
+            
+            b64 = base64.b64encode(report_content.encode()).decode()
+            st.download_button(
+                label="📥 下载完整报告 (PDF)",
+                data=f"data:application/pdf;base64,{b64}",
+                file_name=f"{report_type}_{datetime.now().strftime('%Y%m%d')}.pdf",
+                mime="application/pdf"
+            )
+
+@st.fragment
+def distribution_section():
+    """产销调运优化（编辑销地市场只重跑本片段）"""
+    st.caption("编辑销地市场的位置、各水果需求上限与价格溢价，按到货价格扣除运输成本后的净收益最大化调运")
+    markets = st.data_editor(DEFAULT_MARKETS, num_rows="dynamic", use_container_width=True,
+                             key="distribution_markets")
+    markets = markets.dropna(subset=["市场", "纬度", "经度", "需求上限(吨)", "价格溢价"])
+    if markets.empty:
+        st.warning("请至少保留一个销地市场")
+    else:
+        flows, dist_summary = optimize_distribution(
+            filtered_regional_market_df, filtered_market_df, markets
+        )
+        col_d1, col_d2, col_d3, col_d4 = st.columns(4)
+        with col_d1:
+            st.metric("调运量", f"{dist_summary['调运量(吨)']:,.0f}吨",
+                      f"总产量 {dist_summary['总产量(吨)']:,.0f}吨", delta_color="off")
+        with col_d2:
+            st.metric("销售收入", f"¥{dist_summary['销售收入(元)']:,.0f}")
+        with col_d3:
+            st.metric("运输成本", f"¥{dist_summary['运输成本(元)']:,.0f}")
+        with col_d4:
+            st.metric("净收益", f"¥{dist_summary['净收益(元)']:,.0f}")
+        
+        if flows.empty:
+            st.info("当前价格与运输成本下没有净收益为正的调运线路")
+        else:
+            by_market = flows.groupby(["市场", "水果类型"])["运量(吨)"].sum().reset_index()
+            fig_flow = px.bar(by_market, x="市场", y="运量(吨)", color="水果类型",
+                              title="各销地市场调入量")
+            st.plotly_chart(fig_flow, use_container_width=True)
+            st.dataframe(flows.style.format({
+                "运量(吨)": "{:,.1f}", "距离(公里)": "{:,.0f}", "单位运输成本(元/公斤)": "{:.2f}",
+                "到货价格(元/公斤)": "{:.2f}", "销售收入(元)": "¥{:,.0f}",
+                "运输成本(元)": "¥{:,.0f}", "净收益(元)": "¥{:,.0f}",
+            }), use_container_width=True)
+
+@st.fragment
+def year_over_year_section():
+    """历年同比分析（切换对比年度或回溯时间点只重跑本片段）"""
+    snapshots = get_snapshots()
+    col_a, col_b = st.columns(2)
+    with col_a:
+        time_travel = st.checkbox("按历史时间点回溯", value=False, key="yoy_time_travel")
+        as_of = None
+        if time_travel:
+            as_of_date = st.date_input("数据截至", value=datetime.now().date(), key="yoy_as_of")
+            as_of = datetime.combine(as_of_date, datetime.max.time()).isoformat(timespec="seconds")
+    seasons = snapshots.seasons("observations", as_of)
+    if len(seasons) < 2:
+        st.info("历史快照中暂无可对比的往年数据")
+        return
+    current = seasons[-1]
+    with col_b:
+        baseline = st.selectbox(f"{current}年对比年度", seasons[-2::-1], key="yoy_baseline")
+    simulated = [season for season in (baseline, current)
+                 if snapshots.entry("observations", season, as_of)["说明"] in SIMULATED_NOTES]
+    if simulated:
+        st.warning(f"{'、'.join(map(str, simulated))}年的历史快照为演示用模拟数据，不是实际观测")
+    
+    totals, monthly = season_comparison(
+        snapshots.version("observations"), current, baseline, as_of, *selected_filters
+    )
+    if totals.empty:
+        st.warning("所选条件下暂无往年数据")
+        return
+    row = totals.iloc[0]
+    
+    def yoy_delta(col):
+        change = row[f"{col}同比(%)"]
+        return f"{change:+.1f}% 同比" if pd.notna(change) else "无同期数据"
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("经济损失", f"¥{row['经济损失(元)(本期)']:,.0f}", yoy_delta("经济损失(元)"), delta_color="inverse")
+    with col2:
+        st.metric("防治成本", f"¥{row['防治成本(元)(本期)']:,.0f}", yoy_delta("防治成本(元)"), delta_color="inverse")
+    with col3:
+        st.metric("平均严重程度", f"{row['严重程度(本期)']:.2f}/5.0", yoy_delta("严重程度"), delta_color="inverse")
+    with col4:
+        st.metric("平均发生频次", f"{row['月均发生频次(本期)']:.1f}", yoy_delta("月均发生频次"), delta_color="inverse")
+    
+    monthly["年度"] = monthly["年度"].astype(str)
+    fig = px.line(monthly, x="月份", y="经济损失(元)", color="年度", markers=True,
+                  title=f"{current}年与{baseline}年经济损失月度对比")
+    st.plotly_chart(fig, use_container_width=True)
+
+@st.fragment
+def market_linkage_section():
+    """市场调整损失与病虫害压力滞后相关（切换市场指标只重跑本片段）"""
+    col1, col2 = st.columns(2)
+    with col1:
+        losses = market_adjusted_filtered(["水果类型"])
+        chart = losses.melt(id_vars="水果类型", value_vars=["经济损失(元)", ADJUSTED_LOSS_COLUMN],
+                            var_name="估算口径", value_name="损失(元)")
+        chart["估算口径"] = chart["估算口径"].replace({"经济损失(元)": "静态估值", ADJUSTED_LOSS_COLUMN: "当月市场价格"})
+        fig = px.bar(chart, x="水果类型", y="损失(元)", color="估算口径", barmode="group",
+                     title="静态估值与市场价格调整后的经济损失")
+        st.plotly_chart(fig, use_container_width=True)
+    with col2:
+        _, correlations = market_impact_tables(data_version)
+        indicator = st.selectbox("市场指标", list(MARKET_INDICATORS), key="linkage_indicator")
+        grid = correlations[correlations["市场指标"] == indicator].pivot(
+            index="水果类型", columns="滞后(月)", values="相关系数"
+        )
+        fig = px.imshow(grid, text_auto=".2f", zmin=-1, zmax=1, color_continuous_scale="RdBu_r",
+                        labels=dict(x="滞后月数", y="水果类型", color="相关系数"),
+                        title=f"病虫害压力与{indicator}的滞后相关（全县）")
+        st.plotly_chart(fig, use_container_width=True)
+    st.caption("病虫害压力指数 = 严重程度均值 × 月均发生频次均值；滞后 k 表示压力领先市场指标 k 个月")
+
+@st.fragment
+def percentile_section():
+    """损失与严重程度分位数（由草图合并得到；切换分组只重跑本片段）"""
+    sketches = filtered_sketches()
+    overall = quantiles(sketches, "经济损失(元)").iloc[0]
+    if overall["样本数"] == 0:
+        st.info("所选筛选条件下暂无观测记录，无法计算分位数")
+        return
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("单条记录损失 p50", f"¥{overall['p50']:,.0f}")
+    col2.metric("单条记录损失 p90", f"¥{overall['p90']:,.0f}")
+    col3.metric("单条记录损失 p99", f"¥{overall['p99']:,.0f}")
+    col4.metric("记录数", f"{int(overall['样本数']):,}")
+    
+    group_by = st.selectbox("分组维度", ["乡镇", "病虫害类型", "水果类型"], key="percentile_group")
+    loss = quantiles(sketches, "经济损失(元)", [group_by])
+    severity = quantiles(sketches, "严重程度", [group_by]).drop(columns="样本数")
+    table = loss.merge(severity, on=group_by, suffixes=("(损失)", "(严重程度)"))
+    st.dataframe(table.round(1), use_container_width=True, hide_index=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        loss_hist = histogram(sketches, "经济损失(元)")
+        fig = px.bar(loss_hist, x="代表值", y="计数", log_x=True, title="单条记录经济损失分布",
+                     labels={"代表值": "经济损失(元)", "计数": "记录数"})
+        st.plotly_chart(fig, use_container_width=True)
+    with col2:
+        severity_hist = histogram(sketches, "严重程度", [group_by])
+        fig = px.bar(severity_hist, x="代表值", y="计数", color=group_by, title="严重程度分布",
+                     labels={"代表值": "严重程度", "计数": "记录数"})
+        st.plotly_chart(fig, use_container_width=True)
+
+@st.fragment
+def weather_alert_section():
+    """气象预警（调整预警参数只重跑本片段）"""
+    risk = weather_risk()
+    diseases = [d for d in selected_diseases if d in set(risk["病虫害类型"].cat.categories)]
+    if not diseases:
+        diseases = list(risk["病虫害类型"].cat.categories)
+    
+    first_date, last_date = risk["日期"].min().date(), risk["日期"].max().date()
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        lead_days = st.slider("预警提前天数", 1, 14, 7)
+        default_date = max(first_date, last_date - timedelta(days=lead_days - 1))
+        as_of = st.date_input("预警起始日期", value=default_date, min_value=first_date, max_value=last_date)
+        threshold = st.slider("预警阈值", 0.3, 0.95, 0.7, 0.05)
+    
+    day_risk = risk[(risk["日期"] == pd.Timestamp(as_of)) & risk["病虫害类型"].isin(diseases)]
+    with col2:
+        m = create_risk_map(day_risk)
+        st_folium(m, width=700, height=380, returned_objects=[])
+    
+    alerts = risk_alerts(risk[risk["病虫害类型"].isin(diseases)], as_of, lead_days, threshold)
+    st.markdown(f"**⚠️ 未来{lead_days}天预警（{len(alerts)}条）**")
+    if alerts.empty:
+        st.success("预警窗口内各乡镇风险均低于阈值")
+    else:
+        st.dataframe(alerts.style.format({"最高风险指数": "{:.2f}"}), use_container_width=True)
+    
+    history = risk[
+        risk["病虫害类型"].isin(diseases)
+        & (risk["日期"] > pd.Timestamp(as_of) - pd.Timedelta(days=60))
+        & (risk["日期"] < pd.Timestamp(as_of) + pd.Timedelta(days=lead_days))
+    ]
+    daily_max = history.groupby(["日期", "乡镇"], observed=True)["风险指数"].max().reset_index()
+    fig = px.line(daily_max, x="日期", y="风险指数", color="乡镇", title="各乡镇逐日最高风险指数")
+    fig.add_hline(y=threshold, line_dash="dash", line_color="red")
+    st.plotly_chart(fig, use_container_width=True)
+
 # --------------------------
 # 基础版页面
 # --------------------------
@@ -483,8 +1153,7 @@ def render_basic_version():
     # 地图展示
     st.subheader("🗺️ 病虫害分布地图")
     if not filtered_df.empty:
-        m = create_basic_map(filtered_df)
-        st_folium(m, width=800, height=400, returned_objects=[])
+        show_cached_map("basic", width=800, height=400)
     else:
         st.warning("请选择筛选条件查看数据")
     
@@ -540,8 +1209,7 @@ def render_pro_version():
     with tab1:
         st.subheader("病虫害分布热力图")
         if not filtered_df.empty:
-            m = create_advanced_map(filtered_df)
-            st_folium(m, width=800, height=400, returned_objects=[])
+            show_cached_map("advanced", width=800, height=400)
         else:
             st.warning("请选择筛选条件查看数据")
     
@@ -549,11 +1217,7 @@ def render_pro_version():
         st.subheader("病虫害趋势分析")
         if not filtered_df.empty:
             # 月度趋势分析
-            monthly_trend = filtered_df.groupby("月份").agg({
-                "月均发生频次": "mean",
-                "严重程度": "mean",
-                "经济损失(元)": "sum"
-            }).reset_index()
+            monthly_trend = aggregate_filtered(["月份"], MONTHLY_TREND_METRICS)
             
             fig = make_subplots(
                 rows=2, cols=1,
@@ -581,6 +1245,9 @@ def render_pro_version():
             
             fig.update_layout(height=500, showlegend=True)
             st.plotly_chart(fig, use_container_width=True)
+            
+            st.subheader("📅 历年同比分析")
+            year_over_year_section()
         else:
             st.warning("请选择筛选条件查看数据")
     
@@ -588,11 +1255,11 @@ def render_pro_version():
         st.subheader("AI智能防治推荐")
         if not filtered_df.empty:
             # 找出最严重的病虫害问题
-            top_issues = filtered_df.groupby("病虫害类型").agg({
+            top_issues = aggregate_filtered(["病虫害类型"], {
                 "严重程度": "mean",
                 "月均发生频次": "mean",
                 "经济损失(元)": "sum"
-            }).reset_index()
+            })
             
             top_issues["综合指数"] = (
                 top_issues["严重程度"] * 0.4 + 
@@ -635,20 +1302,22 @@ def render_pro_version():
         if not filtered_market_df.empty:
             # 市场KPI指标
             display_market_kpi_metrics(filtered_market_df)
+            anomalies = visible_anomalies()
             
             # 价格趋势分析
             st.subheader("📈 价格趋势分析")
-            price_trend = filtered_market_df.groupby(["月份", "水果类型"]).agg({
+            price_trend = filtered_market_df.groupby(["月份", "水果类型"], observed=True).agg({
                 "价格(元/公斤)": "mean"
             }).reset_index()
             
             fig_price = px.line(price_trend, x="月份", y="价格(元/公斤)", color="水果类型",
                               title="各水果价格月度趋势", markers=True)
+            annotate_anomalies(fig_price, anomalies, ["价格(元/公斤)"])
             st.plotly_chart(fig_price, use_container_width=True)
             
             # 销量与产量对比
             st.subheader("📦 销量与产量分析")
-            sales_yield_trend = filtered_market_df.groupby(["月份", "水果类型"]).agg({
+            sales_yield_trend = filtered_market_df.groupby(["月份", "水果类型"], observed=True).agg({
                 "销量(吨)": "sum",
                 "产量(吨)": "sum"
             }).reset_index()
@@ -656,8 +1325,11 @@ def render_pro_version():
             fig_sales = px.bar(sales_yield_trend, x="月份", y=["销量(吨)", "产量(吨)"], 
                              color="水果类型", barmode="group",
                              title="销量与产量月度对比")
+            annotate_anomalies(fig_sales, anomalies, ["销量(吨)", "产量(吨)"])
             st.plotly_chart(fig_sales, use_container_width=True)
             
+            display_market_anomaly_alerts(anomalies)
+            
         else:
             st.warning("请选择筛选条件查看市场数据")
     
@@ -735,9 +1407,15 @@ def render_enterprise_version():
                 f"{efficiency_ratio:.1f}%",
                 "投入产出比"
             )
+        
+        adjusted = market_adjusted_filtered([]).iloc[0]
+        st.caption(
+            f"💹 按当月市场价格估算的经济损失: ¥{adjusted[ADJUSTED_LOSS_COLUMN]:,.0f}"
+            f"（较静态估值 {adjusted['调整幅度(%)']:+.1f}%）"
+        )
     
     # 企业版专属功能选项卡
-    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["🗺️ 高级地图", "📈 深度分析", "🤖 智能决策", "📊 数据管理", "📋 定制报告", "💰 市场分析"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["🗺️ 高级地图", "📈 深度分析", "🤖 智能决策", "📊 数据管理", "📋 定制报告", "💰 市场分析", "🌦️ 气象预警"])
     
     with tab1:
         st.subheader("高级可视化分析")
@@ -746,15 +1424,11 @@ def render_enterprise_version():
             
             with col1:
                 # 热力图
-                m = create_advanced_map(filtered_df)
-                st_folium(m, width=400, height=400, returned_objects=[])
+                show_cached_map("advanced", width=400, height=400)
             
             with col2:
                 # 乡镇对比分析
-                town_analysis = filtered_df.groupby("乡镇").agg({
-                    "严重程度": "mean",
-                    "经济损失(元)": "sum"
-                }).reset_index()
+                town_analysis = aggregate_filtered(["乡镇"], SEVERITY_LOSS_METRICS)
                 
                 fig = px.bar(town_analysis, x="乡镇", y="经济损失(元)", 
                             title="各乡镇经济损失对比",
@@ -772,10 +1446,11 @@ def render_enterprise_version():
             with col1:
                 # 成本效益分析
                 cost_benefit_data = []
-                for disease in filtered_df["病虫害类型"].unique():
-                    disease_data = filtered_df[filtered_df["病虫害类型"] == disease]
-                    total_loss = disease_data["经济损失(元)"].sum()
-                    total_cost = disease_data["防治成本(元)"].sum()
+                disease_totals = aggregate_filtered(["病虫害类型"], {"经济损失(元)": "sum", "防治成本(元)": "sum"})
+                for _, disease_row in disease_totals.iterrows():
+                    disease = disease_row["病虫害类型"]
+                    total_loss = disease_row["经济损失(元)"]
+                    total_cost = disease_row["防治成本(元)"]
                     solution = solution_db.get(disease, {})
                     
                     cost_benefit_data.append({
@@ -795,10 +1470,7 @@ def render_enterprise_version():
             
             with col2:
                 # 时间序列预测
-                monthly_data = filtered_df.groupby("月份").agg({
-                    "严重程度": "mean",
-                    "经济损失(元)": "sum"
-                }).reset_index()
+                monthly_data = aggregate_filtered(["月份"], SEVERITY_LOSS_METRICS)
                 
                 # 简单线性预测（模拟）
                 if len(monthly_data) > 1:
@@ -813,6 +1485,12 @@ def render_enterprise_version():
                                            mode='lines', name='预测趋势', line=dict(color='red', dash='dash')))
                     fig.update_layout(title="病虫害严重程度趋势预测", xaxis_title="月份", yaxis_title="严重程度")
                     st.plotly_chart(fig, use_container_width=True)
+            
+            st.subheader("📅 历年同比分析")
+            year_over_year_section()
+            
+            st.subheader("📐 损失与严重程度分位数")
+            percentile_section()
         else:
             st.warning("请选择筛选条件查看数据")
     
@@ -820,12 +1498,7 @@ def render_enterprise_version():
         st.subheader("AI智能决策支持")
         if not filtered_df.empty:
             # 高级AI推荐
-            top_issues = filtered_df.groupby("病虫害类型").agg({
-                "严重程度": "mean",
-                "月均发生频次": "mean",
-                "经济损失(元)": "sum",
-                "防治成本(元)": "sum"
-            }).reset_index()
+            top_issues = aggregate_filtered(["病虫害类型"], THREAT_METRICS)
             
             top_issues["综合威胁指数"] = (
                 top_issues["严重程度"] * 0.3 + 
@@ -866,16 +1539,17 @@ def render_enterprise_version():
                     
                     # 行动建议
                     st.markdown("**💡 行动建议:**")
-                    col_a, col_b, col_c = st.columns(3)
-                    with col_a:
-                        if st.button(f"📞 紧急专家会诊", key=f"expert_{disease}"):
-                            st.success(f"已启动{disease}紧急专家会诊流程!")
-                    with col_b:
-                        if st.button(f"🛒 批量采购物资", key=f"bulk_{disease}"):
-                            st.info(f"跳转到{disease}防治物资批量采购页面")
-                    with col_c:
-                        if st.button(f"📋 生成防治方案", key=f"plan_{disease}"):
-                            st.info(f"生成{disease}定制化综合防治方案")
+                    disease_action_buttons(disease)
+            
+            # 蒙特卡洛情景模拟
+            st.markdown("---")
+            st.subheader("🎲 防治情景模拟")
+            scenario_simulation_section()
+            
+            # 预算约束下的防治方案分配
+            st.markdown("---")
+            st.subheader("💰 防治预算优化分配")
+            budget_allocation_section()
         else:
             st.warning("请选择筛选条件查看数据")
     
@@ -886,27 +1560,7 @@ def render_enterprise_version():
             
             with col1:
                 st.markdown("**📥 数据导出**")
-                export_format = st.selectbox("选择导出格式", ["CSV", "Excel", "JSON"])
-                
-                if st.button("生成导出文件"):
-                    if export_format == "CSV":
-                        csv = filtered_df.to_csv(index=False)
-                        st.download_button(
-                            label="下载CSV文件",
-                            data=csv,
-                            file_name=f"病虫害数据_{datetime.now().strftime('%Y%m%d')}.csv",
-                            mime="text/csv"
-                        )
-                    elif export_format == "Excel":
-                        output = io.BytesIO()
-                        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                            filtered_df.to_excel(writer, index=False, sheet_name='病虫害数据')
-                        st.download_button(
-                            label="下载Excel文件",
-                            data=output.getvalue(),
-                            file_name=f"病虫害数据_{datetime.now().strftime('%Y%m%d')}.xlsx",
-                            mime="application/vnd.ms-excel"
-                        )
+                data_export_section()
             
             with col2:
                 st.markdown("**🔗 API接口**")
@@ -929,105 +1583,69 @@ response = requests.get(url, headers=headers, params=params)
 data = response.json()
                 """)
                 
-                if st.button("生成API密钥"):
-                    st.success("API密钥已生成: sk_ent_xxxxxxxxxxxxxxxx")
-        else:
-            st.warning("请选择筛选条件查看数据")
-    
-    with tab5:
-        st.subheader("定制报告生成")
-        if not filtered_df.empty:
-            report_type = st.selectbox("选择报告类型", 
-                                     ["月度分析报告", "季度总结报告", "年度综合报告", "专项防治报告"])
+                api_key_section()
             
-            col1, col2 = st.columns(2)
+            with st.expander("📦 内存占用报告"):
+                report = table_memory_report(data_version)
+                st.dataframe(report.style.format({
+                    "默认类型(MB)": "{:.2f}", "紧凑类型(MB)": "{:.2f}", "压缩倍数": "{:.1f}×"
+                }), use_container_width=True)
             
-            with col1:
-                st.markdown("**报告内容定制**")
-                include_trend = st.checkbox("包含趋势分析", value=True)
-                include_economic = st.checkbox("包含经济分析", value=True)
-                include_recommendations = st.checkbox("包含防治建议", value=True)
-                include_comparison = st.checkbox("包含区域对比", value=True)
-                include_market = st.checkbox("包含市场分析", value=True)
+            with st.expander("🧹 数据质量隔离区"):
+                # 共享数据集模式下为只读快照，隔离记录只保存在 SQLite 存储中
+                if not hasattr(store, "quarantine_summary"):
+                    st.info("共享数据集模式下请在接入节点查看隔离记录")
+                else:
+                    quarantine = store.quarantine_summary()
+                    if quarantine.empty:
+                        st.success("暂无未通过校验的入库数据")
+                    else:
+                        st.caption(f"共 {int(quarantine['行数'].sum())} 行数据未通过入库校验，未进入地图与指标计算")
+                        st.dataframe(quarantine, use_container_width=True, hide_index=True)
             
-            with col2:
-                st.markdown("**报告格式设置**")
-                report_style = st.selectbox("报告风格", ["简洁版", "详细版", "学术版", "商业版"])
-                include_charts = st.checkbox("包含图表", value=True)
-                include_data = st.checkbox("包含原始数据", value=False)
+            with st.expander("🗺️ 地图载荷报告"):
+                payload = map_payload_report(data_version, *selected_filters)
+                st.caption(f"当前地图弹窗模式: {'按需弹窗' if MAP_POPUP_MODE == 'lazy' else '内嵌弹窗'}（环境变量 SPP_MAP_POPUPS）")
+                st.dataframe(payload.style.format({
+                    "内嵌弹窗(KB)": "{:.1f}", "按需弹窗(KB)": "{:.1f}", "减少(%)": "{:.1f}"
+                }), use_container_width=True, hide_index=True)
             
-            if st.button("🖨️ 生成定制报告"):
-                with st.spinner("正在生成定制报告..."):
-                    # 模拟报告生成过程
-                    progress_bar = st.progress(0)
-                    for i in range(100):
-                        progress_bar.progress(i + 1)
-                    
-                    st.success("✅ 定制报告生成完成！")
-                    
-                    # 模拟报告内容预览
-                    st.markdown(f"""
-                    ### 📋 {report_type} - 预览
-                    
-                    **报告摘要**:
-                    - 分析时段: {selected_months}月
-                    - 覆盖区域: {', '.join(selected_towns)}
-                    - 主要作物: {', '.join(selected_fruits)}
-                    - 重点关注病虫害: {', '.join(selected_diseases)}
-                    
-                    **核心发现**:
-                    1. 预计总经济损失: ¥{filtered_df['经济损失(元)'].sum():,.0f}
-                    2. 平均病虫害严重程度: {filtered_df['严重程度'].mean():.1f}/5.0
-                    3. 防治投资回报率: {(filtered_df['经济损失(元)'].sum() / filtered_df['防治成本(元)'].sum()):.1f}:1
-                    
-                    **市场分析**:
-                    - 平均市场价格: ¥{filtered_market_df['价格(元/公斤)'].mean():.2f}/公斤
-                    - 总销量: {filtered_market_df['销量(吨)'].sum():.1f}吨
-                    - 总产量: {filtered_market_df['产量(吨)'].sum():.1f}吨
-                    
-                    **主要建议**:
-                    - 优先防治: {selected_diseases[0] if selected_diseases else 'N/A'}
-                    - 重点区域: {selected_towns[0] if selected_towns else 'N/A'}
-                    - 最佳防治时机: 建议在{min(selected_months) if selected_months else 'N/A'}月前完成防治准备
-                    """)
-                    
-                    # 创建模拟PDF下载
-                    report_content = f"""
-                    {report_type}
-                    生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-                    
-                    报告摘要:
-                    - 分析时段: {selected_months}月
-                    - 覆盖区域: {', '.join(selected_towns)}
-                    - 主要作物: {', '.join(selected_fruits)}
-                    - 重点关注病虫害: {', '.join(selected_diseases)}
-                    
-                    核心发现:
-                    1. 预计总经济损失: ¥{filtered_df['经济损失(元)'].sum():,.0f}
-                    2. 平均病虫害严重程度: {filtered_df['严重程度'].mean():.1f}/5.0
-                    3. 防治投资回报率: {(filtered_df['经济损失(元)'].sum() / filtered_df['防治成本(元)'].sum()):.1f}:1
-                    
-                    市场分析:
-                    - 平均市场价格: ¥{filtered_market_df['价格(元/公斤)'].mean():.2f}/公斤
-                    - 总销量: {filtered_market_df['销量(吨)'].sum():.1f}吨
-                    - 总产量: {filtered_market_df['产量(吨)'].sum():.1f}吨
-                    """
-                    
-                    b64 = base64.b64encode(report_content.encode()).decode()
+            with st.expander("🌙 夜间批处理结果"):
+                batch = latest_batch_results()
+                if batch is None:
+                    st.info("暂无与当前数据版本一致的批处理结果，可通过定时任务运行 `python batch.py` 生成")
+                else:
+                    manifest, batch_tables = batch
+                    st.caption(f"生成时间 {manifest['generated_at']} · {manifest['towns']}个乡镇 · 耗时 {manifest['seconds']}秒")
+                    kpis = batch_tables["kpis"]
+                    kpis = kpis[
+                        kpis["乡镇"].isin(selected_towns)
+                        & kpis["水果类型"].isin(selected_fruits)
+                        & kpis["月份"].isin(selected_months)
+                    ]
+                    st.dataframe(kpis.round(2), use_container_width=True)
                     st.download_button(
-                        label="📥 下载完整报告 (PDF)",
-                        data=f"data:application/pdf;base64,{b64}",
-                        file_name=f"{report_type}_{datetime.now().strftime('%Y%m%d')}.pdf",
-                        mime="application/pdf"
+                        label="下载全县KPI (CSV)",
+                        data=batch_tables["kpis"].to_csv(index=False),
+                        file_name=f"全县KPI_{manifest['run_id']}.csv",
+                        mime="text/csv"
                     )
         else:
             st.warning("请选择筛选条件查看数据")
     
+    with tab5:
+        st.subheader("定制报告生成")
+        if not filtered_df.empty:
+            custom_report_section()
+        else:
+            st.warning("请选择筛选条件查看数据")
+    
     with tab6:
         st.subheader("💰 市场数据分析")
         if not filtered_market_df.empty:
             # 市场KPI指标
             display_market_kpi_metrics(filtered_market_df)
+            anomalies = visible_anomalies()
             
             # 市场分析图表
             col1, col2 = st.columns(2)
@@ -1035,29 +1653,31 @@ data = response.json()
             with col1:
                 # 价格趋势分析
                 st.subheader("📈 价格趋势分析")
-                price_trend = filtered_market_df.groupby(["月份", "水果类型"]).agg({
+                price_trend = filtered_market_df.groupby(["月份", "水果类型"], observed=True).agg({
                     "价格(元/公斤)": "mean"
                 }).reset_index()
                 
                 fig_price = px.line(price_trend, x="月份", y="价格(元/公斤)", color="水果类型",
                                   title="各水果价格月度趋势", markers=True)
+                annotate_anomalies(fig_price, anomalies, ["价格(元/公斤)"])
                 st.plotly_chart(fig_price, use_container_width=True)
                 
                 # 市场需求分析
                 st.subheader("📊 市场需求分析")
-                demand_trend = filtered_market_df.groupby(["月份", "水果类型"]).agg({
+                demand_trend = filtered_market_df.groupby(["月份", "水果类型"], observed=True).agg({
                     "市场需求指数": "mean",
                     "库存水平": "mean"
                 }).reset_index()
                 
                 fig_demand = px.line(demand_trend, x="月份", y=["市场需求指数", "库存水平"], 
                                    color="水果类型", title="市场需求与库存趋势")
+                annotate_anomalies(fig_demand, anomalies, ["市场需求指数", "库存水平"])
                 st.plotly_chart(fig_demand, use_container_width=True)
             
             with col2:
                 # 销量与产量对比
                 st.subheader("📦 销量与产量分析")
-                sales_yield_trend = filtered_market_df.groupby(["月份", "水果类型"]).agg({
+                sales_yield_trend = filtered_market_df.groupby(["月份", "水果类型"], observed=True).agg({
                     "销量(吨)": "sum",
                     "产量(吨)": "sum"
                 }).reset_index()
@@ -1065,6 +1685,7 @@ data = response.json()
                 fig_sales = px.bar(sales_yield_trend, x="月份", y=["销量(吨)", "产量(吨)"], 
                                  color="水果类型", barmode="group",
                                  title="销量与产量月度对比")
+                annotate_anomalies(fig_sales, anomalies, ["销量(吨)", "产量(吨)"])
                 st.plotly_chart(fig_sales, use_container_width=True)
                 
                 # 区域市场分析
@@ -1074,6 +1695,17 @@ data = response.json()
                                         color="水果类型", title="各乡镇水果产量分布")
                     st.plotly_chart(fig_regional, use_container_width=True)
             
+            display_market_anomaly_alerts(anomalies)
+            
+            # 病虫害与市场联动
+            st.subheader("🔗 病虫害与市场联动分析")
+            market_linkage_section()
+            
+            # 产销调运优化
+            st.subheader("🚚 产销调运优化")
+            if not filtered_regional_market_df.empty:
+                distribution_section()
+            
             # 市场预测
             st.subheader("🔮 市场预测分析")
             col_pred1, col_pred2, col_pred3 = st.columns(3)
@@ -1103,12 +1735,12 @@ data = response.json()
             st.subheader("💡 市场决策建议")
             
             # 找出价格最高的水果
-            max_price_fruit = filtered_market_df.groupby("水果类型")["价格(元/公斤)"].mean().idxmax()
-            max_price = filtered_market_df.groupby("水果类型")["价格(元/公斤)"].mean().max()
+            max_price_fruit = filtered_market_df.groupby("水果类型", observed=True)["价格(元/公斤)"].mean().idxmax()
+            max_price = filtered_market_df.groupby("水果类型", observed=True)["价格(元/公斤)"].mean().max()
             
             # 找出需求最高的水果
-            max_demand_fruit = filtered_market_df.groupby("水果类型")["市场需求指数"].mean().idxmax()
-            max_demand = filtered_market_df.groupby("水果类型")["市场需求指数"].mean().max()
+            max_demand_fruit = filtered_market_df.groupby("水果类型", observed=True)["市场需求指数"].mean().idxmax()
+            max_demand = filtered_market_df.groupby("水果类型", observed=True)["市场需求指数"].mean().max()
             
             st.info(f"""
             **市场机会分析**:
@@ -1120,6 +1752,10 @@ data = response.json()
         else:
             st.warning("请选择筛选条件查看市场数据")
     
+    with tab7:
+        st.subheader("🌦️ 气象驱动病虫害预警")
+        weather_alert_section()
+    
     # 企业版专属服务
     st.markdown("---")
     st.markdown("""
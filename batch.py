@@ -0,0 +1,236 @@
+"""
+批处理任务（不依赖 Streamlit）
+
+适合 cron 等定时任务：对全县每个 乡镇 × 水果类型 × 月份 组合计算 KPI 与损失排名、各乡镇病虫害威胁排名与趋势预测
+（在全县数据上按组向量化一次完成），再按乡镇分片在进程池中并行运行防治情景模拟并生成报告。
+结果写入磁盘，页面按数据版本直接读取，无需在会话中重算。
+
+输出目录结构:
+    <output>/runs/<时间戳>/kpis.parquet        KPI 与损失排名
+    <output>/runs/<时间戳>/threats.parquet     各乡镇病虫害威胁排名
+    <output>/runs/<时间戳>/forecasts.parquet   各乡镇各水果逐月趋势预测
+    <output>/runs/<时间戳>/scenarios.parquet   防治情景模拟（--draws 0 时不生成）
+    <output>/runs/<时间戳>/reports/<乡镇>.md  乡镇报告
+    <output>/runs/<时间戳>/manifest.json       数据版本、生成时间与行数
+    <output>/latest.json                       指向最近一次完成的运行（原子替换）
+
+用法:
+    python batch.py
+    python batch.py --output /srv/spp/batch --workers 8 --draws 5000 --keep 7
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from analytics import rank_towns, summarize
+from datasets import fruit_economic_value, open_store, solution_db
+from simulation import build_scenario_table, run_monte_carlo
+
+DEFAULT_BATCH_DIR = os.environ.get("SPP_BATCH_DIR", os.path.join("data", "batch"))
+
+
+def town_report(town, kpis, threats, forecasts, scenario_summary):
+    """生成乡镇报告（Markdown）"""
+    loss = kpis["经济损失(元)"].sum()
+    cost = kpis["防治成本(元)"].sum()
+    lines = [
+        f"# {town} 病虫害防控报告",
+        "",
+        f"- 预估总经济损失: ¥{loss:,.0f}",
+        f"- 预估防治总成本: ¥{cost:,.0f}",
+        f"- 投资回报率: {loss / cost:.1f}:1" if cost > 0 else "- 投资回报率: N/A",
+        f"- 观测记录数: {int(kpis['记录数'].sum())}",
+        "",
+        "## 主要威胁",
+        "",
+    ]
+    for _, row in threats.head(3).iterrows():
+        solution = solution_db.get(row["病虫害类型"], {})
+        lines.append(
+            f"{int(row['威胁排名'])}. **{row['病虫害类型']}** 综合威胁指数 {row['综合威胁指数']:.2f}，"
+            f"经济损失 ¥{row['经济损失(元)']:,.0f}；推荐方案：{solution.get('AI推荐方案', '数据收集中')}"
+        )
+    lines += ["", "## 趋势预测", ""]
+    last_month = forecasts.dropna(subset=["严重程度实际"])["月份"].max()
+    upcoming = forecasts[forecasts["月份"] == (last_month % 12) + 1] if pd.notna(last_month) else forecasts.iloc[:0]
+    for _, row in upcoming.iterrows():
+        lines.append(
+            f"- {row['水果类型']}：{int(row['月份'])}月预测严重程度 {row['严重程度预测']:.1f}/5.0，"
+            f"预测经济损失 ¥{row['经济损失预测(元)']:,.0f}"
+        )
+    if scenario_summary:
+        low, mid, high = scenario_summary["投资回报率"]
+        lines += [
+            "",
+            "## 防治情景模拟",
+            "",
+            f"- 模拟次数: {scenario_summary['模拟次数']:,}",
+            f"- 投资回报率中位数: {mid:.1f}:1（{scenario_summary['置信水平'] * 100:.0f}%区间 {low:.1f}~{high:.1f}）",
+            f"- 防治盈利概率: {scenario_summary['盈利概率'] * 100:.1f}%",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def _run_town(task):
+    """单个乡镇的情景模拟与报告（在子进程中执行）"""
+    town, observations, kpis, threats, forecasts, n_draws = task
+    scenarios, scenario_summary = pd.DataFrame(), {}
+    if n_draws > 0:
+        cells = build_scenario_table(observations, solution_db, fruit_economic_value)
+        simulation = run_monte_carlo(cells, n_draws=n_draws, max_workers=1)
+        scenarios, scenario_summary = simulation["cells"], simulation["summary"]
+    report = town_report(town, kpis, threats, forecasts, scenario_summary)
+    return town, scenarios, report
+
+
+def run_batch(store, output=DEFAULT_BATCH_DIR, workers=None, n_draws=2000, keep=7):
+    """
+    计算全县批处理结果并写入 output
+
+    返回:
+        manifest（dict），包含数据版本、运行目录、耗时与各结果表行数
+    """
+    started = time.perf_counter()
+    data_version = store.version()
+    observations = store.load_table("observations")
+
+    # KPI、威胁排名与趋势预测在全县数据上按组向量化计算，只需一次
+    kpis, threats, forecasts = summarize(observations)
+    kpis = rank_towns(kpis)
+
+    # 情景模拟与报告按乡镇分片并行
+    def by_town(frame):
+        return {str(town): part for town, part in frame.groupby("乡镇", observed=True)}
+
+    parts = [by_town(frame) for frame in (observations, kpis, threats, forecasts)]
+    towns = sorted(parts[0])
+    tasks = [(town, *(part[town] for part in parts), n_draws) for town in towns]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        results = [_run_town(task) for task in tasks]
+    else:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(_run_town, tasks, chunksize=chunksize))
+
+    reports = {town: report for town, _, report in results}
+    scenario_parts = [scenarios for _, scenarios, _ in results if not scenarios.empty]
+    tables = {
+        "kpis": kpis,
+        "threats": threats,
+        "forecasts": forecasts,
+        "scenarios": pd.concat(scenario_parts, ignore_index=True) if scenario_parts else pd.DataFrame(),
+    }
+
+    run_id, run_dir = _create_run_dir(output)
+    row_counts = {}
+    for name, table in tables.items():
+        if table.empty:
+            continue
+        # category 列按字符串写出，读取方无需依赖本次运行的类别集合
+        table = table.astype({col: str for col, dtype in table.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)})
+        table.to_parquet(os.path.join(run_dir, f"{name}.parquet"), index=False)
+        row_counts[name] = len(table)
+    for town, report in reports.items():
+        with open(os.path.join(run_dir, "reports", f"{town}.md"), "w", encoding="utf-8") as f:
+            f.write(report)
+
+    manifest = {
+        "data_version": data_version,
+        "run_id": run_id,
+        "run_dir": os.path.abspath(run_dir),
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "towns": len(towns),
+        "observations": len(observations),
+        "draws": n_draws,
+        "rows": row_counts,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+    with open(os.path.join(run_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # 运行完成后再原子替换 latest.json，读取方不会看到写了一半的结果
+    latest = os.path.join(output, "latest.json")
+    with open(latest + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(latest + ".tmp", latest)
+    _prune_runs(os.path.join(output, "runs"), keep)
+    return manifest
+
+
+def _create_run_dir(output):
+    """
+    新建本次运行目录（运行编号精确到微秒，按字典序即时间顺序）；
+    目录已存在说明另一运行同时启动，重新取编号，两个运行不会写入同一目录
+    """
+    os.makedirs(os.path.join(output, "runs"), exist_ok=True)
+    while True:
+        run_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        run_dir = os.path.join(output, "runs", run_id)
+        try:
+            os.makedirs(run_dir, exist_ok=False)
+        except FileExistsError:
+            continue
+        os.makedirs(os.path.join(run_dir, "reports"))
+        return run_id, run_dir
+
+
+def _prune_runs(runs_dir, keep):
+    """只保留最近 keep 次运行"""
+    if keep <= 0:
+        return
+    for run_id in sorted(os.listdir(runs_dir))[:-keep]:
+        shutil.rmtree(os.path.join(runs_dir, run_id), ignore_errors=True)
+
+
+def load_latest(output=DEFAULT_BATCH_DIR, data_version=None):
+    """
+    读取最近一次批处理结果
+
+    参数:
+        data_version: 指定时只返回该数据版本的结果（数据已更新则结果视为过期）
+
+    返回:
+        (manifest, {表名: DataFrame})；没有可用结果时返回 None
+    """
+    try:
+        with open(os.path.join(output, "latest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data_version is not None and manifest["data_version"] != data_version:
+        return None
+    tables = {}
+    for name in manifest["rows"]:
+        path = os.path.join(manifest["run_dir"], f"{name}.parquet")
+        if not os.path.exists(path):
+            return None  # 运行目录已被清理
+        tables[name] = pd.read_parquet(path)
+    return manifest, tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智慧植保批处理任务：全县 KPI、排名、预测与报告")
+    parser.add_argument("--output", default=DEFAULT_BATCH_DIR, help="结果输出目录")
+    parser.add_argument("--db", help="SQLite 数据库路径（默认使用 SPP_DB_PATH 或 data/plant_protection.db）")
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数，默认使用全部CPU核")
+    parser.add_argument("--draws", type=int, default=2000, help="每个乡镇的情景模拟次数，0 表示不模拟")
+    parser.add_argument("--keep", type=int, default=7, help="保留最近几次运行结果，0 表示全部保留")
+    args = parser.parse_args()
+
+    store = open_store(args.db)
+    manifest = run_batch(store, args.output, workers=args.workers, n_draws=args.draws, keep=args.keep)
+    print(json.dumps(manifest, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
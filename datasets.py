@@ -0,0 +1,290 @@
+"""
+数据注册表与模拟数据生成
+
+鲁山县乡镇坐标、水果与病虫害、经济价值、防治方案库，以及观测、市场与区域市场模拟数据的生成。
+本模块不依赖 Streamlit，可被页面、批处理任务与其他工具共同调用。
+"""
+
+import os
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from schema import compact
+from storage import PlantProtectionStore
+
+# 设置随机种子以确保数据可重现
+random.seed(42)
+
+# 鲁山县主要乡镇及经纬度
+lushan_towns = {
+    "鲁阳镇": (33.74, 112.82),
+    "下汤镇": (33.60, 112.75),
+    "梁洼镇": (33.78, 112.93),
+    "张官营镇": (33.68, 113.05),
+    "尧山镇": (33.50, 112.58),
+    "瓦屋镇": (33.70, 112.65),
+    "赵村镇": (33.62, 112.60),
+    "四棵树乡": (33.55, 112.68)
+}
+
+# 水果类型与对应常见病虫害及经济价值
+fruit_diseases = {
+    "桃": ["褐腐病", "蚜虫", "桃小食心虫"],
+    "苹果": ["炭疽病", "红蜘蛛", "白粉病"],
+    "葡萄": ["霜霉病", "灰霉病", "透翅蛾"],
+    "梨": ["黑星病", "梨木虱", "蚜虫"]
+}
+
+# 水果经济价值（元/公斤）
+fruit_economic_value = {
+    "桃": 8.5,
+    "苹果": 6.2,
+    "葡萄": 12.8,
+    "梨": 5.6
+}
+
+# 解决方案数据库
+solution_db = {
+    "褐腐病": {
+        "症状": "果实出现褐色腐烂，表面有灰色霉层",
+        "防治经验": "1. 冬季清园，烧毁病果；2. 花期喷50%多菌灵500倍液；3. 果实成熟期套袋（鲁阳镇果农实测有效）",
+        "AI推荐方案": "基于历史数据分析，建议在3-4月花期前进行预防性施药，效果提升35%",
+        "防治成本": "中等（200-300元/亩）",
+        "效果评估": "85%有效率",
+        "投资回报率": "3.2:1",
+        "环保等级": "⭐️⭐️⭐️☆"
+    },
+    "蚜虫": {
+        "症状": "叶片卷曲，虫体聚集在叶背",
+        "防治经验": "1. 挂黄板诱杀；2. 释放天敌瓢虫；3. 蚜虫爆发期用10%吡虫啉2000倍液（下汤镇桃园推荐）",
+        "AI推荐方案": "智能监测+生物防治组合，减少化学农药使用40%",
+        "防治成本": "低（100-150元/亩）",
+        "效果评估": "92%有效率",
+        "投资回报率": "4.5:1",
+        "环保等级": "⭐️⭐️⭐️⭐️"
+    },
+    "桃小食心虫": {
+        "症状": "果实表面有针孔，果肉内有虫道",
+        "防治经验": "1. 地面覆盖地膜阻止成虫出土；2. 性诱剂诱杀雄虫；3. 卵期喷20%氯虫苯甲酰胺（张官营镇经验）",
+        "AI推荐方案": "性信息素迷向技术+精准施药时机预测",
+        "防治成本": "中等偏高（300-400元/亩）",
+        "效果评估": "88%有效率",
+        "投资回报率": "2.8:1",
+        "环保等级": "⭐️⭐️⭐️⭐️☆"
+    },
+    "炭疽病": {
+        "症状": "果实出现褐色凹陷斑，有轮纹状小黑点",
+        "防治经验": "1. 及时摘除病果；2. 雨季前喷70%甲基托布津800倍液；3. 增施有机肥提高抗性（尧山镇苹果园）",
+        "AI推荐方案": "基于气象数据的预警系统，提前7天预警防控",
+        "防治成本": "中等（180-250元/亩）",
+        "效果评估": "90%有效率",
+        "投资回报率": "3.5:1",
+        "环保等级": "⭐️⭐️⭐️☆"
+    },
+    "霜霉病": {
+        "症状": "叶片背面有白色霉层，正面发黄",
+        "防治经验": "1. 合理修剪保证通风；2. 发病初期喷58%甲霜灵锰锌500倍液；3. 避免傍晚浇水（瓦屋镇葡萄园）",
+        "AI推荐方案": "微气候监测+精准施药，降低用药量30%",
+        "防治成本": "中等（220-280元/亩）",
+        "效果评估": "87%有效率",
+        "投资回报率": "3.0:1",
+        "环保等级": "⭐️⭐️⭐️⭐️"
+    },
+}
+
+def generate_simulated_data():
+    data = []
+    dates = [datetime(2024, 1, 1) + timedelta(days=30*i) for i in range(12)]
+    
+    for town, (lat, lon) in lushan_towns.items():
+        fruits = random.sample(list(fruit_diseases.keys()), k=random.randint(2, 3))
+        for fruit in fruits:
+            diseases = random.sample(fruit_diseases[fruit], k=random.randint(1, 2))
+            for disease in diseases:
+                for date in dates:
+                    base_freq = random.randint(1, 10)
+                    base_severity = random.randint(1, 5)
+                    
+                    seasonal_factor = 1 + 0.3 * np.sin(2 * np.pi * date.month / 12)
+                    freq = max(1, int(base_freq * seasonal_factor))
+                    severity = max(1, min(5, int(base_severity * seasonal_factor)))
+                    
+                    area_affected = random.uniform(0.1, 0.3)
+                    yield_loss = severity * 0.05 + random.uniform(0.05, 0.15)
+                    economic_loss = area_affected * yield_loss * fruit_economic_value[fruit] * 10000
+                    
+                    data.append({
+                        "日期": date,
+                        "月份": date.month,
+                        "乡镇": town,
+                        "纬度": lat + random.uniform(-0.03, 0.03),
+                        "经度": lon + random.uniform(-0.03, 0.03),
+                        "水果类型": fruit,
+                        "病虫害类型": disease,
+                        "月均发生频次": freq,
+                        "严重程度": severity,
+                        "经济损失(元)": economic_loss,
+                        "防治成本(元)": economic_loss * random.uniform(0.1, 0.3)
+                    })
+    return compact(pd.DataFrame(data), "observations")
+
+# --------------------------
+# 新增：市场数据生成函数
+# --------------------------
+
+def generate_market_data():
+    """生成模拟市场数据"""
+    # 生成过去12个月的数据
+    dates = [datetime(2024, 1, 1) + timedelta(days=30*i) for i in range(12)]
+    fruits = list(fruit_diseases.keys())
+    towns = list(lushan_towns.keys())
+    
+    market_data = []
+    
+    for date in dates:
+        for fruit in fruits:
+            # 基础价格（元/公斤）
+            base_price = fruit_economic_value[fruit]
+            
+            # 季节性价格波动
+            seasonal_factor = 1 + 0.4 * np.sin(2 * np.pi * date.month / 12)
+            current_price = base_price * seasonal_factor * random.uniform(0.9, 1.1)
+            
+            # 销量（吨）
+            base_sales = random.randint(50, 200)
+            sales = base_sales * seasonal_factor * random.uniform(0.8, 1.2)
+            
+            # 产量（吨）
+            base_yield = random.randint(100, 500)
+            yield_amount = base_yield * random.uniform(0.7, 1.3)
+            
+            # 市场需求指数
+            demand_index = random.uniform(0.5, 1.5)
+            
+            # 库存水平
+            inventory_level = random.uniform(0.2, 0.8)
+            
+            market_data.append({
+                "日期": date,
+                "月份": date.month,
+                "水果类型": fruit,
+                "价格(元/公斤)": round(current_price, 2),
+                "销量(吨)": round(sales, 2),
+                "产量(吨)": round(yield_amount, 2),
+                "市场需求指数": round(demand_index, 2),
+                "库存水平": round(inventory_level, 2)
+            })
+    
+    return compact(pd.DataFrame(market_data), "market_prices")
+
+def generate_regional_market_data():
+    """生成区域市场数据"""
+    fruits = list(fruit_diseases.keys())
+    towns = list(lushan_towns.keys())
+    
+    regional_data = []
+    
+    for town in towns:
+        for fruit in fruits:
+            # 区域产量（吨）
+            yield_amount = random.randint(50, 300)
+            
+            # 区域品质等级（1-5星）
+            quality_grade = random.randint(3, 5)
+            
+            # 区域市场份额
+            market_share = random.uniform(0.05, 0.25)
+            
+            # 运输成本（元/公斤）
+            transport_cost = random.uniform(0.5, 2.0)
+            
+            regional_data.append({
+                "乡镇": town,
+                "水果类型": fruit,
+                "区域产量(吨)": yield_amount,
+                "品质等级": quality_grade,
+                "市场份额": round(market_share, 3),
+                "运输成本(元/公斤)": round(transport_cost, 2)
+            })
+    
+    return compact(pd.DataFrame(regional_data), "regional_market")
+
+
+def generate_history(observations, years):
+    """
+    由当前年度观测数据生成往年模拟数据（仅用于演示）：日期平移到对应年份，
+    发生频次、严重程度与损失按年份随机波动（每个年份使用固定种子，可重现）
+    """
+    current_year = int(observations["日期"].dt.year.max())
+    seasons = []
+    for year in years:
+        rng = np.random.default_rng(year)
+        frame = observations.copy()
+        frame["日期"] = frame["日期"] - pd.DateOffset(years=current_year - year)
+        # 年度整体波动 × 逐条波动
+        level = rng.uniform(0.7, 1.2)
+        factor = level * rng.uniform(0.8, 1.2, len(frame))
+        # 空值保持为空，整数类型由 compact 统一决定
+        frame["月均发生频次"] = (frame["月均发生频次"] * factor).round().clip(lower=1)
+        frame["严重程度"] = (frame["严重程度"] * factor).round().clip(1, 5)
+        frame["经济损失(元)"] = (frame["经济损失(元)"] * factor).astype("float32")
+        frame["防治成本(元)"] = (frame["防治成本(元)"] * factor * rng.uniform(0.9, 1.1)).astype("float32")
+        seasons.append(frame)
+    return compact(pd.concat(seasons, ignore_index=True), "observations")
+
+
+def open_store(path=None):
+    """打开数据存储，首次使用时写入生成的数据；设置 SPP_SHARED_DATA_DIR 时返回共享数据集"""
+    store = PlantProtectionStore() if path is None else PlantProtectionStore(path)
+    store.seed_if_empty("observations", generate_simulated_data)
+    store.seed_if_empty("market_prices", generate_market_data)
+    store.seed_if_empty("regional_market", generate_regional_market_data)
+    
+    # 共享数据集模式：多进程部署时由 SQLite 导出 Arrow 文件，各进程只读内存映射
+    shared_dir = os.environ.get("SPP_SHARED_DATA_DIR")
+    if shared_dir:
+        from shared_data import SharedDataStore
+        
+        # Arrow 文件按 SQLite 的数据版本导出，源数据变化后自动重新导出
+        shared = SharedDataStore(shared_dir, source=store)
+        shared.sync()
+        return shared
+    return store
+
+
+# 提交到历史快照的表；页面按这些表的版本缓存快照存储
+SNAPSHOT_TABLES = ("observations", "market_prices")
+
+# 演示环境补充的往年模拟数据年数；默认 0，生产环境不写入任何模拟历史
+DEMO_HISTORY_YEARS = int(os.environ.get("SPP_DEMO_HISTORY_YEARS", "0"))
+DEMO_HISTORY_NOTE = "演示用模拟数据"
+# 清单说明为以下取值的版本是模拟数据（含早期版本写入的标记）
+SIMULATED_NOTES = (DEMO_HISTORY_NOTE, "往年模拟数据")
+
+
+def open_snapshots(store, directory=None, demo_history_years=None):
+    """
+    打开历史快照存储，并提交当前数据（内容未变化时不写入新版本）
+
+    demo_history_years（默认取 SPP_DEMO_HISTORY_YEARS）大于 0 时，首次使用为观测表补充若干往年的模拟数据：
+    清单说明记为 DEMO_HISTORY_NOTE，提交时间回填为该年度最后一刻，按时间点回溯时与真实历史的时间线一致
+    """
+    from snapshots import SnapshotStore
+
+    if demo_history_years is None:
+        demo_history_years = DEMO_HISTORY_YEARS
+    snapshots = SnapshotStore() if directory is None else SnapshotStore(directory)
+    observations = store.load_table("observations")
+    if not snapshots.manifest("observations") and demo_history_years > 0:
+        current_year = int(observations["日期"].dt.year.max())
+        history = generate_history(observations, range(current_year - demo_history_years, current_year))
+        for season, part in history.groupby(history["日期"].dt.year):
+            snapshots.commit("observations", part, note=DEMO_HISTORY_NOTE,
+                             committed_at=datetime(int(season), 12, 31, 23, 59, 59))
+    version = store.version(SNAPSHOT_TABLES)
+    snapshots.commit("observations", observations, note=version)
+    snapshots.commit("market_prices", store.load_table("market_prices"), note=version)
+    return snapshots
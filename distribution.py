@@ -0,0 +1,174 @@
+"""
+产销调运优化
+
+将各乡镇的区域产量调运到一组可配置的销地市场：到货净收益 = 市场价格 × 市场溢价 − 运输成本，
+运输成本 = 乡镇基础运输成本（regional_market 的 运输成本(元/公斤)）+ 按距离计算的干线运费。
+在乡镇供给与市场需求约束下最大化净收益，即经典运输问题；
+各水果之间相互独立，分别构造稀疏线性规划，由 HiGHS 以列生成方式求解（只放入对偶检验数为负的弧），
+数百个乡镇与数百个市场也可交互求解。
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linprog
+from scipy.sparse import coo_matrix
+
+# 默认销地市场：名称、坐标、各水果需求上限（吨）与相对县内均价的价格溢价
+DEFAULT_MARKETS = pd.DataFrame([
+    {"市场": "鲁山县城批发市场", "纬度": 33.74, "经度": 112.91, "需求上限(吨)": 300, "价格溢价": 1.00},
+    {"市场": "平顶山果品批发市场", "纬度": 33.77, "经度": 113.19, "需求上限(吨)": 400, "价格溢价": 1.08},
+    {"市场": "洛阳宏进农副产品批发市场", "纬度": 34.62, "经度": 112.45, "需求上限(吨)": 350, "价格溢价": 1.15},
+    {"市场": "南阳果品批发市场", "纬度": 33.00, "经度": 112.53, "需求上限(吨)": 250, "价格溢价": 1.10},
+    {"市场": "郑州万邦农产品物流城", "纬度": 34.68, "经度": 113.85, "需求上限(吨)": 600, "价格溢价": 1.25},
+])
+
+FREIGHT_RATE = 0.0008  # 干线运费（元/公斤/公里）
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """球面距离（公里），参数可广播"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def build_arcs(regional, market_prices, markets, town_coords, freight_rate=FREIGHT_RATE):
+    """
+    构造 (水果, 乡镇, 市场) 调运弧及单位净收益
+
+    参数:
+        regional: 区域市场数据（乡镇, 水果类型, 区域产量(吨), 运输成本(元/公斤)）
+        market_prices: 市场数据，按水果类型取平均价格
+        markets: 销地市场表（市场, 纬度, 经度, 需求上限(吨), 价格溢价）
+        town_coords: {乡镇: (纬度, 经度)}
+    """
+    prices = market_prices.groupby("水果类型", observed=True)["价格(元/公斤)"].mean()
+    supply = regional[regional["水果类型"].isin(prices.index)].reset_index(drop=True)
+    supply["水果类型"] = supply["水果类型"].astype(str)
+    supply["乡镇"] = supply["乡镇"].astype(str)
+    markets = markets.reset_index(drop=True)
+
+    n_supply, n_markets = len(supply), len(markets)
+    town_lat = supply["乡镇"].map(lambda t: town_coords[t][0]).to_numpy(dtype=float)
+    town_lon = supply["乡镇"].map(lambda t: town_coords[t][1]).to_numpy(dtype=float)
+    distance = haversine_km(
+        town_lat[:, None], town_lon[:, None],
+        markets["纬度"].to_numpy(dtype=float)[None, :], markets["经度"].to_numpy(dtype=float)[None, :],
+    )
+    unit_cost = supply["运输成本(元/公斤)"].to_numpy(dtype=float)[:, None] + freight_rate * distance
+    unit_price = (
+        supply["水果类型"].map(prices).to_numpy(dtype=float)[:, None]
+        * markets["价格溢价"].to_numpy(dtype=float)[None, :]
+    )
+
+    arcs = pd.DataFrame({
+        "供给序号": np.repeat(np.arange(n_supply), n_markets),
+        "市场序号": np.tile(np.arange(n_markets), n_supply),
+        "距离(公里)": distance.reshape(-1),
+        "单位运输成本(元/公斤)": unit_cost.reshape(-1),
+        "到货价格(元/公斤)": unit_price.reshape(-1),
+    })
+    arcs["单位净收益(元/公斤)"] = arcs["到货价格(元/公斤)"] - arcs["单位运输成本(元/公斤)"]
+    return supply, markets, arcs
+
+
+def _top_k(group, score, k):
+    """每组取 score 最高的 k 个元素，返回布尔掩码"""
+    order = np.lexsort((-score, group))
+    sorted_group = group[order]
+    group_start = np.flatnonzero(np.r_[True, sorted_group[1:] != sorted_group[:-1]])
+    rank = np.arange(len(order)) - np.repeat(group_start, np.diff(np.r_[group_start, len(order)]))
+    mask = np.zeros(len(order), dtype=bool)
+    mask[order[rank < k]] = True
+    return mask
+
+
+def _solve_transport(profit, row_idx, col_idx, row_cap, col_cap, top_k, max_rounds):
+    """
+    列生成求解单一水果的运输问题：max Σ profit·x，s.t. 行（乡镇）与列（市场）容量约束
+
+    初始只放入每行、每列单位净收益最高的 top_k 条弧，求解后用约束对偶价格计算全部弧的检验数，
+    将检验数为负的弧（每行、每列最多 top_k 条）加入后重新求解，直到没有可改进的弧，
+    此时的解即为全部弧上的最优解。
+    """
+    n_rows = len(row_cap)
+    b = np.concatenate([row_cap, col_cap])
+    active = _top_k(row_idx, profit, top_k) | _top_k(col_idx, profit, top_k)
+    for _ in range(max_rounds):
+        cols = np.flatnonzero(active)
+        n_cols = len(cols)
+        A = coo_matrix(
+            (np.ones(2 * n_cols), (np.r_[row_idx[cols], n_rows + col_idx[cols]], np.tile(np.arange(n_cols), 2))),
+            shape=(len(b), n_cols),
+        ).tocsr()
+        result = linprog(-profit[cols], A_ub=A, b_ub=b, bounds=(0, None), method="highs-ipm")
+        if not result.success:
+            raise RuntimeError(f"调运优化求解失败: {result.message}")
+        # 最小化问题中 ≤ 约束的对偶价格非正；检验数 = −收益 − (行对偶 + 列对偶)
+        duals = result.ineqlin.marginals
+        reduced = -profit - duals[row_idx] - duals[n_rows + col_idx]
+        candidates = np.flatnonzero(~active & (reduced < -1e-6 * np.maximum(profit, 1.0)))
+        if not len(candidates):
+            break
+        score = -reduced[candidates]
+        entering = _top_k(row_idx[candidates], score, top_k) | _top_k(col_idx[candidates], score, top_k)
+        active[candidates[entering]] = True
+
+    x = np.zeros(len(profit))
+    x[cols] = result.x
+    return x
+
+
+def solve_distribution(supply, markets, arcs, top_k=20, max_rounds=50):
+    """
+    求解运输问题：max Σ 净收益·运量，s.t. 各乡镇运出 ≤ 产量，各市场各水果到货 ≤ 需求上限
+
+    各水果之间没有共享约束，按水果分解为独立的运输问题分别求解（见 _solve_transport）。
+
+    返回:
+        (flows, summary)：flows 为运量大于 0 的调运方案，summary 为汇总指标
+    """
+    summary = {"总产量(吨)": float(supply["区域产量(吨)"].sum()), "调运量(吨)": 0.0,
+               "销售收入(元)": 0.0, "运输成本(元)": 0.0, "净收益(元)": 0.0}
+    arcs = arcs[arcs["单位净收益(元/公斤)"] > 0].reset_index(drop=True)
+    if arcs.empty:
+        return pd.DataFrame(), summary
+
+    supply_idx = arcs["供给序号"].to_numpy()
+    market_idx = arcs["市场序号"].to_numpy()
+    fruit_codes = pd.factorize(supply["水果类型"])[0]
+    arc_fruit = fruit_codes[supply_idx]
+    production = supply["区域产量(吨)"].to_numpy(dtype=float)
+    demand = markets["需求上限(吨)"].to_numpy(dtype=float)
+    # 净收益单位 元/公斤，运量单位 吨
+    profit = arcs["单位净收益(元/公斤)"].to_numpy(dtype=float) * 1000
+
+    x = np.zeros(len(arcs))
+    for fruit in np.unique(arc_fruit):
+        in_fruit = np.flatnonzero(arc_fruit == fruit)
+        rows, row_idx = np.unique(supply_idx[in_fruit], return_inverse=True)
+        x[in_fruit] = _solve_transport(
+            profit[in_fruit], row_idx, market_idx[in_fruit], production[rows], demand, top_k, max_rounds,
+        )
+
+    arcs["运量(吨)"] = x
+    flows = arcs[arcs["运量(吨)"] > 1e-6].copy()
+    flows["乡镇"] = supply["乡镇"].to_numpy()[flows["供给序号"]]
+    flows["水果类型"] = supply["水果类型"].to_numpy()[flows["供给序号"]]
+    flows["市场"] = markets["市场"].to_numpy()[flows["市场序号"]]
+    flows["销售收入(元)"] = flows["运量(吨)"] * flows["到货价格(元/公斤)"] * 1000
+    flows["运输成本(元)"] = flows["运量(吨)"] * flows["单位运输成本(元/公斤)"] * 1000
+    flows["净收益(元)"] = flows["销售收入(元)"] - flows["运输成本(元)"]
+    flows = flows[[
+        "乡镇", "水果类型", "市场", "运量(吨)", "距离(公里)", "单位运输成本(元/公斤)",
+        "到货价格(元/公斤)", "销售收入(元)", "运输成本(元)", "净收益(元)",
+    ]].sort_values("净收益(元)", ascending=False).reset_index(drop=True)
+
+    summary.update({
+        "调运量(吨)": float(flows["运量(吨)"].sum()),
+        "销售收入(元)": float(flows["销售收入(元)"].sum()),
+        "运输成本(元)": float(flows["运输成本(元)"].sum()),
+        "净收益(元)": float(flows["净收益(元)"].sum()),
+    })
+    return flows, summary
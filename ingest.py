@@ -0,0 +1,378 @@
+"""
+传感器与诱捕器数据接入网关
+
+接收田间设备上报的性诱捕器计数与微气候读数（温度、湿度、叶面湿润、降雨），
+支持两种本地接入方式：
+    - TCP：每行一条 JSON（NDJSON）
+    - HTTP：POST /readings，请求体为 NDJSON 或 JSON 数组；GET /stats 查看运行统计
+
+读数经有界队列进入写入协程，按微批次写入数据存储；写入前整批做向量化校验（validation.py），
+未通过的读数连同原因写入隔离区。队列满时 TCP 连接暂停读取
+（依靠 TCP 流控向设备施加背压），HTTP 请求返回 503 并提示稍后重试。
+
+用法:
+    python ingest.py --tcp-port 9009 --http-port 8089 --data-dir data/readings
+    python ingest.py --db data/plant_protection.db   # 写入 SQLite 存储
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import signal
+import time
+from datetime import datetime
+
+from schema import READING_FIELDS, READING_TYPES
+
+READ_CHUNK = 1 << 16
+HTTP_PUT_TIMEOUT = 1.0  # HTTP 请求等待队列空位的最长时间（秒）
+MAX_HTTP_BODY = 8 << 20  # HTTP 请求体上限（字节），超过时返回 413
+MAX_TCP_LINE = 1 << 20  # TCP 单行上限（字节），超过时断开连接
+HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+                413: "Payload Too Large", 503: "Service Unavailable"}
+_STOP = object()  # 写入协程的停止信号：处理完之前入队的读数后写出剩余缓冲并退出
+
+logger = logging.getLogger(__name__)
+
+
+class CsvReadingStore:
+    """按日期分区追加写入 CSV 的读数存储"""
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+
+    def write_batch(self, rows):
+        """写入一个微批次（在线程池中执行，不阻塞事件循环）"""
+        partition = datetime.now().strftime("%Y%m%d")
+        path = os.path.join(self.data_dir, f"readings_{partition}.csv")
+        new_file = not os.path.exists(path)
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(READING_FIELDS)
+            writer.writerows(rows)
+
+    def write_quarantine(self, table, rejected):
+        """未通过校验的读数追加写入隔离 CSV"""
+        if rejected.empty:
+            return
+        partition = datetime.now().strftime("%Y%m%d")
+        path = os.path.join(self.data_dir, f"quarantine_{partition}.csv")
+        rejected.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+
+    def close(self):
+        pass
+
+
+def parse_reading(obj, received_at):
+    """将一条 JSON 读数转换为按 READING_FIELDS 排列的行，无效读数（含字段值为对象或数组）返回 None"""
+    if not isinstance(obj, dict) or obj.get("类型") not in READING_TYPES or not obj.get("乡镇"):
+        return None
+    row = [obj.get(field) for field in READING_FIELDS]
+    if any(isinstance(value, (dict, list)) for value in row):
+        return None
+    if row[0] is None:
+        row[0] = received_at
+    return row
+
+
+class IngestGateway:
+    """异步接入网关：解析 → 有界队列 → 微批次写入"""
+
+    def __init__(self, store, queue_size=256, batch_size=5000, flush_interval=0.5, validator=None,
+                 max_body=MAX_HTTP_BODY, max_line=MAX_TCP_LINE):
+        self.store = store
+        self.validator = validator
+        self.max_body = max_body
+        self.max_line = max_line
+        # 队列元素是一次读取解析出的一组读数，而不是单条读数，以降低调度开销
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = {
+            "accepted": 0, "rejected": 0, "written": 0, "batches": 0, "throttled": 0,
+            "quarantined": 0, "failed_batches": 0, "dropped": 0,
+        }
+        self.started_at = time.monotonic()
+        self._writer_task = None
+
+    def parse_lines(self, lines):
+        """解析 NDJSON 行，返回有效读数列表"""
+        received_at = datetime.now().isoformat(timespec="seconds")
+        rows = []
+        rejected = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                row = parse_reading(json.loads(line), received_at)
+            except ValueError:
+                row = None
+            if row is None:
+                rejected += 1
+            else:
+                rows.append(row)
+        self.stats["accepted"] += len(rows)
+        self.stats["rejected"] += rejected
+        return rows
+
+    async def _writer(self):
+        """从队列中取出读数并按批次大小或刷新间隔写入存储"""
+        buffer = []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - loop.time())
+            try:
+                rows = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                rows = None
+            if rows is _STOP:
+                self.queue.task_done()
+                if buffer:
+                    await self._flush(buffer)
+                return
+            if rows is not None:
+                buffer.extend(rows)
+                self.queue.task_done()
+            if buffer and (len(buffer) >= self.batch_size or loop.time() >= deadline):
+                batch, buffer = buffer, []
+                await self._flush(batch)
+            if loop.time() >= deadline:
+                deadline = loop.time() + self.flush_interval
+
+    async def _flush(self, batch):
+        """写入一个批次；写入失败时整批转入隔离区并记录日志，写入协程继续运行"""
+        self.stats["batches"] += 1
+        try:
+            written = await asyncio.to_thread(self._write, batch)
+        except Exception as error:
+            logger.exception("批次写入失败（%d 条读数），整批转入隔离区", len(batch))
+            self.stats["failed_batches"] += 1
+            try:
+                await asyncio.to_thread(self._quarantine_batch, batch, error)
+            except Exception:
+                logger.exception("隔离区写入失败，丢弃 %d 条读数", len(batch))
+                self.stats["dropped"] += len(batch)
+            else:
+                self.stats["quarantined"] += len(batch)
+            return
+        self.stats["written"] += written
+        self.stats["quarantined"] += len(batch) - written
+
+    def _quarantine_batch(self, batch, error):
+        """将写入失败的整个批次连同异常信息写入隔离区（在线程池中执行）"""
+        import pandas as pd
+
+        from validation import REASON_COLUMN
+
+        rejected = pd.DataFrame(batch, columns=READING_FIELDS)
+        rejected[REASON_COLUMN] = f"批次写入失败: {type(error).__name__}: {error}"
+        self.store.write_quarantine("sensor_readings", rejected)
+
+    def _write(self, batch):
+        """校验并写入一个批次（在线程池中执行），返回写入的读数条数"""
+        if self.validator is None:
+            self.store.write_batch(batch)
+            return len(batch)
+        import pandas as pd
+
+        frame = pd.DataFrame(batch, columns=READING_FIELDS)
+        accepted, rejected = self.validator.split("sensor_readings", frame)
+        if not accepted.empty:
+            # 写入原始读数行，保持上报的取值类型
+            self.store.write_batch([batch[i] for i in accepted.index])
+        self.store.write_quarantine("sensor_readings", rejected)
+        return len(accepted)
+
+    async def handle_tcp(self, reader, writer):
+        """TCP 连接处理：按块读取并拆分为行；队列满时暂停读取形成背压；单行超过上限时断开"""
+        pending = b""
+        try:
+            while True:
+                chunk = await reader.read(READ_CHUNK)
+                if not chunk:
+                    break
+                pending += chunk
+                *lines, pending = pending.split(b"\n")
+                rows = self.parse_lines(lines)
+                if rows:
+                    await self.queue.put(rows)
+                if len(pending) > self.max_line:
+                    # 客户端迟迟不发送换行：丢弃未完成的行并断开，避免缓冲无限增长
+                    self.stats["rejected"] += 1
+                    return
+            rows = self.parse_lines([pending])
+            if rows:
+                await self.queue.put(rows)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_http(self, reader, writer):
+        """最小化 HTTP/1.1 处理：POST /readings 接收读数，GET /stats 返回统计"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length < 0:
+                    raise ValueError("negative content-length")
+                if length > self.max_body:
+                    # 请求体未读取，无法继续复用连接
+                    await self._respond(writer, 413, {"error": f"body exceeds {self.max_body} bytes"}, close=True)
+                    break
+                body = await reader.readexactly(length)
+
+                if method == "POST" and path == "/readings":
+                    status, payload = await self._accept_http_body(body)
+                elif method == "GET" and path == "/stats":
+                    status, payload = 200, self.snapshot_stats()
+                else:
+                    status, payload = 404, {"error": "not found"}
+
+                await self._respond(writer, status, payload)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, payload, close=False):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        extra = "Retry-After: 1\r\n" if status == 503 else ""
+        if close:
+            extra += "Connection: close\r\n"
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n{extra}\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+
+    async def _accept_http_body(self, body):
+        text = body.decode("utf-8").strip()
+        if text.startswith("["):
+            try:
+                items = json.loads(text)
+            except ValueError:
+                return 400, {"error": "invalid json"}
+            lines = [json.dumps(item) for item in items]
+        else:
+            lines = text.splitlines()
+        rows = self.parse_lines(lines)
+        if rows:
+            try:
+                await asyncio.wait_for(self.queue.put(rows), HTTP_PUT_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.stats["throttled"] += len(rows)
+                self.stats["accepted"] -= len(rows)
+                return 503, {"error": "ingest queue full"}
+        return 202, {"accepted": len(rows)}
+
+    def snapshot_stats(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return dict(
+            self.stats,
+            queue_depth=self.queue.qsize(),
+            uptime_s=round(elapsed, 1),
+            written_per_s=round(self.stats["written"] / elapsed, 1),
+        )
+
+    async def serve(self, host="127.0.0.1", tcp_port=9009, http_port=8089):
+        """启动写入协程与 TCP/HTTP 服务，收到 SIGINT/SIGTERM 后写完剩余读数再退出"""
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:  # Windows 事件循环不支持信号处理
+                pass
+
+        self._writer_task = asyncio.create_task(self._writer())
+        servers = []
+        if tcp_port:
+            servers.append(await asyncio.start_server(self.handle_tcp, host, tcp_port))
+        if http_port:
+            servers.append(await asyncio.start_server(self.handle_http, host, http_port))
+        try:
+            await stop.wait()
+        finally:
+            for server in servers:
+                server.close()
+            await self.drain()
+
+    async def drain(self):
+        """停止前将队列中剩余读数全部写入"""
+        try:
+            if self._writer_task:
+                # 停止信号排在所有已入队读数之后；等待写入协程写完最后一批后再关闭存储
+                await self.queue.put(_STOP)
+                await self._writer_task
+        finally:
+            self.store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智慧植保传感器数据接入网关")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--tcp-port", type=int, default=9009, help="NDJSON TCP 端口，0 表示关闭")
+    parser.add_argument("--http-port", type=int, default=8089, help="HTTP 端口，0 表示关闭")
+    parser.add_argument("--data-dir", default=os.path.join("data", "readings"))
+    parser.add_argument("--db", help="写入 SQLite 数据库而不是 CSV 文件")
+    parser.add_argument("--queue-size", type=int, default=256, help="队列容量（以读数批为单位）")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每次写入的最大读数条数")
+    parser.add_argument("--flush-interval", type=float, default=0.5, help="最长刷新间隔（秒）")
+    parser.add_argument("--max-body", type=int, default=MAX_HTTP_BODY, help="HTTP 请求体上限（字节）")
+    parser.add_argument("--max-line", type=int, default=MAX_TCP_LINE, help="TCP 单行上限（字节）")
+    parser.add_argument("--no-validate", action="store_true", help="跳过入库校验（不推荐）")
+    args = parser.parse_args()
+
+    if args.db:
+        from storage import PlantProtectionStore
+
+        store = PlantProtectionStore(args.db)
+    else:
+        store = CsvReadingStore(args.data_dir)
+    validator = None
+    if not args.no_validate:
+        from validation import default_validator
+
+        validator = default_validator()
+
+    gateway = IngestGateway(
+        store,
+        queue_size=args.queue_size,
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
+        validator=validator,
+        max_body=args.max_body,
+        max_line=args.max_line,
+    )
+    endpoints = [f"{name} {args.host}:{port}" for name, port in
+                 (("TCP", args.tcp_port), ("HTTP", args.http_port)) if port]
+    print("接入网关已启动: " + "  ".join(endpoints))
+    try:
+        asyncio.run(gateway.serve(args.host, args.tcp_port, args.http_port))
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(gateway.snapshot_stats(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
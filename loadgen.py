@@ -0,0 +1,141 @@
+"""
+接入网关压测工具
+
+模拟田间诱捕器与气象站设备，通过 TCP（NDJSON）或 HTTP 向 ingest.py 持续上报读数，
+并统计实际发送速率。
+
+用法:
+    python loadgen.py --devices 200 --total 500000
+    python loadgen.py --mode http --port 8089 --rate 20000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+
+TOWNS = ["鲁阳镇", "下汤镇", "梁洼镇", "张官营镇", "尧山镇", "瓦屋镇", "赵村镇", "四棵树乡"]
+FRUITS = ["桃", "苹果", "葡萄", "梨"]
+
+BATCH_LINES = 500  # 每次写入 socket 的读数条数
+
+
+def make_reading(device_id, rng):
+    """生成一条模拟读数"""
+    now = datetime.now().isoformat(timespec="seconds")
+    town = TOWNS[device_id % len(TOWNS)]
+    fruit = FRUITS[device_id % len(FRUITS)]
+    if device_id % 2 == 0:
+        return {
+            "时间": now, "设备编号": f"trap-{device_id:05d}", "类型": "诱捕器",
+            "乡镇": town, "水果类型": fruit, "诱捕数量": rng.randint(0, 60),
+        }
+    return {
+        "时间": now, "设备编号": f"wx-{device_id:05d}", "类型": "气象站",
+        "乡镇": town, "水果类型": fruit,
+        "温度(℃)": round(rng.uniform(5, 35), 1),
+        "相对湿度(%)": round(rng.uniform(30, 100), 1),
+        "叶面湿润(小时)": round(rng.uniform(0, 12), 1),
+        "降雨量(mm)": round(max(0.0, rng.gauss(2, 5)), 1),
+    }
+
+
+def make_payload(device_ids, rng):
+    lines = [json.dumps(make_reading(d, rng), ensure_ascii=False) for d in device_ids]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+async def run_tcp_client(host, port, device_ids, quota, rate, rng, counter):
+    """单个 TCP 连接：循环发送读数直到完成配额"""
+    reader, writer = await asyncio.open_connection(host, port)
+    sent = 0
+    started = time.monotonic()
+    while sent < quota:
+        n = min(BATCH_LINES, quota - sent)
+        writer.write(make_payload([rng.choice(device_ids) for _ in range(n)], rng))
+        # drain 会在网关暂停读取时阻塞，从而体现背压
+        await writer.drain()
+        sent += n
+        counter["sent"] += n
+        if rate:
+            delay = sent / rate - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run_http_client(host, port, device_ids, quota, rate, rng, counter):
+    """单个 HTTP keep-alive 连接：每个请求携带一批 NDJSON 读数"""
+    reader, writer = await asyncio.open_connection(host, port)
+    sent = 0
+    started = time.monotonic()
+    while sent < quota:
+        n = min(BATCH_LINES, quota - sent)
+        body = make_payload([rng.choice(device_ids) for _ in range(n)], rng)
+        writer.write(
+            f"POST /readings HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/x-ndjson\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+        status_line = await reader.readline()
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        await reader.readexactly(length)
+        if b" 503 " in status_line:
+            counter["throttled"] += n
+            await asyncio.sleep(1)
+            continue
+        sent += n
+        counter["sent"] += n
+        if rate:
+            delay = sent / rate - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    counter = {"sent": 0, "throttled": 0}
+    client = run_tcp_client if args.mode == "tcp" else run_http_client
+    port = args.port or (9009 if args.mode == "tcp" else 8089)
+    connections = max(1, min(args.connections, args.devices))
+    device_ids = list(range(args.devices))
+    quota = args.total // connections
+    per_conn_rate = args.rate / connections if args.rate else 0
+
+    started = time.monotonic()
+    await asyncio.gather(*(
+        client(args.host, port, device_ids[i::connections], quota, per_conn_rate,
+               random.Random(rng.random()), counter)
+        for i in range(connections)
+    ))
+    elapsed = time.monotonic() - started
+    print(f"发送读数 {counter['sent']:,} 条，用时 {elapsed:.2f} 秒，"
+          f"速率 {counter['sent'] / elapsed:,.0f} 条/秒，被限流 {counter['throttled']:,} 条")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智慧植保接入网关压测工具")
+    parser.add_argument("--mode", choices=["tcp", "http"], default="tcp")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="默认 TCP 9009 / HTTP 8089")
+    parser.add_argument("--devices", type=int, default=200, help="模拟设备数量")
+    parser.add_argument("--connections", type=int, default=8, help="并发连接数")
+    parser.add_argument("--total", type=int, default=200000, help="读数总条数")
+    parser.add_argument("--rate", type=float, default=0, help="目标速率（条/秒），0 表示不限速")
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+页面并发会话压测
+
+在同一进程中用 Streamlit AppTest 并行驱动多个无头会话（与单个 app.py 实例的所有会话共享
+st.cache_data / st.cache_resource 缓存的情况一致）。每个会话随机切换版本、修改筛选条件，
+并操作各选项卡中的控件（选择框、复选框、数值输入、按钮），记录每次重跑的耗时。
+st.tabs 中所有选项卡的内容在每次重跑时都会执行，因此每次重跑都覆盖全部选项卡。
+
+输出各类操作的重跑延迟分位数、整体吞吐量与内存增量，用于评估单实例可承载的并发农户数，
+也可在持续集成中通过 --max-p95 / 错误数发现性能退化。没有可操作控件的 "页面控件" 操作不重跑，
+记为跳过，不计入延迟统计。
+
+内存分两部分报告：各会话以默认筛选条件打开时，共享缓存已由预热会话填充，打开阶段的增量
+按会话数平均作为每会话状态的估计；随机操作阶段的增量主要来自新筛选组合写入的共享缓存，
+只报告总量，不按会话平均。
+
+用法:
+    python loadtest.py --sessions 20 --actions 10
+    python loadtest.py --sessions 50 --actions 20 --json loadtest.json --max-p95 3.0
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+
+VERSION_OPTIONS = ["基础版 (免费)", "专业版 (199元/月)", "企业版 (999元/月)"]
+ACTIONS = ("版本切换", "筛选条件", "页面控件")
+PERCENTILES = (50, 90, 95, 99)
+
+
+def rss_bytes():
+    """当前进程常驻内存（字节）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # 非 Linux 平台退化为峰值常驻内存（macOS 单位为字节，其余为 KB）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _option_value(option):
+    """AppTest 中的选项均为字符串，月份等整数选项需要还原"""
+    return int(option) if option.isdigit() else option
+
+
+class Session:
+    """一个模拟农户会话"""
+
+    def __init__(self, app_path, rng, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.app = AppTest.from_file(app_path, default_timeout=timeout)
+        self.rng = rng
+        self.timings = []  # (操作, 耗时秒)
+        self.skipped = []  # 没有执行重跑的操作
+        self.errors = []
+
+    def _run(self, action):
+        started = time.perf_counter()
+        try:
+            self.app.run()
+        except Exception as exc:  # 超时或脚本之外的异常
+            self.errors.append(f"{action}: {exc!r}")
+            return
+        self.timings.append((action, time.perf_counter() - started))
+        for exception in self.app.exception:
+            self.errors.append(f"{action}: {exception.value}")
+
+    def open(self):
+        self._run("首次加载")
+
+    def switch_tier(self):
+        self.app.sidebar.selectbox[0].set_value(self.rng.choice(VERSION_OPTIONS))
+        self._run("版本切换")
+
+    def _pick(self, widget):
+        options = list(widget.options)
+        if not options:
+            return []
+        return [_option_value(o) for o in self.rng.sample(options, self.rng.randint(1, len(options)))]
+
+    def change_filters(self):
+        # 月份、乡镇、水果类型一起修改；病虫害选项依赖所选水果，重跑后再修改
+        filters = self.app.sidebar.multiselect
+        for widget in filters[:3]:
+            widget.set_value(self._pick(widget))
+        self._run("筛选条件")
+        diseases = self.app.sidebar.multiselect[3]
+        diseases.set_value(self._pick(diseases))
+        self._run("筛选条件")
+
+    def touch_widget(self):
+        main = self.app.main
+        candidates = (
+            [("button", w) for w in main.button]
+            + [("selectbox", w) for w in main.selectbox if len(w.options) > 1]
+            + [("checkbox", w) for w in main.checkbox]
+            + [("number_input", w) for w in main.number_input]
+        )
+        if not candidates:
+            self.skipped.append("页面控件")
+            return
+        kind, widget = self.rng.choice(candidates)
+        if kind == "button":
+            widget.click()
+        elif kind == "selectbox":
+            widget.select_index(self.rng.randrange(len(widget.options)))
+        elif kind == "checkbox":
+            widget.set_value(not widget.value)
+        else:
+            widget.increment() if self.rng.random() < 0.5 else widget.decrement()
+        self._run("页面控件")
+
+    def step(self):
+        action = self.rng.choices(ACTIONS, weights=(1, 3, 4))[0]
+        if action == "版本切换":
+            self.switch_tier()
+        elif action == "筛选条件":
+            self.change_filters()
+        else:
+            self.touch_widget()
+
+
+def _session_worker(session, n_actions, think_time):
+    for _ in range(n_actions):
+        try:
+            session.step()
+        except Exception as exc:  # 控件缺失等驱动错误，记录后继续
+            session.errors.append(f"驱动: {exc!r}")
+        if think_time:
+            time.sleep(session.rng.uniform(0, think_time))
+
+
+def run_load_test(app_path="app.py", sessions=10, actions=10, think_time=0.0, seed=42, timeout=300):
+    """
+    运行压测
+
+    返回:
+        dict：各操作的延迟分位数（秒）、吞吐量、错误与内存统计
+    """
+    # 先用一个会话完成模块导入与缓存预热，基线内存不计入会话
+    warmup = Session(app_path, random.Random(seed), timeout)
+    warmup.open()
+    baseline_rss = rss_bytes()
+
+    # 各会话依次完成首次加载：每个 AppTest 首次运行时会编译脚本，CPython 3.11 并发 ast.parse 不安全；
+    # 真实服务中脚本只编译一次，不存在这个问题
+    rng = random.Random(seed)
+    pool = [Session(app_path, random.Random(rng.random()), timeout) for _ in range(sessions)]
+    for session in pool:
+        session.open()
+    open_rss = rss_bytes()
+
+    threads = [
+        threading.Thread(target=_session_worker, args=(s, actions, think_time), daemon=True)
+        for s in pool
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    final_rss = rss_bytes()
+
+    timings = [t for s in pool for t in s.timings]
+    report = {
+        "会话数": sessions,
+        "每会话操作数": actions,
+        "耗时(秒)": round(elapsed, 2),
+        "重跑次数": sum(1 for action, _ in timings if action != "首次加载"),
+        "跳过操作数": sum(len(s.skipped) for s in pool),
+        "错误数": sum(len(s.errors) for s in pool),
+        "错误示例": [e for s in pool for e in s.errors][:5],
+        "延迟(秒)": {},
+        "内存": {
+            "基线RSS(MB)": round(baseline_rss / 1024 ** 2, 1),
+            "会话打开后RSS(MB)": round(open_rss / 1024 ** 2, 1),
+            "结束RSS(MB)": round(final_rss / 1024 ** 2, 1),
+            # 默认筛选条件的共享缓存已由预热会话填充，打开阶段的增量近似为会话自身状态
+            "每会话打开增量(MB)": round((open_rss - baseline_rss) / sessions / 1024 ** 2, 2),
+            # 随机操作阶段的增量包含新筛选组合写入的共享缓存，不按会话平均
+            "操作阶段增量(MB)": round((final_rss - open_rss) / 1024 ** 2, 1),
+        },
+    }
+    report["吞吐量(次/秒)"] = round(report["重跑次数"] / elapsed, 2) if elapsed > 0 else 0.0
+    for action in ("首次加载",) + ACTIONS + ("全部",):
+        values = np.array([d for a, d in timings if a == action or (action == "全部" and a != "首次加载")])
+        if values.size == 0:
+            continue
+        stats = {"次数": int(values.size)}
+        stats.update({f"p{p}": round(float(np.percentile(values, p)), 3) for p in PERCENTILES})
+        stats["最大"] = round(float(values.max()), 3)
+        report["延迟(秒)"][action] = stats
+    return report
+
+
+def print_report(report):
+    print(f"会话数 {report['会话数']} · 每会话 {report['每会话操作数']} 次操作 · "
+          f"重跑 {report['重跑次数']} 次 · 跳过 {report['跳过操作数']} 次 · 耗时 {report['耗时(秒)']} 秒 · "
+          f"错误 {report['错误数']}")
+    print(f"吞吐量 {report['吞吐量(次/秒)']} 次重跑/秒")
+    header = ["操作", "次数"] + [f"p{p}" for p in PERCENTILES] + ["最大"]
+    print("".join(f"{h:>10}" for h in header))
+    for action, stats in report["延迟(秒)"].items():
+        print(f"{action:>8}" + "".join(f"{stats[h]:>10}" for h in header[1:]))
+    memory = report["内存"]
+    print(f"内存 基线 {memory['基线RSS(MB)']}MB → 会话打开后 {memory['会话打开后RSS(MB)']}MB → "
+          f"结束 {memory['结束RSS(MB)']}MB")
+    print(f"每会话打开约 {memory['每会话打开增量(MB)']}MB；操作阶段共增长 {memory['操作阶段增量(MB)']}MB"
+          "（含共享缓存）")
+    for error in report["错误示例"]:
+        print("错误:", error)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智慧植保页面并发会话压测")
+    parser.add_argument("--app", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"))
+    parser.add_argument("--sessions", type=int, default=10, help="并发会话数")
+    parser.add_argument("--actions", type=int, default=10, help="每个会话的操作次数")
+    parser.add_argument("--think-time", type=float, default=0.0, help="操作间最长随机停顿（秒）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=300, help="单次重跑超时（秒）")
+    parser.add_argument("--json", help="将报告写入 JSON 文件")
+    parser.add_argument("--max-p95", type=float, help="全部重跑的 p95 延迟上限（秒），超出时以非零状态退出")
+    args = parser.parse_args()
+
+    report = run_load_test(args.app, args.sessions, args.actions, args.think_time, args.seed, args.timeout)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failed = report["错误数"] > 0
+    p95 = report["延迟(秒)"].get("全部", {}).get("p95")
+    if args.max_p95 is not None and p95 is not None and p95 > args.max_p95:
+        print(f"p95 延迟 {p95}s 超过上限 {args.max_p95}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
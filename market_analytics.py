@@ -0,0 +1,127 @@
+"""
+病虫害损失 × 市场价格联动分析
+
+观测数据中的经济损失按静态的 fruit_economic_value 估算。本模块将观测与各水果逐月的市场价格关联：
+按 月度市场价格 / 静态估值 的价格系数重新估算损失（损失对价格线性，任意分组的调整损失
+都可由 水果类型 × 月份 粒度的合计乘以系数再汇总得到），并计算病虫害压力与价格、销量、产量之间
+的滞后相关系数。所有计算均按 水果类型 × 月份 的二维数组向量化完成。本模块不依赖 Streamlit。
+"""
+
+import numpy as np
+import pandas as pd
+
+from views import build_cube, rollup
+
+MONTHS = np.arange(1, 13)
+MARKET_INDICATORS = {"价格(元/公斤)": "mean", "销量(吨)": "sum", "产量(吨)": "sum"}
+PRESSURE_COLUMN = "病虫害压力指数"
+ADJUSTED_LOSS_COLUMN = "市场调整损失(元)"
+DEFAULT_LAGS = (0, 1, 2, 3)
+
+
+def price_factors(market, base_values):
+    """
+    各 (水果类型, 月份) 的月度市场价格与价格系数（市场价格 / 静态估值）
+
+    参数:
+        base_values: {水果类型: 静态估值(元/公斤)}，即生成损失时使用的 fruit_economic_value
+    """
+    monthly = market.groupby(["水果类型", "月份"], observed=True).agg(MARKET_INDICATORS).reset_index()
+    monthly["水果类型"] = monthly["水果类型"].astype(str)
+    base = monthly["水果类型"].map(base_values).astype(float)
+    monthly["静态估值(元/公斤)"] = base
+    monthly["价格系数"] = monthly["价格(元/公斤)"] / base.where(base > 0)
+    return monthly
+
+
+def adjust_losses(frame, factors):
+    """
+    为含 水果类型、月份、经济损失(元) 的表追加市场价格与调整损失；
+    无当月价格的组合沿用静态估值（系数为 1）
+    """
+    keys = frame[["水果类型", "月份"]].astype({"水果类型": str, "月份": int})
+    joined = keys.merge(factors[["水果类型", "月份", "价格(元/公斤)", "价格系数"]],
+                        on=["水果类型", "月份"], how="left")
+    result = frame.copy()
+    result["市场价格(元/公斤)"] = joined["价格(元/公斤)"].to_numpy()
+    factor = joined["价格系数"].fillna(1.0).to_numpy()
+    result["价格系数"] = factor
+    result[ADJUSTED_LOSS_COLUMN] = result["经济损失(元)"].to_numpy(dtype=float) * factor
+    return result
+
+
+def market_adjusted_losses(cube, factors, group_by):
+    """
+    从汇总立方体按 group_by 计算静态损失与市场调整损失
+
+    参数:
+        cube: views.build_cube 的输出（可为已按筛选条件投影的立方体）
+    """
+    group_by = list(group_by)
+    detail_keys = list(dict.fromkeys(group_by + ["水果类型", "月份"]))
+    detail = adjust_losses(rollup(cube, detail_keys, {"经济损失(元)": "sum"}), factors)
+    columns = ["经济损失(元)", ADJUSTED_LOSS_COLUMN]
+    if group_by:
+        result = detail.groupby(group_by, observed=True)[columns].sum().reset_index()
+    else:
+        result = detail[columns].sum().to_frame().T
+    result["调整幅度(%)"] = (result[ADJUSTED_LOSS_COLUMN] / result["经济损失(元)"].where(result["经济损失(元)"] > 0) - 1) * 100
+    return result
+
+
+def _to_grid(frame, column, fruits):
+    """整理为 [水果 × 月份] 数组；缺失月份为 NaN"""
+    grid = frame.pivot_table(index="水果类型", columns="月份", values=column, aggfunc="mean", observed=True)
+    return grid.reindex(index=fruits, columns=MONTHS).to_numpy(dtype=float)
+
+
+def _rowwise_corr(x, y):
+    """逐行 Pearson 相关系数（忽略任一方为 NaN 的月份），返回 (相关系数, 样本数)"""
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    n = valid.sum(axis=1)
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = x.sum(axis=1) / n
+        mean_y = y.sum(axis=1) / n
+        dx = np.where(valid, x - mean_x[:, None], 0.0)
+        dy = np.where(valid, y - mean_y[:, None], 0.0)
+        corr = (dx * dy).sum(axis=1) / np.sqrt((dx * dx).sum(axis=1) * (dy * dy).sum(axis=1))
+    return np.where(n >= 3, corr, np.nan), n
+
+
+def lagged_correlations(cube, factors, lags=DEFAULT_LAGS):
+    """
+    各水果病虫害压力（严重程度均值 × 发生频次均值）与 lag 个月后的市场指标的相关系数
+
+    返回:
+        DataFrame：水果类型、市场指标、滞后(月)、相关系数、样本数
+    """
+    pressure = rollup(cube, ["水果类型", "月份"], {"严重程度": "mean", "月均发生频次": "mean"})
+    pressure["水果类型"] = pressure["水果类型"].astype(str)
+    pressure[PRESSURE_COLUMN] = pressure["严重程度"] * pressure["月均发生频次"]
+    fruits = sorted(set(pressure["水果类型"]) & set(factors["水果类型"]))
+    if not fruits:
+        return pd.DataFrame(columns=["水果类型", "市场指标", "滞后(月)", "相关系数", "样本数"])
+
+    p = _to_grid(pressure, PRESSURE_COLUMN, fruits)
+    rows = []
+    for indicator in MARKET_INDICATORS:
+        x = _to_grid(factors, indicator, fruits)
+        for lag in lags:
+            # 压力在第 t 月，市场指标在第 t + lag 月
+            corr, n = _rowwise_corr(p[:, :len(MONTHS) - lag], x[:, lag:])
+            rows.append(pd.DataFrame({"水果类型": fruits, "市场指标": indicator, "滞后(月)": lag,
+                                      "相关系数": corr, "样本数": n}))
+    return pd.concat(rows, ignore_index=True)
+
+
+def market_impact(observations, market, base_values, lags=DEFAULT_LAGS):
+    """
+    一次计算价格系数与全县数据上的滞后相关系数
+
+    返回:
+        (factors, correlations)
+    """
+    factors = price_factors(market, base_values)
+    return factors, lagged_correlations(build_cube(observations), factors, lags)
@@ -0,0 +1,177 @@
+"""
+防治预算优化分配
+
+根据观测数据中各 (乡镇, 水果类型, 病虫害类型) 的预期损失，结合 solution_db 中的防治成本区间与防治效果，
+在给定预算下为每个单元格选择一种防治方案（或不防治），使挽回损失最大。
+
+方案成本 = 防治面积(亩) × solution_db 成本区间的单价（下限 / 中值 / 上限，元/亩）。观测数据没有面积，
+防治面积由观测防治成本按区间中值单价折算（即把观测成本视为标准方案的支出）。solution_db 只给出
+一个有效率，作为标准方案的有效率；经济与强化方案的有效率按 TREATMENT_OPTIONS 中的假设折算。
+
+问题是多选择背包：每个单元格的方案按成本排序后取收益的上凸包，凸包上的增量按
+"挽回损失/新增成本" 降序排列后贪心选取，等价于线性规划松弛的最优解；
+最后用剩余预算补选仍放得下的增量。单元格数上万时也可在百毫秒级完成。
+"""
+
+import numpy as np
+import pandas as pd
+
+from simulation import CELL_KEYS, parse_cost_range, parse_percent
+
+# 防治方案：(名称, 成本区间取价, 有效率函数)；有效率函数的参数为 solution_db 报告的有效率
+#   经济防治按区间下限单价，有效率假设为报告值的 60%
+#   标准防治按区间中值单价，有效率即报告值
+#   强化防治按区间上限单价，假设可再消除剩余损失的一半
+TREATMENT_OPTIONS = [
+    ("经济防治", "下限", lambda base: 0.6 * base),
+    ("标准防治", "中值", lambda base: base),
+    ("强化防治", "上限", lambda base: base + (1 - base) * 0.5),
+]
+NO_TREATMENT = "不防治"
+DEFAULT_COST_SPREAD = 0.2  # solution_db 缺少成本区间时，下限/上限单价按中值 ±20% 处理
+
+
+def build_options(df, solution_db):
+    """
+    生成候选方案表
+
+    返回:
+        (cells, options)：cells 为单元格预期损失，options 为每个单元格每个方案的成本与挽回损失
+    """
+    cells = df.groupby(CELL_KEYS, observed=True).agg(
+        预期损失=("经济损失(元)", "sum"),
+        标准成本=("防治成本(元)", "sum"),
+    ).reset_index()
+    cells = cells[cells["预期损失"] > 0].reset_index(drop=True)
+
+    # 每种病虫害只解析一次方案参数，再按病虫害展开到单元格
+    diseases = cells["病虫害类型"].astype(str)
+    params = {}
+    for disease in diseases.unique():
+        solution = solution_db.get(disease, {})
+        low, high = parse_cost_range(solution.get("防治成本"))
+        params[disease] = {"有效率": parse_percent(solution.get("效果评估")),
+                           "下限": low, "中值": (low + high) / 2, "上限": high}
+    lookup = pd.DataFrame.from_dict(params, orient="index").loc[diseases.to_numpy()]
+    base_efficacy = lookup["有效率"].to_numpy(dtype=float)
+    mid = lookup["中值"].to_numpy(dtype=float)
+    # 相对中值的单价；防治面积 × 中值单价 = 观测防治成本，因此方案成本 = 观测成本 × 相对单价
+    relative_price = {
+        "下限": np.nan_to_num(lookup["下限"].to_numpy(dtype=float) / mid, nan=1 - DEFAULT_COST_SPREAD),
+        "中值": np.ones(len(cells)),
+        "上限": np.nan_to_num(lookup["上限"].to_numpy(dtype=float) / mid, nan=1 + DEFAULT_COST_SPREAD),
+    }
+    cells["防治面积(亩)"] = cells["标准成本"].to_numpy(dtype=float) / mid
+
+    loss = cells["预期损失"].to_numpy(dtype=float)
+    cost = cells["标准成本"].to_numpy(dtype=float)
+    n_cells, n_options = len(cells), len(TREATMENT_OPTIONS)
+    options = pd.DataFrame({
+        "单元格": np.repeat(np.arange(n_cells), n_options),
+        "方案": np.tile([name for name, _, _ in TREATMENT_OPTIONS], n_cells),
+        "成本": np.concatenate([cost * relative_price[point] for _, point, _ in TREATMENT_OPTIONS]
+                             ).reshape(n_options, n_cells).T.reshape(-1),
+        "挽回损失": np.concatenate([loss * np.clip(fn(base_efficacy), 0, 1) for _, _, fn in TREATMENT_OPTIONS]
+                               ).reshape(n_options, n_cells).T.reshape(-1),
+    })
+    return cells, options
+
+
+def _hull_increments(options):
+    """每个单元格方案的上凸包增量：(单元格, 方案, 新增成本, 新增挽回损失)"""
+    options = options.sort_values(["单元格", "成本"], kind="stable")
+    cell_ids = options["单元格"].to_numpy()
+    costs = options["成本"].to_numpy()
+    gains = options["挽回损失"].to_numpy()
+    names = options["方案"].to_numpy()
+    bounds = np.flatnonzero(np.r_[True, cell_ids[1:] != cell_ids[:-1], True])
+
+    rows = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        # 单调链求上凸包，起点为 "不防治" (0, 0)
+        hull = [(0.0, 0.0, None)]
+        for c, g, name in zip(costs[start:end], gains[start:end], names[start:end]):
+            if g <= hull[-1][1]:
+                continue  # 成本更高但收益不增加的方案被支配
+            while len(hull) >= 2:
+                (c1, g1, _), (c2, g2, _) = hull[-2], hull[-1]
+                if (g2 - g1) * (c - c1) <= (g - g1) * (c2 - c1):
+                    hull.pop()
+                else:
+                    break
+            hull.append((c, g, name))
+        cell = cell_ids[start]
+        for (c1, g1, _), (c2, g2, name) in zip(hull[:-1], hull[1:]):
+            rows.append((cell, name, c2 - c1, g2 - g1, len(rows)))
+    increments = pd.DataFrame(rows, columns=["单元格", "方案", "新增成本", "新增挽回", "序号"])
+    # 零成本增量（凸包上收益必为正）效率记为无穷大，排在最前，保证同一单元格的增量按凸包顺序选取
+    increments["效率"] = np.where(
+        increments["新增成本"] > 0,
+        increments["新增挽回"] / increments["新增成本"].where(increments["新增成本"] > 0),
+        np.inf,
+    )
+    return increments
+
+
+def optimize_allocation(cells, options, budget):
+    """
+    在预算内选择各单元格的防治方案
+
+    返回:
+        (allocation, summary)：allocation 为每个单元格选定的方案、成本与挽回损失；
+        summary 包含预算使用、挽回损失合计以及线性规划上界
+    """
+    allocation = cells[CELL_KEYS + ["预期损失"]].copy()
+    allocation["方案"] = NO_TREATMENT
+    allocation["投入成本"] = 0.0
+    allocation["挽回损失"] = 0.0
+    summary = {"预算": float(budget), "已用预算": 0.0, "挽回损失": 0.0, "上界": 0.0, "防治单元数": 0}
+    if cells.empty or budget < 0:
+        return allocation, summary
+
+    increments = _hull_increments(options)
+    # 同一单元格的凸包增量效率递减，按效率降序排序后同单元格增量仍保持先后顺序
+    increments = increments.sort_values(["效率", "序号"], ascending=[False, True], kind="stable").reset_index(drop=True)
+    cum_cost = increments["新增成本"].cumsum().to_numpy()
+    n_prefix = int(np.searchsorted(cum_cost, budget, side="right"))
+
+    taken = np.zeros(len(increments), dtype=bool)
+    taken[:n_prefix] = True
+    spent = cum_cost[n_prefix - 1] if n_prefix else 0.0
+
+    # 线性规划松弛上界：前缀全部选取 + 下一个增量按比例选取
+    upper = increments["新增挽回"].to_numpy()[:n_prefix].sum()
+    if n_prefix < len(increments):
+        nxt = increments.iloc[n_prefix]
+        upper += nxt["新增挽回"] * (budget - spent) / nxt["新增成本"]
+
+    # 剩余预算补选：单元格的前一个增量已选取时才能选后一个
+    blocked = set(increments["单元格"].to_numpy()[n_prefix:n_prefix + 1])
+    inc_cells = increments["单元格"].to_numpy()
+    inc_costs = increments["新增成本"].to_numpy()
+    for i in range(n_prefix + 1, len(increments)):
+        cell = inc_cells[i]
+        if cell in blocked:
+            continue
+        if spent + inc_costs[i] <= budget:
+            taken[i] = True
+            spent += inc_costs[i]
+        else:
+            blocked.add(cell)
+
+    chosen = increments[taken]
+    per_cell = chosen.groupby("单元格").agg(
+        投入成本=("新增成本", "sum"),
+        挽回损失=("新增挽回", "sum"),
+        方案=("方案", "last"),
+    )
+    allocation.loc[per_cell.index, ["投入成本", "挽回损失", "方案"]] = per_cell[["投入成本", "挽回损失", "方案"]].to_numpy()
+    allocation[["投入成本", "挽回损失"]] = allocation[["投入成本", "挽回损失"]].astype(float)
+
+    summary.update({
+        "已用预算": float(spent),
+        "挽回损失": float(allocation["挽回损失"].sum()),
+        "上界": float(max(upper, allocation["挽回损失"].sum())),
+        "防治单元数": int((allocation["方案"] != NO_TREATMENT).sum()),
+    })
+    return allocation, summary
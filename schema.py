@@ -0,0 +1,146 @@
+"""
+紧凑数据类型
+
+为各数据表定义紧凑的列类型：乡镇、水果类型、病虫害类型等低基数字符串使用 category，
+月份、严重程度等小整数使用 int8/int16，经纬度、产销量等使用 float32；金额与单价（"(元" 列）保持 float64，
+避免大额合计丢失分位精度。整数列转换前检查取值范围，超出紧凑类型时自动改用更宽的类型；
+含空值的整数列改用可空整数类型（Int8/Int16 ...）。
+筛选、分组与缓存都作用在更小的数据上，并提供逐表的内存占用报告。
+"""
+
+import numpy as np
+import pandas as pd
+
+# 传感器读数字段（与 sensor_readings 表列名一致，接入网关按此顺序排列读数）
+READING_FIELDS = [
+    "时间", "设备编号", "类型", "乡镇", "水果类型",
+    "诱捕数量", "温度(℃)", "相对湿度(%)", "叶面湿润(小时)", "降雨量(mm)",
+]
+READING_TYPES = {"诱捕器", "气象站"}
+
+COMPACT_SCHEMAS = {
+    "observations": {
+        "月份": "int8",
+        "乡镇": "category",
+        "纬度": "float32",
+        "经度": "float32",
+        "水果类型": "category",
+        "病虫害类型": "category",
+        "月均发生频次": "int16",
+        "严重程度": "int8",
+        "经济损失(元)": "float64",
+        "防治成本(元)": "float64",
+    },
+    "market_prices": {
+        "月份": "int8",
+        "水果类型": "category",
+        "价格(元/公斤)": "float64",
+        "销量(吨)": "float32",
+        "产量(吨)": "float32",
+        "市场需求指数": "float32",
+        "库存水平": "float32",
+    },
+    "regional_market": {
+        "乡镇": "category",
+        "水果类型": "category",
+        "区域产量(吨)": "int16",
+        "品质等级": "int8",
+        "市场份额": "float32",
+        "运输成本(元/公斤)": "float64",
+    },
+    "sensor_readings": {
+        "设备编号": "category",
+        "类型": "category",
+        "乡镇": "category",
+        "水果类型": "category",
+        "诱捕数量": "Int16",
+        "温度(℃)": "float32",
+        "相对湿度(%)": "float32",
+        "叶面湿润(小时)": "float32",
+        "降雨量(mm)": "float32",
+    },
+}
+
+
+# 取值超出紧凑类型范围时依次尝试的更宽类型
+WIDER_DTYPES = {
+    "int8": ("int16", "int32", "int64"),
+    "int16": ("int32", "int64"),
+    "int32": ("int64",),
+    "Int8": ("Int16", "Int32", "Int64"),
+    "Int16": ("Int32", "Int64"),
+    "Int32": ("Int64",),
+    "float32": ("float64",),
+}
+# 列中含空值时改用的可空整数类型（numpy 整数类型无法表示 NaN）
+NULLABLE_DTYPES = {"int8": "Int8", "int16": "Int16", "int32": "Int32", "int64": "Int64"}
+
+
+def _fits(series, dtype):
+    """列的取值范围是否在 dtype 可表示的范围内（空列、非数值列视为可以转换）"""
+    if not pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+        return True
+    low, high = series.min(), series.max()
+    if pd.isna(low) or pd.isna(high):
+        return True
+    numpy_dtype = np.dtype(dtype.lower())
+    info = np.iinfo(numpy_dtype) if numpy_dtype.kind == "i" else np.finfo(numpy_dtype)
+    return info.min <= low and high <= info.max
+
+
+def fitting_dtype(series, dtype):
+    """series 可无溢出转换的最紧凑类型：dtype 本身或 WIDER_DTYPES 中第一个放得下的类型；含空值的整数列用可空类型"""
+    if dtype in NULLABLE_DTYPES and series.isna().any():
+        dtype = NULLABLE_DTYPES[dtype]
+    if dtype not in WIDER_DTYPES:
+        return dtype
+    for candidate in (dtype,) + WIDER_DTYPES[dtype]:
+        if _fits(series, candidate):
+            return candidate
+    return WIDER_DTYPES[dtype][-1]
+
+
+def compact(frame, table):
+    """按表的紧凑类型转换列（超出范围的列改用更宽的类型，含空值的整数列改用可空类型）；不在定义中的列保持不变"""
+    schema = COMPACT_SCHEMAS.get(table, {})
+    dtypes = {col: fitting_dtype(frame[col], dtype) for col, dtype in schema.items() if col in frame.columns}
+    if not dtypes:
+        return frame
+    return frame.astype(dtypes)
+
+
+def widen(frame):
+    """还原为默认宽类型（object 字符串、int64、float64），用于对比内存占用"""
+    dtypes = {}
+    for col, dtype in frame.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(dtype):
+            dtypes[col] = object
+        elif pd.api.types.is_integer_dtype(dtype):
+            dtypes[col] = "Int64" if frame[col].isna().any() else np.int64
+        elif pd.api.types.is_float_dtype(dtype):
+            dtypes[col] = np.float64
+    return frame.astype(dtypes)
+
+
+def memory_report(frames):
+    """
+    各表内存占用报告
+
+    参数:
+        frames: {表名: DataFrame}，DataFrame 可以是紧凑类型或默认类型
+
+    返回:
+        DataFrame，包含行数、默认类型内存、紧凑类型内存与压缩倍数
+    """
+    rows = []
+    for table, frame in frames.items():
+        wide_bytes = widen(frame).memory_usage(index=False, deep=True).sum()
+        compact_bytes = compact(frame, table).memory_usage(index=False, deep=True).sum()
+        rows.append({
+            "数据表": table,
+            "行数": len(frame),
+            "默认类型(MB)": wide_bytes / 1024 ** 2,
+            "紧凑类型(MB)": compact_bytes / 1024 ** 2,
+            "压缩倍数": wide_bytes / compact_bytes if compact_bytes else np.nan,
+        })
+    return pd.DataFrame(rows)
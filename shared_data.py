@@ -0,0 +1,194 @@
+"""
+跨进程共享数据集（Arrow IPC 内存映射）
+
+多个 Streamlit 服务进程部署在负载均衡之后时，数据只写入一次 Arrow IPC（Feather v2）文件，
+各进程以只读方式内存映射，所有进程共享操作系统页缓存中的同一份数据：
+新增进程几乎不增加内存占用，启动时也无需重新生成或加载数据。
+Arrow 文件记录导出时源存储（SQLite）的数据版本，源数据变化后由第一个发现的进程重新导出。
+
+筛选与聚合直接在 Arrow 表上完成，只有筛选结果才会转换为 pandas DataFrame。
+对外提供与 storage.PlantProtectionStore 相同的查询接口，页面可直接切换。
+"""
+
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+from locking import file_lock
+
+DEFAULT_SHARED_DIR = os.environ.get("SPP_SHARED_DATA_DIR", "")
+
+TABLES = ("observations", "market_prices", "regional_market")
+
+# pandas 聚合名称到 Arrow 聚合函数的映射
+AGGREGATES = {"sum": "sum", "mean": "mean", "min": "min", "max": "max", "count": "count"}
+
+
+class SharedDataset:
+    """Arrow IPC 文件目录：一次写入，多进程只读内存映射"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._tables = {}
+        self._versions = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.arrow")
+
+    def _lock(self):
+        """目录级文件锁，保证多个进程同时启动或同时发现源数据变化时只有一个写入"""
+        return file_lock(os.path.join(self.directory, ".lock"))
+
+    def source_version(self):
+        """导出 Arrow 文件时源存储的数据版本；尚未导出时为 None"""
+        try:
+            with open(os.path.join(self.directory, "source_version"), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set_source_version(self, version):
+        path = os.path.join(self.directory, "source_version")
+        with open(path + f".tmp{os.getpid()}", "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(path + f".tmp{os.getpid()}", path)
+
+    def publish(self, name, frame):
+        """写入（或替换）一个表；先写临时文件再原子替换，已映射旧文件的进程不受影响"""
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        tmp_path = self.path(name) + f".tmp{os.getpid()}"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, self.path(name))
+
+    def ensure(self, name, make_frame):
+        """表文件不存在时调用 make_frame 生成并写入；返回是否新写入"""
+        if os.path.exists(self.path(name)):
+            return False
+        with self._lock():
+            if os.path.exists(self.path(name)):
+                return False
+            self.publish(name, make_frame())
+            return True
+
+    def version(self, name):
+        stat = os.stat(self.path(name))
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def table(self, name):
+        """返回内存映射的 Arrow 表；文件被替换后自动重新映射"""
+        version = self.version(name)
+        if self._versions.get(name) != version:
+            source = pa.memory_map(self.path(name), "r")
+            self._tables[name] = ipc.open_file(source).read_all()
+            self._versions[name] = version
+        return self._tables[name]
+
+    def mapped_bytes(self):
+        """各表内存映射的字节数（位于共享页缓存，不计入进程私有内存）"""
+        return {name: table.nbytes for name, table in self._tables.items()}
+
+
+class SharedDataStore:
+    """基于 SharedDataset 的查询接口，与 PlantProtectionStore 保持一致"""
+
+    def __init__(self, directory=DEFAULT_SHARED_DIR, source=None):
+        """
+        参数:
+            source: 源存储（PlantProtectionStore）；提供时 Arrow 文件随源存储的数据版本重新导出
+        """
+        self.dataset = SharedDataset(directory)
+        self.source = source
+        self._synced_version = None
+
+    def seed_if_empty(self, table, make_frame):
+        return self.dataset.ensure(table, make_frame)
+
+    def sync(self):
+        """源存储数据版本与已导出的版本不同时重新导出全部表；返回是否由本进程导出"""
+        if self.source is None:
+            return False
+        version = self.source.version(TABLES)
+        if version == self._synced_version:
+            return False
+        published = False
+        with self.dataset._lock():
+            missing = not all(os.path.exists(self.dataset.path(table)) for table in TABLES)
+            if missing or self.dataset.source_version() != version:
+                for table in TABLES:
+                    self.dataset.publish(table, self.source.load_table(table))
+                self.dataset.set_source_version(version)
+                published = True
+        self._synced_version = version
+        return published
+
+    def version(self, tables=TABLES):
+        """数据集版本标识：先与源存储同步，tables 中任一 Arrow 文件被替换时改变，用作缓存键"""
+        self.sync()
+        return ";".join(
+            "{}={}:{}:{}".format(table, *self.dataset.version(table)) for table in tables
+        )
+
+    def sensor_version(self):
+        """传感器读数不导出到共享数据集，版本取自源存储"""
+        return self.source.sensor_version() if self.source is not None else ""
+
+    @staticmethod
+    def _mask(table, filters):
+        mask = None
+        for column, values in filters.items():
+            if values is None:
+                continue
+            values = list(values)
+            if not values:
+                return pa.array([False] * table.num_rows)
+            value_type = table.schema.field(column).type
+            if pa.types.is_dictionary(value_type):  # category 列以字典编码存储
+                value_type = value_type.value_type
+            value_set = pa.array(values, type=value_type)
+            condition = pc.is_in(table[column], value_set=value_set)
+            mask = condition if mask is None else pc.and_(mask, condition)
+        return mask
+
+    def _select(self, name, filters):
+        table = self.dataset.table(name)
+        mask = self._mask(table, filters)
+        return table if mask is None else table.filter(mask)
+
+    def load_table(self, table):
+        return self.dataset.table(table).to_pandas()
+
+    def load_rows(self, table, offset=0):
+        return self.dataset.table(table).slice(offset).to_pandas()
+
+    def distinct(self, table, column):
+        values = pc.unique(self.dataset.table(table)[column])
+        return sorted(values.to_pylist())
+
+    def query_observations(self, months=None, towns=None, fruits=None, diseases=None):
+        return self._select("observations", {
+            "月份": months, "乡镇": towns, "水果类型": fruits, "病虫害类型": diseases,
+        }).to_pandas()
+
+    def aggregate_observations(self, group_by, metrics, months=None, towns=None, fruits=None, diseases=None):
+        table = self._select("observations", {
+            "月份": months, "乡镇": towns, "水果类型": fruits, "病虫害类型": diseases,
+        })
+        result = table.group_by(group_by).aggregate(
+            [(col, AGGREGATES[how]) for col, how in metrics.items()]
+        )
+        # Arrow 聚合结果列名形如 "经济损失(元)_sum"，还原为原列名
+        result = result.rename_columns(
+            [name if name in group_by else name.rsplit("_", 1)[0] for name in result.column_names]
+        )
+        return result.to_pandas().sort_values(group_by).reset_index(drop=True)[group_by + list(metrics)]
+
+    def query_market(self, months=None, fruits=None):
+        return self._select("market_prices", {"月份": months, "水果类型": fruits}).to_pandas()
+
+    def query_regional_market(self, towns=None, fruits=None):
+        return self._select("regional_market", {"乡镇": towns, "水果类型": fruits}).to_pandas()
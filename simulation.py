@@ -0,0 +1,207 @@
+"""
+防治情景蒙特卡洛模拟
+
+对每个 (乡镇, 水果类型, 病虫害类型) 组合随机抽取病虫害压力、防治效果与水果价格，
+在进程池中并行运行数千次模拟，输出损失与投资回报率的分布及置信区间。
+本模块不依赖 Streamlit，可被页面与批处理任务共同调用。
+"""
+
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# 模拟参数默认值
+DEFAULT_EFFICACY = 0.75        # 缺少方案数据时的默认防治有效率
+EFFICACY_CONCENTRATION = 40.0  # Beta 分布集中度，越大越接近点估计
+PRESSURE_SIGMA = 0.35          # 病虫害压力对数正态波动
+PRICE_SIGMA = 0.15             # 水果价格相对波动
+CHUNK_DRAWS = 2000             # 每个进程任务的模拟次数
+
+CELL_KEYS = ["乡镇", "水果类型", "病虫害类型"]
+
+_executor = None
+
+
+def parse_percent(text, default=DEFAULT_EFFICACY):
+    """解析 "85%有效率" 形式的文本为 0-1 小数"""
+    match = re.search(r"(\d+(?:\.\d+)?)\s*%", str(text or ""))
+    return float(match.group(1)) / 100 if match else default
+
+
+def parse_ratio(text, default=np.nan):
+    """解析 "3.2:1" 形式的投资回报率"""
+    match = re.search(r"(\d+(?:\.\d+)?)\s*:\s*(\d+(?:\.\d+)?)", str(text or ""))
+    if not match or float(match.group(2)) == 0:
+        return default
+    return float(match.group(1)) / float(match.group(2))
+
+
+def parse_cost_range(text):
+    """解析 "中等（200-300元/亩）" 形式的防治成本区间，返回 (下限, 上限)"""
+    match = re.search(r"(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)", str(text or ""))
+    if not match:
+        return np.nan, np.nan
+    return float(match.group(1)), float(match.group(2))
+
+
+def build_scenario_table(df, solution_db, fruit_economic_value):
+    """按 (乡镇, 水果类型, 病虫害类型) 汇总基准损失，并附加方案参数"""
+    cells = df.groupby(CELL_KEYS, observed=True).agg(
+        基准损失=("经济损失(元)", "sum"),
+        基准成本=("防治成本(元)", "sum"),
+    ).reset_index()
+
+    # 每种病虫害只解析一次方案参数，再按病虫害展开到单元格
+    diseases = cells["病虫害类型"].astype(str)
+    params = {}
+    for disease in diseases.unique():
+        solution = solution_db.get(disease, {})
+        low, high = parse_cost_range(solution.get("防治成本"))
+        mid = (low + high) / 2
+        params[disease] = {
+            "防治有效率": parse_percent(solution.get("效果评估")),
+            "报价回报率": parse_ratio(solution.get("投资回报率")),
+            "成本下限系数": low / mid,
+            "成本上限系数": high / mid,
+        }
+    lookup = pd.DataFrame.from_dict(params, orient="index").loc[diseases.to_numpy()]
+    for col in lookup.columns:
+        cells[col] = lookup[col].to_numpy(dtype=float)
+    # 成本相对波动区间，缺少数据时按 ±20% 处理
+    cells["成本下限系数"] = cells["成本下限系数"].fillna(0.8)
+    cells["成本上限系数"] = cells["成本上限系数"].fillna(1.2)
+    cells["参考价格"] = cells["水果类型"].astype(str).map(fruit_economic_value).astype(float)
+    return cells
+
+
+def _simulate_chunk(args):
+    """进程池任务：对一批模拟次数计算每个单元格的剩余损失、挽回损失与成本"""
+    seed, n_draws, base_loss, base_cost, efficacy, cost_low, cost_high, disease_codes = args
+    rng = np.random.default_rng(seed)
+    n_cells = base_loss.shape[0]
+    n_diseases = int(disease_codes.max()) + 1 if n_cells else 0
+
+    # 病虫害压力：同一病虫害在全县共享一部分冲击，乡镇之间再叠加独立波动
+    shared = rng.normal(0.0, PRESSURE_SIGMA * 0.6, size=(n_draws, n_diseases))
+    local = rng.normal(0.0, PRESSURE_SIGMA * 0.8, size=(n_draws, n_cells))
+    pressure = np.exp(shared[:, disease_codes] + local - 0.5 * PRESSURE_SIGMA ** 2)
+
+    price = np.clip(rng.normal(1.0, PRICE_SIGMA, size=(n_draws, n_cells)), 0.1, None)
+
+    alpha = efficacy * EFFICACY_CONCENTRATION
+    beta = (1.0 - efficacy) * EFFICACY_CONCENTRATION
+    treated = rng.beta(alpha, beta, size=(n_draws, n_cells))
+
+    cost = base_cost * rng.uniform(cost_low, cost_high, size=(n_draws, n_cells))
+
+    untreated_loss = base_loss * pressure * price
+    avoided = untreated_loss * treated
+    residual = untreated_loss - avoided
+    return (
+        untreated_loss.astype(np.float32),
+        residual.astype(np.float32),
+        avoided.astype(np.float32),
+        cost.astype(np.float32),
+    )
+
+
+def _get_executor(max_workers):
+    """复用模块级进程池；使用 spawn 避免在多线程的 Streamlit 服务进程中 fork"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def run_monte_carlo(cells, n_draws=5000, seed=42, max_workers=None, confidence=0.9):
+    """
+    运行蒙特卡洛模拟
+
+    参数:
+        cells: build_scenario_table 的输出
+        n_draws: 模拟次数
+        seed: 随机种子，保证结果可复现
+        max_workers: 进程数，默认使用全部CPU核
+        confidence: 置信区间水平
+
+    返回:
+        dict，包含 "county"（全县逐次模拟结果）、"cells"（单元格分布摘要）、"summary"（全县指标）
+    """
+    if cells.empty or n_draws <= 0:
+        return {"county": pd.DataFrame(), "cells": pd.DataFrame(), "summary": {}}
+
+    max_workers = max_workers or os.cpu_count() or 1
+    disease_codes = pd.factorize(cells["病虫害类型"])[0]
+    arrays = (
+        cells["基准损失"].to_numpy(dtype=np.float64),
+        cells["基准成本"].to_numpy(dtype=np.float64),
+        cells["防治有效率"].to_numpy(dtype=np.float64).clip(0.01, 0.99),
+        cells["成本下限系数"].to_numpy(dtype=np.float64),
+        cells["成本上限系数"].to_numpy(dtype=np.float64),
+        disease_codes,
+    )
+
+    sizes = [CHUNK_DRAWS] * (n_draws // CHUNK_DRAWS)
+    if n_draws % CHUNK_DRAWS:
+        sizes.append(n_draws % CHUNK_DRAWS)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(s, n) + arrays for s, n in zip(seeds, sizes)]
+
+    if max_workers == 1 or len(tasks) == 1:
+        parts = [_simulate_chunk(t) for t in tasks]
+    else:
+        parts = list(_get_executor(max_workers).map(_simulate_chunk, tasks))
+
+    untreated, residual, avoided, cost = (np.concatenate(p) for p in zip(*parts))
+
+    lower_q = (1 - confidence) / 2
+    upper_q = 1 - lower_q
+    quantiles = [lower_q, 0.5, upper_q]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cell_roi = np.where(cost > 0, avoided / cost, np.nan)
+
+    cell_summary = cells[CELL_KEYS].copy()
+    loss_q = np.quantile(residual, quantiles, axis=0)
+    # 成本为零的单元格整列为 NaN，np.quantile 会对该列返回 NaN
+    roi_q = np.quantile(cell_roi, quantiles, axis=0)
+    cell_summary["未防治损失均值"] = untreated.mean(axis=0)
+    cell_summary["防治后损失均值"] = residual.mean(axis=0)
+    cell_summary["损失下限"] = loss_q[0]
+    cell_summary["损失中位数"] = loss_q[1]
+    cell_summary["损失上限"] = loss_q[2]
+    cell_summary["ROI下限"] = roi_q[0]
+    cell_summary["ROI中位数"] = roi_q[1]
+    cell_summary["ROI上限"] = roi_q[2]
+    cell_summary["报价回报率"] = cells["报价回报率"].to_numpy()
+
+    county = pd.DataFrame({
+        "未防治损失": untreated.sum(axis=1, dtype=np.float64),
+        "防治后损失": residual.sum(axis=1, dtype=np.float64),
+        "挽回损失": avoided.sum(axis=1, dtype=np.float64),
+        "防治成本": cost.sum(axis=1, dtype=np.float64),
+    })
+    county["投资回报率"] = county["挽回损失"] / county["防治成本"].where(county["防治成本"] > 0)
+
+    def band(series):
+        values = series.dropna().to_numpy()
+        if values.size == 0:
+            return (np.nan, np.nan, np.nan)
+        return tuple(np.quantile(values, quantiles))
+
+    summary = {
+        "模拟次数": int(n_draws),
+        "置信水平": confidence,
+        "未防治损失": band(county["未防治损失"]),
+        "防治后损失": band(county["防治后损失"]),
+        "投资回报率": band(county["投资回报率"]),
+        "盈利概率": float((county["挽回损失"] > county["防治成本"]).mean()),
+    }
+    return {"county": county, "cells": cell_summary, "summary": summary}
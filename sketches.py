@@ -0,0 +1,188 @@
+"""
+可合并的分位数草图
+
+按汇总立方体的每个单元 (月份, 乡镇, 水果类型, 病虫害类型) 为各度量保存一份对数分桶直方图
+（DDSketch 的分桶方式）：取值 x 落入第 ceil(log_γ x) 个桶，γ = (1 + α) / (1 − α)，
+由桶还原的分位数相对误差不超过 α。严重程度等小整数按取值直接分桶，结果精确。
+
+草图以长表 (单元维度..., 度量, 桶, 计数) 保存，合并即按桶求和，因此：
+    - 任意筛选条件的分位数 = 选中单元的草图合并后查询，不需要对明细排序；
+    - 新数据只需计算自身的草图再与已有草图合并（增量更新，见 SketchAccumulator）。
+所有计算均为整列向量化。本模块不依赖 Streamlit。
+"""
+
+import numpy as np
+import pandas as pd
+
+from views import CUBE_KEYS
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = np.log(GAMMA)
+MIN_POSITIVE = 1e-9      # 不大于该值的取值计入零值桶
+ZERO_BUCKET = -(2 ** 31)
+
+# 度量的分桶方式：log 为对数分桶（非负连续值），exact 为按整数取值分桶
+SKETCH_MEASURES = {"经济损失(元)": "log", "防治成本(元)": "log", "严重程度": "exact", "月均发生频次": "exact"}
+MEASURE_COLUMN = "度量"
+BUCKET_COLUMN = "桶"
+COUNT_COLUMN = "计数"
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def bucket_index(values, kind):
+    """取值 → 桶编号"""
+    values = np.asarray(values, dtype=float)
+    if kind == "exact":
+        return np.rint(values).astype(np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        index = np.ceil(np.log(values) / LOG_GAMMA)
+    return np.where(values > MIN_POSITIVE, index, ZERO_BUCKET).astype(np.int64)
+
+
+def bucket_value(index, kind):
+    """桶编号 → 代表值（对数桶取使相对误差最小的 2γ^i / (γ + 1)）"""
+    index = np.asarray(index, dtype=np.int64)
+    if kind == "exact":
+        return index.astype(float)
+    value = 2 * np.power(GAMMA, index.astype(float)) / (GAMMA + 1)
+    return np.where(index == ZERO_BUCKET, 0.0, value)
+
+
+def build_sketches(observations, keys=CUBE_KEYS, measures=SKETCH_MEASURES):
+    """
+    计算每个单元各度量的草图
+
+    返回:
+        DataFrame：keys、度量、桶、计数，每行为一个单元一个度量的一个非空桶
+    """
+    keys = list(keys)
+    parts = []
+    for measure, kind in measures.items():
+        if measure not in observations:
+            continue
+        values = observations[measure].to_numpy(dtype=float, na_value=np.nan)
+        valid = ~np.isnan(values)
+        frame = observations.loc[valid, keys].copy()
+        frame[BUCKET_COLUMN] = bucket_index(values[valid], kind)
+        counts = frame.groupby(keys + [BUCKET_COLUMN], observed=True).size().rename(COUNT_COLUMN).reset_index()
+        counts.insert(len(keys), MEASURE_COLUMN, measure)
+        parts.append(counts)
+    if not parts:
+        return pd.DataFrame(columns=keys + [MEASURE_COLUMN, BUCKET_COLUMN, COUNT_COLUMN])
+    return merge_sketches(*parts, keys=keys)
+
+
+def merge_sketches(*sketches, keys=CUBE_KEYS):
+    """合并草图（相同单元、度量、桶的计数相加），用于增量更新"""
+    combined = pd.concat([s for s in sketches if not s.empty], ignore_index=True)
+    if combined.empty:
+        return sketches[0]
+    group = list(keys) + [MEASURE_COLUMN, BUCKET_COLUMN]
+    merged = combined.groupby(group, observed=True, sort=False)[COUNT_COLUMN].sum().reset_index()
+    merged[MEASURE_COLUMN] = merged[MEASURE_COLUMN].astype("category")
+    return merged
+
+
+class SketchAccumulator:
+    """
+    追加写入的表的增量草图：记住已合并的行数，每次只读取并合并其后新增的行
+
+    用已合并的最后一行核对表没有被整表替换（替换或删除行后该行不再位于原位置），否则全部重建。
+    """
+
+    def __init__(self, keys=CUBE_KEYS, measures=SKETCH_MEASURES):
+        self.keys = list(keys)
+        self.measures = measures
+        self._reset()
+
+    def _reset(self):
+        self.rows = 0
+        self._last_row = None
+        self.sketches = pd.DataFrame(columns=self.keys + [MEASURE_COLUMN, BUCKET_COLUMN, COUNT_COLUMN])
+
+    def update(self, load_rows):
+        """
+        合并新增的行
+
+        参数:
+            load_rows: load_rows(offset) 返回表中第 offset 行（从 0 开始，按写入顺序）及之后的所有行
+
+        返回:
+            当前全表的草图
+        """
+        start = max(self.rows - 1, 0)
+        rows = load_rows(start)
+        if self.rows and (rows.empty or _row_key(rows.iloc[0]) != self._last_row):
+            self._reset()
+            start, rows = 0, load_rows(0)
+        new = rows.iloc[self.rows - start:]
+        if not new.empty:
+            sketches = build_sketches(new, self.keys, self.measures)
+            self.sketches = merge_sketches(self.sketches, sketches, keys=self.keys)
+            self.rows = start + len(rows)
+            self._last_row = _row_key(rows.iloc[-1])
+        return self.sketches
+
+
+def _row_key(row):
+    return repr(row.tolist())
+
+
+def select(sketches, filters):
+    """按 {维度列: 取值列表} 选出单元的草图；取值为 None 表示不限"""
+    mask = np.ones(len(sketches), dtype=bool)
+    for column, values in filters.items():
+        if values is not None:
+            mask &= sketches[column].isin(list(values)).to_numpy()
+    return sketches[mask]
+
+
+def histogram(sketches, measure, group_by=()):
+    """
+    合并选中单元后某度量的分布
+
+    返回:
+        DataFrame：group_by 列、桶、代表值、计数（按组与桶升序）
+    """
+    group_by = list(group_by)
+    rows = sketches[sketches[MEASURE_COLUMN] == measure]
+    merged = rows.groupby(group_by + [BUCKET_COLUMN], observed=True)[COUNT_COLUMN].sum().reset_index()
+    merged = merged[merged[COUNT_COLUMN] > 0].sort_values(group_by + [BUCKET_COLUMN]).reset_index(drop=True)
+    merged.insert(len(group_by) + 1, "代表值", bucket_value(merged[BUCKET_COLUMN], SKETCH_MEASURES.get(measure, "log")))
+    return merged
+
+
+def quantiles(sketches, measure, group_by=(), qs=DEFAULT_QUANTILES):
+    """
+    由合并后的草图计算各组分位数（DDSketch 取秩 q·(n−1) 所在桶的代表值）
+
+    返回:
+        DataFrame：group_by 列、样本数，以及每个 q 的 pXX 列
+    """
+    group_by = list(group_by)
+    hist = histogram(sketches, measure, group_by)
+    if group_by:
+        codes = hist.groupby(group_by, observed=True, sort=False).ngroup().to_numpy()
+        result = hist.groupby(group_by, observed=True, sort=False)[COUNT_COLUMN].sum().rename("样本数").reset_index()
+    else:
+        codes = np.zeros(len(hist), dtype=np.int64)
+        result = pd.DataFrame({"样本数": [int(hist[COUNT_COLUMN].sum())]})
+    counts = hist[COUNT_COLUMN].to_numpy()
+    values = hist["代表值"].to_numpy()
+    n_groups = len(result)
+    totals = np.bincount(codes, weights=counts, minlength=n_groups)
+    # 组内累计计数：全局累计减去该组之前的累计
+    cumulative = np.cumsum(counts)
+    offsets = np.concatenate([[0], np.cumsum(totals)[:-1]])
+    within = cumulative - offsets[codes]
+    for q in qs:
+        rank = q * (totals - 1)
+        hit = within > rank[codes]
+        # 每组第一个超过秩的桶
+        first = np.full(n_groups, -1)
+        positions = np.flatnonzero(hit)
+        first_positions = pd.Series(positions).groupby(codes[positions]).min()
+        first[first_positions.index.to_numpy()] = first_positions.to_numpy()
+        result[f"p{q * 100:g}"] = np.where(first >= 0, values[np.maximum(first, 0)], np.nan)
+    return result
@@ -0,0 +1,197 @@
+"""
+历史快照与时间回溯存储
+
+按年度（产季）将数据表保存为 zstd 压缩的 Parquet 分区，每次提交只为内容发生变化的年度写入新版本
+（内容哈希相同的年度直接复用上一版本），所有历史版本都保留，可按时间点回溯：
+
+    <dir>/<表名>/manifest.json                         版本清单（原子替换）
+    <dir>/<表名>/<年度>/v<版本号>.parquet               某年度的一个版本
+
+查询时只读取所需年度与列，行组按月份排序，月份、乡镇等筛选条件下推到 Parquet 行组，
+同比查询不需要把所有年度载入内存。本模块不依赖 Streamlit。
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from locking import file_lock
+
+DEFAULT_SNAPSHOT_DIR = os.environ.get("SPP_SNAPSHOT_DIR", os.path.join("data", "snapshots"))
+
+SEASON_COLUMN = "年度"
+# 各表用于划分年度的日期列与行组排序列
+SEASON_SOURCES = {"observations": "日期", "market_prices": "日期", "sensor_readings": "时间"}
+SORT_COLUMNS = {"observations": ["月份", "乡镇"], "market_prices": ["月份"], "sensor_readings": ["时间"]}
+ROW_GROUP_SIZE = 64 * 1024
+
+
+class SnapshotStore:
+    """按年度分区、带版本的历史数据存储"""
+
+    def __init__(self, directory=DEFAULT_SNAPSHOT_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _table_dir(self, table):
+        return os.path.join(self.directory, table)
+
+    def _manifest_path(self, table):
+        return os.path.join(self._table_dir(table), "manifest.json")
+
+    def _lock(self, table):
+        """表级文件锁，多个进程同时提交时串行写入清单"""
+        return file_lock(os.path.join(self._table_dir(table), ".lock"))
+
+    def manifest(self, table):
+        """版本清单：[{年度, 版本, 文件, 行数, 摘要, 提交时间, 说明}]"""
+        try:
+            with open(self._manifest_path(table), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _write_manifest(self, table, entries):
+        path = self._manifest_path(table)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def commit(self, table, frame, note="", committed_at=None):
+        """
+        提交一份数据：按年度拆分，只为内容变化的年度写入新版本
+
+        参数:
+            committed_at: 提交时间（默认当前时间），导入历史数据时可指定
+
+        返回:
+            本次写入的新版本清单项列表（内容未变化时为空）
+        """
+        committed_at = (committed_at or datetime.now()).isoformat(timespec="seconds")
+        seasons = pd.to_datetime(frame[SEASON_SOURCES[table]]).dt.year
+        sort_columns = [col for col in SORT_COLUMNS.get(table, []) if col in frame]
+        written = []
+        with self._lock(table):
+            entries = self.manifest(table)
+            for season, part in frame.groupby(seasons.to_numpy(), sort=True):
+                season = int(season)
+                if sort_columns:
+                    part = part.sort_values(sort_columns, kind="stable")
+                part = part.reset_index(drop=True)
+                digest = hashlib.sha1(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes()).hexdigest()[:16]
+                history = [e for e in entries if e["年度"] == season]
+                if history and history[-1]["摘要"] == digest:
+                    continue
+                version = history[-1]["版本"] + 1 if history else 1
+                relative = os.path.join(str(season), f"v{version:04d}.parquet")
+                path = os.path.join(self._table_dir(table), relative)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                pq.write_table(
+                    pa.Table.from_pandas(part, preserve_index=False), path + ".tmp",
+                    compression="zstd", row_group_size=ROW_GROUP_SIZE, use_dictionary=True,
+                )
+                os.replace(path + ".tmp", path)
+                entry = {"年度": season, "版本": version, "文件": relative, "行数": len(part),
+                         "摘要": digest, "提交时间": committed_at, "说明": note}
+                entries.append(entry)
+                written.append(entry)
+            if written:
+                self._write_manifest(table, entries)
+        return written
+
+    def seasons(self, table, as_of=None):
+        """截至 as_of 已有数据的年度（升序）"""
+        return sorted(self._resolve(table, as_of))
+
+    def entry(self, table, season, as_of=None):
+        """某年度在 as_of 时刻的清单项（含提交时间与说明），没有该年度时返回 None"""
+        return self._resolve(table, as_of).get(season)
+
+    def version(self, table):
+        """清单标识：任一年度提交新版本时改变，用作缓存键"""
+        entries = self.manifest(table)
+        return f"{len(entries)}:{entries[-1]['提交时间'] if entries else ''}"
+
+    def _resolve(self, table, as_of=None):
+        """各年度在 as_of 时刻的最新版本：{年度: 清单项}"""
+        as_of = pd.Timestamp(as_of).isoformat() if as_of is not None else None
+        latest = {}
+        for entry in self.manifest(table):
+            if as_of is None or entry["提交时间"] <= as_of:
+                latest[entry["年度"]] = entry
+        return latest
+
+    def read(self, table, seasons=None, as_of=None, columns=None, filters=None):
+        """
+        读取指定年度在 as_of 时刻的数据
+
+        参数:
+            seasons: 年度列表，None 表示全部年度
+            as_of: 时间点（datetime 或 ISO 字符串），None 表示最新版本
+            columns: 只读取的列
+            filters: {列: 取值列表}，取值为 None 表示不过滤；下推到 Parquet 行组
+
+        返回:
+            DataFrame，附加 年度 列
+        """
+        resolved = self._resolve(table, as_of)
+        if seasons is not None:
+            resolved = {s: e for s, e in resolved.items() if s in set(seasons)}
+        predicate = []
+        for column, values in (filters or {}).items():
+            if values is None:
+                continue
+            values = [v.item() if hasattr(v, "item") else v for v in values]
+            if not values:
+                return pd.DataFrame(columns=list(columns or []) + [SEASON_COLUMN])
+            predicate.append((column, "in", values))
+        parts = []
+        for season, entry in sorted(resolved.items()):
+            data = pq.read_table(os.path.join(self._table_dir(table), entry["文件"]),
+                                 columns=columns, filters=predicate or None)
+            part = data.to_pandas()
+            part[SEASON_COLUMN] = season
+            parts.append(part)
+        if not parts:
+            return pd.DataFrame(columns=list(columns or []) + [SEASON_COLUMN])
+        return pd.concat(parts, ignore_index=True)
+
+    def aggregate(self, table, group_by, metrics, seasons=None, as_of=None, filters=None):
+        """
+        按年度分组聚合；每个年度只读取分组列与度量列
+
+        参数:
+            metrics: {列: "sum" | "mean" | "count" | "min" | "max"}
+        """
+        group_by = [SEASON_COLUMN] + [col for col in group_by if col != SEASON_COLUMN]
+        columns = list(dict.fromkeys([col for col in group_by if col != SEASON_COLUMN] + list(metrics)))
+        frame = self.read(table, seasons, as_of, columns, filters)
+        if frame.empty:
+            return pd.DataFrame(columns=group_by + list(metrics))
+        return frame.groupby(group_by, observed=True).agg(metrics).reset_index()
+
+    def year_over_year(self, table, group_by, metrics, season, baseline, as_of=None, filters=None):
+        """
+        同比：season 与 baseline 两个年度按 group_by 聚合后对齐
+
+        返回:
+            DataFrame：group_by 列，以及每个度量的 本期、同期 与 同比变化(%) 三列
+        """
+        totals = self.aggregate(table, group_by, metrics, [season, baseline], as_of, filters)
+        current = totals[totals[SEASON_COLUMN] == season].drop(columns=SEASON_COLUMN)
+        previous = totals[totals[SEASON_COLUMN] == baseline].drop(columns=SEASON_COLUMN)
+        if group_by:
+            result = current.merge(previous, on=list(group_by), how="outer", suffixes=("_本期", "_同期"))
+        else:
+            result = pd.concat([current.add_suffix("_本期").reset_index(drop=True),
+                                previous.add_suffix("_同期").reset_index(drop=True)], axis=1)
+        for col in metrics:
+            now, before = result[f"{col}_本期"], result[f"{col}_同期"]
+            result = result.rename(columns={f"{col}_本期": f"{col}(本期)", f"{col}_同期": f"{col}(同期)"})
+            result[f"{col}同比(%)"] = (now - before) / before.where(before != 0) * 100
+        return result
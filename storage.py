@@ -0,0 +1,341 @@
+"""
+SQLite 持久化存储
+
+以 WAL 模式的 SQLite 保存病虫害观测、市场价格、区域市场与传感器读数，
+观测表按 (月份, 乡镇, 水果类型, 病虫害类型) 建立索引，筛选与聚合直接下推为 SQL。
+连接池可在多个 Streamlit 会话之间共享（页面中通过 st.cache_resource 持有单例）。
+"""
+
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+from schema import READING_FIELDS, compact
+
+DEFAULT_DB_PATH = os.environ.get("SPP_DB_PATH", os.path.join("data", "plant_protection.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    "日期" TEXT NOT NULL,
+    "月份" INTEGER NOT NULL,
+    "乡镇" TEXT NOT NULL,
+    "纬度" REAL,
+    "经度" REAL,
+    "水果类型" TEXT NOT NULL,
+    "病虫害类型" TEXT NOT NULL,
+    "月均发生频次" INTEGER,
+    "严重程度" INTEGER,
+    "经济损失(元)" REAL,
+    "防治成本(元)" REAL
+);
+CREATE INDEX IF NOT EXISTS idx_observations_filter
+    ON observations ("月份", "乡镇", "水果类型", "病虫害类型");
+
+CREATE TABLE IF NOT EXISTS market_prices (
+    "日期" TEXT NOT NULL,
+    "月份" INTEGER NOT NULL,
+    "水果类型" TEXT NOT NULL,
+    "价格(元/公斤)" REAL,
+    "销量(吨)" REAL,
+    "产量(吨)" REAL,
+    "市场需求指数" REAL,
+    "库存水平" REAL
+);
+CREATE INDEX IF NOT EXISTS idx_market_prices_filter
+    ON market_prices ("月份", "水果类型");
+
+CREATE TABLE IF NOT EXISTS regional_market (
+    "乡镇" TEXT NOT NULL,
+    "水果类型" TEXT NOT NULL,
+    "区域产量(吨)" REAL,
+    "品质等级" INTEGER,
+    "市场份额" REAL,
+    "运输成本(元/公斤)" REAL
+);
+CREATE INDEX IF NOT EXISTS idx_regional_market_filter
+    ON regional_market ("乡镇", "水果类型");
+
+CREATE TABLE IF NOT EXISTS sensor_readings (
+    "时间" TEXT NOT NULL,
+    "设备编号" TEXT,
+    "类型" TEXT NOT NULL,
+    "乡镇" TEXT NOT NULL,
+    "水果类型" TEXT,
+    "诱捕数量" INTEGER,
+    "温度(℃)" REAL,
+    "相对湿度(%)" REAL,
+    "叶面湿润(小时)" REAL,
+    "降雨量(mm)" REAL
+);
+CREATE INDEX IF NOT EXISTS idx_sensor_readings_town_time
+    ON sensor_readings ("乡镇", "时间");
+
+CREATE TABLE IF NOT EXISTS quarantine (
+    "接收时间" TEXT NOT NULL,
+    "表名" TEXT NOT NULL,
+    "原因" TEXT NOT NULL,
+    "数据" TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_quarantine_table_time
+    ON quarantine ("表名", "接收时间");
+
+CREATE TABLE IF NOT EXISTS dataset_versions (
+    table_name TEXT PRIMARY KEY,
+    version TEXT NOT NULL
+);
+"""
+
+# 页面数据表与传感器表分别计算版本：传感器微批写入频繁，不应使页面缓存失效
+PAGE_TABLES = ("observations", "market_prices", "regional_market")
+SENSOR_TABLES = ("sensor_readings",)
+DATA_TABLES = PAGE_TABLES + SENSOR_TABLES
+
+DATE_COLUMNS = {"observations": ["日期"], "market_prices": ["日期"], "sensor_readings": ["时间"]}
+
+# 允许下推为 SQL 的聚合函数
+AGGREGATES = {"sum": "SUM", "mean": "AVG", "min": "MIN", "max": "MAX", "count": "COUNT"}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class ConnectionPool:
+    """线程安全的 SQLite 连接池，连接按需创建、用完归还"""
+
+    def __init__(self, path, size=4):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")  # 64MB 页缓存
+        conn.execute("PRAGMA mmap_size=268435456")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接；池满时等待其他会话归还"""
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                # 归还前回滚未提交的事务，避免把脏连接交给下一个会话
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put_nowait(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class PlantProtectionStore:
+    """平台数据存储：表结构管理、批量写入与下推查询"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, pool_size=4):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.pool = ConnectionPool(path, size=pool_size)
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+            # 早于版本表创建的数据库：用行数与最大 rowid 作为初始版本
+            for table in DATA_TABLES:
+                count, max_rowid = conn.execute(
+                    f"SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM {_quote(table)}"
+                ).fetchone()
+                conn.execute(
+                    "INSERT OR IGNORE INTO dataset_versions VALUES (?, ?)",
+                    (table, f"rows:{count}:{max_rowid}"),
+                )
+            conn.commit()
+
+    # ---------- 写入 ----------
+
+    @staticmethod
+    def _insert(conn, table, frame):
+        columns = list(frame.columns)
+        rows = frame.copy()
+        for col in DATE_COLUMNS.get(table, []):
+            if col in rows:
+                rows[col] = pd.to_datetime(rows[col]).dt.strftime("%Y-%m-%dT%H:%M:%S")
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            _quote(table), ", ".join(_quote(c) for c in columns), ", ".join("?" * len(columns))
+        )
+        conn.executemany(sql, rows.astype(object).where(rows.notna(), None).itertuples(index=False))
+        digest = pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes()
+        PlantProtectionStore._bump_version(conn, table, digest)
+
+    @staticmethod
+    def _bump_version(conn, table, digest, replace=False):
+        """根据写入内容的哈希更新表版本：新版本 = hash(旧版本 + 本次写入内容)"""
+        row = conn.execute(
+            "SELECT version FROM dataset_versions WHERE table_name = ?", (table,)
+        ).fetchone()
+        previous = "" if replace or row is None else row[0]
+        version = hashlib.sha1(previous.encode() + digest).hexdigest()[:16]
+        conn.execute("INSERT OR REPLACE INTO dataset_versions VALUES (?, ?)", (table, version))
+
+    def write_frame(self, table, frame, replace=False):
+        """将 DataFrame 批量写入表；replace=True 时先清空表"""
+        with self.pool.connection() as conn:
+            with conn:
+                if replace:
+                    conn.execute(f"DELETE FROM {_quote(table)}")
+                    self._bump_version(conn, table, b"", replace=True)
+                self._insert(conn, table, frame)
+
+    def seed_if_empty(self, table, make_frame):
+        """表为空时写入初始数据；多个进程同时启动时由写锁保证只写入一次"""
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                empty = conn.execute(f"SELECT 1 FROM {_quote(table)} LIMIT 1").fetchone() is None
+                if empty:
+                    self._insert(conn, table, make_frame())
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return empty
+
+    def write_batch(self, rows):
+        """接入网关的写入接口：rows 为按 READING_FIELDS 排列的读数列表"""
+        sql = "INSERT INTO sensor_readings ({}) VALUES ({})".format(
+            ", ".join(_quote(c) for c in READING_FIELDS), ", ".join("?" * len(READING_FIELDS))
+        )
+        with self.pool.connection() as conn:
+            with conn:
+                conn.executemany(sql, rows)
+                self._bump_version(conn, "sensor_readings", repr(rows).encode("utf-8"))
+
+    def write_quarantine(self, table, rejected):
+        """将校验未通过的行（validation.Validator.split 的 rejected）写入隔离表"""
+        if rejected.empty:
+            return
+        from validation import quarantine_records
+
+        with self.pool.connection() as conn:
+            with conn:
+                conn.executemany("INSERT INTO quarantine VALUES (?, ?, ?, ?)", quarantine_records(table, rejected))
+
+    def quarantine_summary(self):
+        """隔离表按 表名 × 原因 的行数与最近接收时间"""
+        return self.read_sql(
+            'SELECT "表名", "原因", COUNT(*) AS "行数", MAX("接收时间") AS "最近接收时间" '
+            'FROM quarantine GROUP BY 1, 2 ORDER BY 3 DESC'
+        )
+
+    def version(self, tables=PAGE_TABLES):
+        """
+        数据集版本标识：tables 中任一表内容变化时改变，用作缓存键
+
+        默认只包含页面数据表（观测、市场、区域市场）；传感器读数的版本用 sensor_version
+        """
+        placeholders = ", ".join("?" * len(tables))
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT table_name, version FROM dataset_versions WHERE table_name IN ({placeholders}) ORDER BY 1",
+                list(tables),
+            ).fetchall()
+        return ";".join(f"{table}={version}" for table, version in rows)
+
+    def sensor_version(self):
+        """传感器读数的版本标识：每个接入微批写入后改变"""
+        return self.version(SENSOR_TABLES)
+
+    def close(self):
+        self.pool.close()
+
+    # ---------- 查询 ----------
+
+    def read_sql(self, sql, params=(), table=None):
+        """执行查询并返回 DataFrame，自动解析日期列并转换为紧凑类型"""
+        with self.pool.connection() as conn:
+            frame = pd.read_sql_query(sql, conn, params=list(params))
+        for col in DATE_COLUMNS.get(table, []):
+            if col in frame:
+                frame[col] = pd.to_datetime(frame[col])
+        return compact(frame, table) if table else frame
+
+    @staticmethod
+    def _where(filters):
+        """将 {列名: 取值列表} 转换为 WHERE 子句；取值为 None 表示不过滤该列"""
+        clauses, params = [], []
+        for column, values in filters.items():
+            if values is None:
+                continue
+            values = list(values)
+            if not values:
+                return " WHERE 0", []
+            clauses.append(f"{_quote(column)} IN ({', '.join('?' * len(values))})")
+            # numpy 标量转换为 Python 原生类型，sqlite3 才能绑定
+            params.extend(v.item() if hasattr(v, "item") else v for v in values)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def load_table(self, table):
+        return self.read_sql(f"SELECT * FROM {_quote(table)}", table=table)
+
+    def load_rows(self, table, offset=0):
+        """按写入顺序跳过前 offset 行后的所有行（增量计算只读取新增的行）"""
+        return self.read_sql(f"SELECT * FROM {_quote(table)} ORDER BY rowid LIMIT -1 OFFSET ?", (offset,), table=table)
+
+    def distinct(self, table, column):
+        """某列的去重取值（走索引，不加载整表）"""
+        sql = f"SELECT DISTINCT {_quote(column)} FROM {_quote(table)} ORDER BY 1"
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute(sql)]
+
+    def query_observations(self, months=None, towns=None, fruits=None, diseases=None):
+        """按月份、乡镇、水果类型、病虫害类型筛选观测数据"""
+        where, params = self._where({
+            "月份": months, "乡镇": towns, "水果类型": fruits, "病虫害类型": diseases,
+        })
+        return self.read_sql(f"SELECT * FROM observations{where}", params, table="observations")
+
+    def aggregate_observations(self, group_by, metrics, months=None, towns=None, fruits=None, diseases=None):
+        """
+        在数据库中完成分组聚合
+
+        参数:
+            group_by: 分组列名列表
+            metrics: {列名: 聚合方式}，聚合方式取 sum / mean / min / max / count
+        """
+        where, params = self._where({
+            "月份": months, "乡镇": towns, "水果类型": fruits, "病虫害类型": diseases,
+        })
+        keys = ", ".join(_quote(c) for c in group_by)
+        selects = ", ".join(
+            f"{AGGREGATES[how]}({_quote(col)}) AS {_quote(col)}" for col, how in metrics.items()
+        )
+        sql = f"SELECT {keys}, {selects} FROM observations{where} GROUP BY {keys} ORDER BY {keys}"
+        return self.read_sql(sql, params)
+
+    def query_market(self, months=None, fruits=None):
+        where, params = self._where({"月份": months, "水果类型": fruits})
+        return self.read_sql(f"SELECT * FROM market_prices{where}", params, table="market_prices")
+
+    def query_regional_market(self, towns=None, fruits=None):
+        where, params = self._where({"乡镇": towns, "水果类型": fruits})
+        return self.read_sql(f"SELECT * FROM regional_market{where}", params, table="regional_market")
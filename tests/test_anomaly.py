@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+from anomaly import DEFAULT_THRESHOLD, anomaly_alerts, detect_anomalies, robust_zscores
+
+
+def noisy_series(n_series=4, n_times=60, seed=0):
+    rng = np.random.default_rng(seed)
+    return 10 + rng.normal(0, 0.5, (n_series, n_times))
+
+
+def strongest(z):
+    """|z| 最大的位置，以及它与其余位置中最大 |z| 的比值"""
+    magnitude = np.abs(np.nan_to_num(z))
+    top = np.unravel_index(np.argmax(magnitude), z.shape)
+    rest = magnitude.copy()
+    rest[top] = 0
+    return tuple(int(i) for i in top), magnitude[top] / rest.max()
+
+
+def test_robust_zscores_flag_injected_spike():
+    for seed in range(5):
+        values = noisy_series(seed=seed)
+        values[2, 40] += 8.0
+        z, baseline = robust_zscores(values, window=15, min_periods=10)
+        top, margin = strongest(z)
+        assert top == (2, 40)
+        assert z[2, 40] > DEFAULT_THRESHOLD and margin > 2
+        assert abs(baseline[2, 40] - 10) < 1.0
+
+
+def test_spike_does_not_mask_itself_in_centered_windows():
+    values = noisy_series(seed=7)
+    values[1, 0] -= 8.0  # 序列开头：只有 center=True 时才有参照窗口
+    z, _ = robust_zscores(values, window=14, min_periods=5, center=True)
+    top, margin = strongest(z)
+    assert top == (1, 0) and z[1, 0] < -DEFAULT_THRESHOLD and margin > 2
+
+
+def test_warm_up_points_have_no_score():
+    z, _ = robust_zscores(noisy_series(), window=7, min_periods=3)
+    assert np.isnan(z[:, :3]).all()
+    assert not np.isnan(z[:, 3:]).any()
+
+
+def test_seasonal_pattern_is_not_flagged_but_spike_is():
+    period = 12
+    season = np.tile(5 * np.sin(np.arange(period) / period * 2 * np.pi), 6)
+    values = noisy_series(n_series=2, n_times=season.size, seed=1) + season
+    values[1, 50] -= 6.0
+    z, _ = robust_zscores(values, window=15, min_periods=10, seasonal_period=period)
+    top, margin = strongest(z)
+    assert top == (1, 50) and z[1, 50] < -DEFAULT_THRESHOLD and margin > 2
+
+
+def test_detect_anomalies_reports_spike_in_long_table():
+    values = noisy_series(n_series=2, n_times=30, seed=2)
+    values[0, 20] *= 2
+    dates = pd.date_range("2024-01-01", periods=30)
+    frame = pd.DataFrame({
+        "水果类型": np.repeat(["桃", "苹果"], 30),
+        "日期": np.tile(dates, 2),
+        "价格(元/公斤)": values.reshape(-1),
+    })
+    alerts = anomaly_alerts(detect_anomalies(frame, "日期", ["水果类型"], ["价格(元/公斤)"], window=10, min_periods=5))
+    alert = alerts.iloc[0]  # 按偏离程度排序，注入的尖峰排第一
+    assert alert["水果类型"] == "桃"
+    assert alert["日期"] == dates[20]
+    assert alert["异常方向"] == "飙升"
+
+
+def test_scale_floor_limits_false_positives_in_short_windows():
+    rng = np.random.default_rng(3)
+    values = rng.uniform(0.5, 1.5, (500, 12))  # 无异常的逐月序列
+    z, _ = robust_zscores(values, window=5, min_periods=3, center=True)
+    floored, _ = robust_zscores(values, window=7, min_periods=4, center=True, scale_floor=1.0)
+    assert np.nanmean(np.abs(z) > DEFAULT_THRESHOLD) > 0.05
+    assert np.nanmean(np.abs(floored) > DEFAULT_THRESHOLD) < 0.02
+
+    values[0, 6] += 3.0
+    floored, _ = robust_zscores(values, window=7, min_periods=4, center=True, scale_floor=1.0)
+    assert floored[0, 6] > DEFAULT_THRESHOLD
@@ -0,0 +1,112 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from optimizer import NO_TREATMENT, _hull_increments, build_options, optimize_allocation
+
+
+def make_instance(n_cells=5, seed=0):
+    """随机生成单元格与每个单元格 3 个方案（成本递增）"""
+    rng = np.random.default_rng(seed)
+    cells = pd.DataFrame({
+        "乡镇": [f"乡镇{i}" for i in range(n_cells)],
+        "水果类型": "桃",
+        "病虫害类型": "蚜虫",
+        "预期损失": rng.uniform(1000, 5000, n_cells),
+    })
+    rows = []
+    for cell in range(n_cells):
+        costs = np.sort(rng.uniform(100, 1500, 3))
+        gains = np.sort(rng.uniform(200, 3000, 3))
+        rows += [(cell, f"方案{k}", costs[k], gains[k]) for k in range(3)]
+    options = pd.DataFrame(rows, columns=["单元格", "方案", "成本", "挽回损失"])
+    return cells, options
+
+
+def brute_force(options, n_cells, budget):
+    """穷举每个单元格的方案（含不防治）求精确最优"""
+    choices = [[(0.0, 0.0)] + list(zip(group["成本"], group["挽回损失"]))
+               for _, group in options.groupby("单元格")]
+    best = 0.0
+    for combo in itertools.product(*choices):
+        cost = sum(c for c, _ in combo)
+        if cost <= budget:
+            best = max(best, sum(g for _, g in combo))
+    return best
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_allocation_is_feasible_and_bounded(seed):
+    cells, options = make_instance(seed=seed)
+    for budget in np.linspace(0, options["成本"].sum(), 25):
+        allocation, summary = optimize_allocation(cells, options, budget)
+        assert summary["已用预算"] <= budget + 1e-6
+        assert allocation["投入成本"].sum() == pytest.approx(summary["已用预算"])
+        optimum = brute_force(options, len(cells), budget)
+        assert summary["挽回损失"] <= optimum + 1e-6
+        assert optimum <= summary["上界"] + 1e-6
+        # 每个单元格只选一个方案，且成本与挽回损失与方案表一致
+        chosen = allocation[allocation["方案"] != NO_TREATMENT]
+        for idx, row in chosen.iterrows():
+            option = options[(options["单元格"] == idx) & (options["方案"] == row["方案"])].iloc[0]
+            assert row["投入成本"] == pytest.approx(option["成本"])
+            assert row["挽回损失"] == pytest.approx(option["挽回损失"])
+
+
+def test_more_budget_never_saves_less():
+    cells, options = make_instance(n_cells=8, seed=42)
+    previous_saved = previous_upper = -1.0
+    for budget in np.linspace(0, options["成本"].sum(), 60):
+        _, summary = optimize_allocation(cells, options, budget)
+        assert summary["挽回损失"] >= previous_saved - 1e-6
+        assert summary["上界"] >= previous_upper - 1e-6
+        previous_saved, previous_upper = summary["挽回损失"], summary["上界"]
+
+
+def test_zero_cost_increment_sorts_first_and_is_always_taken():
+    cells, options = make_instance(n_cells=3, seed=1)
+    # 单元格 0 的最便宜方案不花钱
+    options.loc[(options["单元格"] == 0) & (options["方案"] == "方案0"), "成本"] = 0.0
+    increments = _hull_increments(options)
+    free = increments[(increments["单元格"] == 0) & (increments["新增成本"] == 0)]
+    assert len(free) == 1
+    assert np.isposinf(free["效率"].iloc[0])
+    assert not increments["效率"].isna().any()
+
+    ordered = increments.sort_values(["效率", "序号"], ascending=[False, True], kind="stable")
+    assert ordered.index[0] == free.index[0]
+
+    # 预算为零或很小时零成本方案仍被选中，且不占用预算
+    for budget in (0.0, 1.0):
+        allocation, summary = optimize_allocation(cells, options, budget)
+        assert allocation.loc[0, "方案"] == "方案0"
+        assert summary["已用预算"] <= budget
+
+
+def test_cell_increments_are_taken_in_hull_order():
+    cells, options = make_instance(n_cells=6, seed=3)
+    options.loc[options["方案"] == "方案0", "成本"] = 0.0
+    for budget in np.linspace(0, options["成本"].sum(), 30):
+        allocation, _ = optimize_allocation(cells, options, budget)
+        # 所有单元格至少选中零成本方案，不会跳过它直接选后面的增量
+        assert (allocation["方案"] != NO_TREATMENT).all()
+
+
+def test_option_costs_follow_solution_cost_range():
+    solution_db = {"蚜虫": {"防治成本": "低（100-150元/亩）", "效果评估": "92%有效率"}}
+    df = pd.DataFrame({
+        "乡镇": ["张官营镇", "张官营镇"], "水果类型": ["桃", "桃"], "病虫害类型": ["蚜虫", "褐腐病"],
+        "经济损失(元)": [5000.0, 3000.0], "防治成本(元)": [1250.0, 1000.0],
+    })
+    cells, options = build_options(df, solution_db)
+    # 观测成本 1250 元按中值 125 元/亩折算为 10 亩，方案成本为 10 亩 × 100 / 125 / 150 元
+    assert cells["防治面积(亩)"].iloc[0] == pytest.approx(10.0)
+    aphid = options[options["单元格"] == 0].set_index("方案")
+    assert aphid["成本"].tolist() == pytest.approx([1000.0, 1250.0, 1500.0])
+    assert aphid.loc["标准防治", "挽回损失"] == pytest.approx(5000 * 0.92)
+    # 缺少方案数据的病虫害按观测成本 ±20% 定价
+    other = options[options["单元格"] == 1]
+    assert other["成本"].tolist() == pytest.approx([800.0, 1000.0, 1200.0])
+    assert np.isnan(cells["防治面积(亩)"].iloc[1])
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from schema import compact, widen
+
+
+def observations(**columns):
+    frame = pd.DataFrame({
+        "月份": [5, 6, 7], "乡镇": ["张官营镇", "马楼乡", "张官营镇"], "严重程度": [1, 3, 5],
+        "月均发生频次": [3, 8, 12], "经济损失(元)": [1200.0, 800.5, 0.0],
+    })
+    return frame.assign(**columns)
+
+
+def test_compact_dtypes():
+    frame = compact(observations(), "observations")
+    assert frame["月份"].dtype == np.int8 and frame["月均发生频次"].dtype == np.int16
+    assert isinstance(frame["乡镇"].dtype, pd.CategoricalDtype)
+    assert frame["经济损失(元)"].dtype == np.float64
+
+
+def test_out_of_range_integers_widen():
+    frame = compact(observations(月均发生频次=[3, 40_000, 12]), "observations")
+    assert frame["月均发生频次"].dtype == np.int32
+    assert frame["月均发生频次"].tolist() == [3, 40_000, 12]
+
+
+def test_integer_column_with_nulls_becomes_nullable():
+    # SQLite 允许 INTEGER 列为空，validation 也不要求 月均发生频次 必填
+    frame = compact(observations(月均发生频次=[3.0, np.nan, 12.0]), "observations")
+    assert frame["月均发生频次"].dtype == "Int16"
+    assert frame["月均发生频次"].isna().tolist() == [False, True, False]
+    assert frame["月均发生频次"].sum() == 15
+
+    regional = compact(pd.DataFrame({"区域产量(吨)": [np.nan, 70_000.0], "品质等级": [np.nan, 4.0]}), "regional_market")
+    assert regional["区域产量(吨)"].dtype == "Int32" and regional["品质等级"].dtype == "Int8"
+
+
+def test_widen_round_trip():
+    frame = compact(observations(月均发生频次=[3.0, np.nan, 12.0]), "observations")
+    wide = widen(frame)
+    assert wide["乡镇"].dtype == object and wide["月份"].dtype == np.int64
+    assert wide["月均发生频次"].dtype == "Int64"
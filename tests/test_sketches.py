@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sketches import RELATIVE_ACCURACY, SketchAccumulator, build_sketches, merge_sketches, quantiles, select
+
+QS = (0.1, 0.5, 0.9, 0.99)
+
+
+def make_observations(n=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "月份": rng.integers(1, 13, n),
+        "乡镇": rng.choice(["张官营镇", "马楼乡", "辛集乡"], n),
+        "水果类型": rng.choice(["桃", "苹果"], n),
+        "病虫害类型": rng.choice(["蚜虫", "褐腐病", "红蜘蛛"], n),
+        "经济损失(元)": rng.lognormal(8, 1.5, n),
+        "防治成本(元)": rng.lognormal(6, 1.0, n),
+        "严重程度": rng.integers(1, 6, n),
+        "月均发生频次": rng.integers(0, 20, n),
+    })
+
+
+def assert_within_bound(estimates, values):
+    for q in QS:
+        exact = np.quantile(values, q, method="lower")
+        assert estimates[f"p{q * 100:g}"] == pytest.approx(exact, rel=RELATIVE_ACCURACY + 1e-9)
+
+
+def test_merged_sketch_quantiles_within_relative_error():
+    observations = make_observations()
+    bounds = np.linspace(0, len(observations), 5).astype(int)
+    parts = [observations.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    merged = merge_sketches(*(build_sketches(part) for part in parts))
+    result = quantiles(merged, "经济损失(元)", qs=QS).iloc[0]
+    assert result["样本数"] == len(observations)
+    assert_within_bound(result, observations["经济损失(元)"].to_numpy())
+
+
+def test_merge_equals_building_on_all_rows():
+    observations = make_observations(5000, seed=1)
+    whole = build_sketches(observations)
+    merged = merge_sketches(build_sketches(observations.iloc[:2000]), build_sketches(observations.iloc[2000:]))
+    for measure in ("经济损失(元)", "严重程度"):
+        expected = quantiles(whole, measure, ["乡镇"], QS).sort_values("乡镇").reset_index(drop=True)
+        actual = quantiles(merged, measure, ["乡镇"], QS).sort_values("乡镇").reset_index(drop=True)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_grouped_and_filtered_quantiles_within_relative_error():
+    observations = make_observations(seed=2)
+    sketches = build_sketches(observations)
+    months = [3, 4, 5]
+    chosen = select(sketches, {"月份": months, "水果类型": ["桃"]})
+    result = quantiles(chosen, "防治成本(元)", ["乡镇"], QS)
+    rows = observations[observations["月份"].isin(months) & (observations["水果类型"] == "桃")]
+    for _, estimates in result.iterrows():
+        values = rows.loc[rows["乡镇"] == estimates["乡镇"], "防治成本(元)"].to_numpy()
+        assert estimates["样本数"] == len(values)
+        assert_within_bound(estimates, values)
+
+
+def test_exact_measures_are_exact():
+    observations = make_observations(3000, seed=3)
+    result = quantiles(build_sketches(observations), "严重程度", qs=QS).iloc[0]
+    for q in QS:
+        assert result[f"p{q * 100:g}"] == np.quantile(observations["严重程度"], q, method="lower")
+
+
+def test_accumulator_merges_only_appended_rows():
+    observations = make_observations(3000)
+    table = {"rows": observations.iloc[:1000]}
+    offsets = []
+
+    def load_rows(offset):
+        offsets.append(offset)
+        return table["rows"].iloc[offset:]
+
+    accumulator = SketchAccumulator()
+    accumulator.update(load_rows)
+    table["rows"] = observations
+    sketches = accumulator.update(load_rows)
+    assert offsets == [0, 999]
+    expected = quantiles(build_sketches(observations), "经济损失(元)", ["乡镇"]).sort_values("乡镇").reset_index(drop=True)
+    actual = quantiles(sketches, "经济损失(元)", ["乡镇"]).sort_values("乡镇").reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+    # 整表替换后已合并的最后一行不再匹配，全部重建
+    table["rows"] = make_observations(2000, seed=1)
+    sketches = accumulator.update(load_rows)
+    assert offsets[-1] == 0
+    assert quantiles(sketches, "经济损失(元)").iloc[0]["样本数"] == 2000
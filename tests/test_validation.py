@@ -0,0 +1,158 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from validation import REASON_COLUMN, Validator, quarantine_records
+
+TOWNS = {"张官营镇": (33.70, 112.90), "马楼乡": (33.60, 112.70)}
+FRUIT_DISEASES = {"桃": ["褐腐病", "蚜虫"], "苹果": ["蚜虫", "红蜘蛛"]}
+
+
+@pytest.fixture
+def validator():
+    return Validator.from_registries(TOWNS, FRUIT_DISEASES)
+
+
+def observation(**overrides):
+    row = {
+        "日期": "2024-05-10", "月份": 5, "乡镇": "张官营镇", "纬度": 33.70, "经度": 112.90,
+        "水果类型": "桃", "病虫害类型": "蚜虫", "月均发生频次": 3, "严重程度": 2,
+        "经济损失(元)": 1200.0, "防治成本(元)": 300.0,
+    }
+    row.update(overrides)
+    return row
+
+
+def check_one(validator, **overrides):
+    """在一条合法记录之后追加一条修改过的记录，返回第二条记录触发的原因"""
+    frame = pd.DataFrame([observation(), observation(**{"日期": "2024-05-11", **overrides})])
+    failures = validator.check("observations", frame)
+    assert all(not mask[0] for mask in failures.values()), "合法记录不应被拒绝"
+    return {reason for reason, mask in failures.items() if mask[1]}
+
+
+def test_valid_rows_pass(validator):
+    frame = pd.DataFrame([observation(), observation(日期="2024-05-11", 乡镇="马楼乡", 纬度=33.6, 经度=112.7)])
+    assert validator.check("observations", frame) == {}
+    accepted, rejected = validator.split("observations", frame)
+    assert len(accepted) == 2 and rejected.empty and REASON_COLUMN in rejected
+
+
+@pytest.mark.parametrize("overrides, reason", [
+    ({"严重程度": 6}, "严重程度超出范围[1, 5]"),
+    ({"严重程度": 0}, "严重程度超出范围[1, 5]"),
+    ({"经济损失(元)": -1.0}, "经济损失(元)超出范围[0, +∞]"),
+    ({"月均发生频次": "很多"}, "月均发生频次不是数值"),
+])
+def test_range_rules(validator, overrides, reason):
+    assert reason in check_one(validator, **overrides)
+
+
+def test_required_and_date_format(validator):
+    assert "缺少乡镇" in check_one(validator, 乡镇=None)
+    assert "日期格式错误" in check_one(validator, 日期="五月十日")
+
+
+def test_reference_rules(validator):
+    assert check_one(validator, 乡镇="不存在镇") == {"乡镇不在注册表中"}
+    assert "水果类型不在注册表中" in check_one(validator, 水果类型="榴莲")
+
+
+def test_pair_rule(validator):
+    assert check_one(validator, 水果类型="桃", 病虫害类型="红蜘蛛") == {"病虫害类型与水果类型不匹配"}
+    assert check_one(validator, 水果类型="苹果", 病虫害类型="红蜘蛛") == set()
+    # 未知水果只报告引用问题，不重复报告对应关系
+    assert "病虫害类型与水果类型不匹配" not in check_one(validator, 水果类型="榴莲")
+
+
+def test_coordinate_rule(validator):
+    assert check_one(validator, 纬度=40.0) == {"坐标超出县域范围"}
+    assert check_one(validator, 经度=112.65) == set()  # 外扩 0.1 度以内
+
+
+def test_month_of_rule(validator):
+    assert check_one(validator, 月份=6) == {"月份与日期不一致"}
+
+
+def test_duplicate_rule(validator):
+    frame = pd.DataFrame([observation(), observation(严重程度=3), observation(日期="2024-05-12")])
+    failures = validator.check("observations", frame)
+    assert list(failures) == ["批次内重复记录"]
+    assert failures["批次内重复记录"].tolist() == [False, True, False]
+
+
+def test_categorical_columns_are_checked(validator):
+    frame = pd.DataFrame([observation(), observation(日期="2024-05-11", 乡镇="不存在镇")])
+    frame["乡镇"] = frame["乡镇"].astype("category")
+    assert validator.check("observations", frame)["乡镇不在注册表中"].tolist() == [False, True]
+
+
+def test_sensor_rules(validator):
+    frame = pd.DataFrame({
+        "时间": ["2024-05-10T08:00:00"] * 3 + [None],
+        "设备编号": ["d1", "d2", "d3", "d4"],
+        "类型": ["诱捕器", "气象站", "无人机", "诱捕器"],
+        "乡镇": ["张官营镇"] * 4,
+        "水果类型": ["桃"] * 4,
+        "温度(℃)": [20.0, 80.0, 20.0, 20.0],
+    })
+    failures = validator.check("sensor_readings", frame)
+    assert failures["温度(℃)超出范围[-30, 50]"].tolist() == [False, True, False, False]
+    assert failures["类型不在注册表中"].tolist() == [False, False, True, False]
+    assert failures["缺少时间"].tolist() == [False, False, False, True]
+
+
+def test_split_and_quarantine(validator):
+    frame = pd.DataFrame([
+        observation(),
+        observation(日期="2024-05-11", 严重程度=9, 乡镇="不存在镇", 纬度=40.0),
+        observation(日期="2024-06-12"),
+        observation(日期="2024-05-13", 乡镇="马楼乡", 纬度=33.6, 经度=112.7),
+    ])
+    accepted, rejected = validator.split("observations", frame)
+    assert accepted.index.tolist() == [0, 3]
+    assert rejected.index.tolist() == [1, 2]
+    reasons = dict(zip(rejected.index, rejected[REASON_COLUMN]))
+    assert set(reasons[1].split("；")) == {"严重程度超出范围[1, 5]", "乡镇不在注册表中", "坐标超出县域范围"}
+    assert reasons[2] == "月份与日期不一致"
+
+    records = quarantine_records("observations", rejected, received_at="2024-05-14T00:00:00")
+    assert [(r[0], r[1], r[2]) for r in records] == [
+        ("2024-05-14T00:00:00", "observations", reasons[1]),
+        ("2024-05-14T00:00:00", "observations", reasons[2]),
+    ]
+    payload = json.loads(records[0][3])
+    assert payload["乡镇"] == "不存在镇" and REASON_COLUMN not in payload
+
+
+def sensor_reading(**overrides):
+    row = {"时间": "2024-05-10T08:00:00", "设备编号": "d1", "类型": "诱捕器", "乡镇": "张官营镇",
+           "水果类型": "桃", "诱捕数量": 3, "温度(℃)": 20.0}
+    row.update(overrides)
+    return row
+
+
+def test_sensor_readings_in_the_same_second_are_not_duplicates(validator):
+    frame = pd.DataFrame([
+        sensor_reading(),
+        sensor_reading(诱捕数量=5),    # 同一设备同一秒的另一条读数
+        sensor_reading(),             # 同一秒内取值也相同的读数
+        sensor_reading(设备编号=None),
+        sensor_reading(设备编号=None),
+    ])
+    assert validator.check("sensor_readings", frame) == {}
+
+
+def test_non_scalar_values_are_rejected_with_a_reason(validator):
+    frame = pd.DataFrame([sensor_reading(), sensor_reading(设备编号={"a": 1}), sensor_reading(乡镇=["张官营镇"])])
+    failures = validator.check("sensor_readings", frame)
+    assert failures["设备编号不是标量值"].tolist() == [False, True, False]
+    assert failures["乡镇不是标量值"].tolist() == [False, False, True]
+    accepted, rejected = validator.split("sensor_readings", frame)
+    assert accepted.index.tolist() == [0]
+    assert "设备编号不是标量值" in rejected.loc[1, REASON_COLUMN]
+    # 隔离记录仍能序列化原始取值
+    payload = json.loads(quarantine_records("sensor_readings", rejected)[0][3])
+    assert payload["设备编号"] == {"a": 1}
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from views import CUBE_KEYS, build_cube, clip_filters, project, rollup
+
+METRICS = {"经济损失(元)": "sum", "防治成本(元)": "sum", "严重程度": "mean", "月均发生频次": "mean"}
+
+
+def make_observations(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        "月份": rng.integers(1, 13, n),
+        "乡镇": rng.choice(["张官营镇", "马楼乡", "辛集乡", "瓦屋镇"], n),
+        "水果类型": rng.choice(["桃", "苹果", "梨"], n),
+        "病虫害类型": rng.choice(["蚜虫", "褐腐病", "红蜘蛛"], n),
+        "月均发生频次": rng.integers(0, 20, n),
+        "严重程度": rng.integers(1, 6, n),
+        "经济损失(元)": rng.uniform(0, 10000, n),
+        "防治成本(元)": rng.uniform(0, 2000, n),
+    })
+    return frame.astype({"乡镇": "category", "水果类型": "category", "病虫害类型": "category"})
+
+
+@pytest.mark.parametrize("group_by", [["乡镇"], ["月份"], ["病虫害类型", "水果类型"], CUBE_KEYS])
+def test_rollup_matches_groupby_on_raw_rows(group_by):
+    observations = make_observations()
+    expected = observations.groupby(group_by, observed=True).agg(METRICS).reset_index()
+    actual = rollup(build_cube(observations), group_by, METRICS)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_categorical=False)
+
+
+def test_rollup_count_matches_group_sizes():
+    observations = make_observations(seed=1)
+    actual = rollup(build_cube(observations), ["乡镇"], {"记录数": "count"})
+    expected = observations.groupby("乡镇", observed=True).size()
+    assert actual.set_index("乡镇")["记录数"].to_dict() == expected.to_dict()
+
+
+def test_project_matches_filtering_raw_rows():
+    observations = make_observations(seed=2)
+    filters = (list(range(1, 13)), ["张官营镇", "马楼乡", "辛集乡"], ["桃", "苹果"], ["蚜虫", "褐腐病", "红蜘蛛"])
+    selected = observations[
+        np.logical_and.reduce([observations[col].isin(values) for col, values in zip(CUBE_KEYS, filters)])
+    ].reset_index(drop=True)
+    views = {"observations": selected, "cube": build_cube(selected)}
+    clipped = clip_filters(filters, {"月份": [1, 2, 3], "水果类型": ["桃"]})
+    mask = np.logical_and.reduce([selected[col].isin(values) for col, values in zip(CUBE_KEYS, clipped)])
+    expected = selected[mask].reset_index(drop=True)
+    for original in (None, filters):
+        projected = project(views, clipped, original)
+        pd.testing.assert_frame_equal(projected["observations"], expected)
+        pd.testing.assert_frame_equal(
+            rollup(projected["cube"], ["乡镇"], METRICS),
+            expected.groupby("乡镇", observed=True).agg(METRICS).reset_index(),
+            check_dtype=False,
+        )
@@ -0,0 +1,501 @@
+"""
+离线底图瓦片（MBTiles）
+
+农村部署网络慢或无法访问外网时，底图瓦片从本地 MBTiles（SQLite）文件读取，由内置的小型 HTTP
+瓦片服务提供给浏览器，地图不再依赖远程 CartoDB 服务：
+
+    GET /tiles/<z>/<x>/<y>.<格式>   返回瓦片；带 ETag 与长期 Cache-Control，支持 If-None-Match → 304
+    GET /assets/<文件>              返回本地保存的 Leaflet/folium 脚本与样式（同样带 ETag 与长期缓存）
+    GET /metadata                   返回 MBTiles 元数据（JSON）
+
+缺失的瓦片返回 404 并只短期缓存，补种之后浏览器能及时取到。预先下载某个区域的瓦片使用 seed 子命令，
+地图用到的脚本、样式（及其引用的字体）使用 assets 子命令下载，页面随后把 folium 的 default_js / default_css
+改为瓦片服务的本地地址，完全离线时地图也能加载。
+
+用法:
+    # 预下载鲁山县范围 8~14 级瓦片（默认范围取各乡镇坐标外扩 0.2 度）
+    python tiles.py seed --output data/tiles/lushan.mbtiles --zoom 8-14
+    # 下载地图脚本与样式到 data/tiles/assets/
+    python tiles.py assets
+    # 单独运行瓦片服务
+    python tiles.py serve --mbtiles data/tiles/lushan.mbtiles --port 8090
+    # 页面中启用离线底图（页面进程内启动瓦片服务）
+    SPP_MBTILES_PATH=data/tiles/lushan.mbtiles streamlit run app.py
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_MBTILES_PATH = os.environ.get("SPP_MBTILES_PATH", "")
+# 默认只监听本机；需要其他机器访问时显式设置 SPP_TILE_HOST 或 --host 0.0.0.0
+DEFAULT_TILE_HOST = os.environ.get("SPP_TILE_HOST", "127.0.0.1")
+DEFAULT_TILE_PORT = int(os.environ.get("SPP_TILE_PORT", "8090"))
+# 浏览器访问瓦片服务的地址模板；反向代理或远程访问时需要设置
+DEFAULT_TILE_URL = os.environ.get("SPP_TILE_URL", "")
+TILE_MAX_AGE = int(os.environ.get("SPP_TILE_MAX_AGE", str(30 * 24 * 3600)))
+MISSING_TILE_MAX_AGE = 60
+# 本地保存的地图脚本与样式（python tiles.py assets 下载），由瓦片服务在 /assets/ 下提供
+DEFAULT_ASSETS_DIR = os.environ.get("SPP_MAP_ASSETS_DIR", os.path.join("data", "tiles", "assets"))
+ASSET_MANIFEST = "assets.json"
+ASSET_TYPES = {
+    ".js": "application/javascript", ".css": "text/css", ".woff2": "font/woff2", ".woff": "font/woff",
+    ".ttf": "font/ttf", ".eot": "application/vnd.ms-fontobject", ".svg": "image/svg+xml", ".png": "image/png",
+}
+CSS_URL_PATTERN = re.compile(r"""url\(\s*['"]?([^'")]+?)['"]?\s*\)""")
+LOOPBACK_HOSTS = {"127.0.0.1", "localhost", "::1"}
+WILDCARD_HOSTS = {"", "0.0.0.0", "::"}
+
+DEFAULT_SOURCE_URL = "https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png"
+DEFAULT_ATTRIBUTION = "&copy; OpenStreetMap contributors &copy; CARTO"
+SUBDOMAINS = "abcd"
+USER_AGENT = "smart-plant-protection-tile-seeder/1.0"
+CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp", "pbf": "application/x-protobuf"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER NOT NULL,
+    tile_column INTEGER NOT NULL,
+    tile_row INTEGER NOT NULL,
+    tile_data BLOB NOT NULL,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+"""
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    """经纬度 → XYZ 瓦片坐标"""
+    n = 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_in_bbox(bbox, zooms):
+    """
+    范围内的全部瓦片坐标
+
+    参数:
+        bbox: (最小纬度, 最小经度, 最大纬度, 最大经度)
+        zooms: 缩放级别序列
+    """
+    south, west, north, east = bbox
+    for z in zooms:
+        x_min, y_min = lonlat_to_tile(west, north, z)
+        x_max, y_max = lonlat_to_tile(east, south, z)
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                yield z, x, y
+
+
+class MBTiles:
+    """MBTiles 文件读写（瓦片行号按 TMS 规范自下而上编号，对外使用 XYZ 坐标）"""
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+        if not readonly:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.executescript(SCHEMA)
+
+    def _connect(self):
+        if self.readonly:
+            return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    @property
+    def conn(self):
+        """每个线程一个连接（瓦片服务为多线程）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def metadata(self):
+        return dict(self.conn.execute("SELECT name, value FROM metadata"))
+
+    def set_metadata(self, **values):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                                  [(k, str(v)) for k, v in values.items()])
+
+    def get(self, z, x, y):
+        row = self.conn.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, (2 ** z - 1) - y),
+        ).fetchone()
+        return row[0] if row else None
+
+    def existing(self, zooms):
+        """已有瓦片的 XYZ 坐标集合"""
+        placeholders = ", ".join("?" * len(zooms))
+        rows = self.conn.execute(
+            f"SELECT zoom_level, tile_column, tile_row FROM tiles WHERE zoom_level IN ({placeholders})", list(zooms)
+        )
+        return {(z, x, (2 ** z - 1) - row) for z, x, row in rows}
+
+    def put_many(self, tiles):
+        """写入 [(z, x, y, 数据)]"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                [(z, x, (2 ** z - 1) - y, data) for z, x, y, data in tiles],
+            )
+
+
+# ---------- 瓦片服务 ----------
+
+class TileHandler(BaseHTTPRequestHandler):
+    """瓦片请求处理；mbtiles、content_type 与 assets_dir 由 make_server 绑定"""
+
+    mbtiles = None
+    content_type = "image/png"
+    assets_dir = None
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_cached(self, data, content_type):
+        """长期缓存的响应：带 ETag，If-None-Match 命中时返回 304"""
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={TILE_MAX_AGE}"}
+        if self.headers.get("If-None-Match") == etag:
+            self._send(304, headers=headers)
+            return
+        headers["Content-Type"] = content_type
+        self._send(200, data, headers)
+
+    def _send_asset(self, filename):
+        # 只提供资源目录下的文件本身，不允许子目录或 ..
+        path = os.path.join(self.assets_dir or "", filename)
+        if not self.assets_dir or filename != os.path.basename(filename) or not os.path.isfile(path):
+            self._send(404, headers={"Cache-Control": "no-store"})
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        self._send_cached(data, ASSET_TYPES.get(os.path.splitext(filename)[1], "application/octet-stream"))
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metadata":
+            body = json.dumps(self.mbtiles.metadata(), ensure_ascii=False).encode("utf-8")
+            self._send(200, body, {"Content-Type": "application/json", "Cache-Control": "no-cache"})
+            return
+        if path.startswith("/assets/"):
+            self._send_asset(urllib.parse.unquote(path[len("/assets/"):]))
+            return
+        parts = path.strip("/").split("/")
+        try:
+            if len(parts) != 4 or parts[0] != "tiles":
+                raise ValueError
+            z, x, y = int(parts[1]), int(parts[2]), int(parts[3].split(".", 1)[0])
+        except ValueError:
+            self._send(404, headers={"Cache-Control": "no-store"})
+            return
+        data = self.mbtiles.get(z, x, y)
+        if data is None:
+            self._send(404, headers={"Cache-Control": f"public, max-age={MISSING_TILE_MAX_AGE}"})
+            return
+        self._send_cached(data, self.content_type)
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):
+        pass  # 瓦片请求量大，不逐条输出日志
+
+
+def make_server(mbtiles_path, host=DEFAULT_TILE_HOST, port=DEFAULT_TILE_PORT, assets_dir=DEFAULT_ASSETS_DIR):
+    """创建（未启动的）多线程瓦片服务"""
+    mbtiles = MBTiles(mbtiles_path, readonly=True)
+    tile_format = mbtiles.metadata().get("format", "png")
+    handler = type("BoundTileHandler", (TileHandler,), {
+        "mbtiles": mbtiles,
+        "content_type": CONTENT_TYPES.get(tile_format, "application/octet-stream"),
+        "assets_dir": assets_dir,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_background_server(mbtiles_path, host=DEFAULT_TILE_HOST, port=DEFAULT_TILE_PORT, assets_dir=DEFAULT_ASSETS_DIR):
+    """在后台线程中启动瓦片服务，返回服务对象"""
+    server = make_server(mbtiles_path, host, port, assets_dir)
+    threading.Thread(target=server.serve_forever, name="tile-server", daemon=True).start()
+    return server
+
+
+def probe_server(host=DEFAULT_TILE_HOST, port=DEFAULT_TILE_PORT, timeout=2):
+    """端口上的服务是否为瓦片服务：返回其 MBTiles 元数据，连接失败或不是瓦片服务时返回 None"""
+    host = "127.0.0.1" if host in WILDCARD_HOSTS else host
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}/metadata", timeout=timeout) as response:
+            metadata = json.loads(response.read().decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+    return metadata if isinstance(metadata, dict) else None
+
+
+def browser_host(bind_host=DEFAULT_TILE_HOST, server_address=None):
+    """
+    浏览器访问瓦片服务使用的主机名
+
+    监听具体地址时就是该地址；监听所有网卡（0.0.0.0）时取页面服务的对外地址 server_address
+    （Streamlit 的 browser.serverAddress），未提供时为本机
+    """
+    if bind_host in WILDCARD_HOSTS:
+        return server_address or "127.0.0.1"
+    return bind_host
+
+
+def server_url(host="127.0.0.1", port=DEFAULT_TILE_PORT):
+    """浏览器访问瓦片服务的根地址：设置了 SPP_TILE_URL 时取其中 /tiles/ 之前的部分"""
+    if DEFAULT_TILE_URL:
+        return DEFAULT_TILE_URL.split("/tiles/", 1)[0]
+    return f"http://{host}:{port}"
+
+
+def tile_url(port=DEFAULT_TILE_PORT, tile_format="png", host="127.0.0.1"):
+    """浏览器使用的瓦片地址模板：优先 SPP_TILE_URL，否则为 host 上的瓦片服务"""
+    return DEFAULT_TILE_URL or f"{server_url(host, port)}/tiles/{{z}}/{{x}}/{{y}}.{tile_format}"
+
+
+# ---------- 地图脚本与样式 ----------
+
+def map_asset_classes():
+    """页面地图用到的、自带 default_js / default_css 的 folium 元素类"""
+    import folium
+    from folium.plugins import HeatMap, MarkerCluster
+
+    return [folium.Map, MarkerCluster, HeatMap]
+
+
+def _asset_filename(name, url):
+    extension = os.path.splitext(urllib.parse.urlsplit(url).path)[1]
+    return name if name.endswith(extension) else name + extension
+
+
+def _write_asset(directory, filename, data):
+    path = os.path.join(directory, filename)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def _vendor_css_resources(directory, name, css_url, data, failed):
+    """下载 CSS 中 url(...) 引用的字体与图片，并改写为同目录下的相对地址"""
+
+    def replace(match):
+        reference = match.group(1)
+        if reference.startswith(("data:", "#")):
+            return match.group(0)
+        source = urllib.parse.urljoin(css_url, reference)
+        filename = f"{name}-{os.path.basename(urllib.parse.urlsplit(source).path)}"
+        if not os.path.exists(os.path.join(directory, filename)):
+            content = _fetch(source)
+            if content is None:
+                failed.append(source)
+                return match.group(0)
+            _write_asset(directory, filename, content)
+        return f"url({filename})"
+
+    return CSS_URL_PATTERN.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+
+def vendor_assets(directory=DEFAULT_ASSETS_DIR, classes=None):
+    """
+    下载地图元素的脚本与样式到本地目录，并写入 assets.json 清单（资源名 → 文件）
+
+    返回:
+        {"downloaded": 已保存的资源数, "failed": 下载失败的地址}
+    """
+    classes = map_asset_classes() if classes is None else classes
+    os.makedirs(directory, exist_ok=True)
+    manifest, failed = {}, []
+    for cls in classes:
+        for name, url in list(cls.default_js) + list(cls.default_css):
+            if name in manifest:
+                continue
+            data = _fetch(url)
+            if data is None:
+                failed.append(url)
+                continue
+            filename = _asset_filename(name, url)
+            if filename.endswith(".css"):
+                data = _vendor_css_resources(directory, name, url, data, failed)
+            _write_asset(directory, filename, data)
+            manifest[name] = {"文件": filename, "来源": url}
+    _write_asset(directory, ASSET_MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    return {"downloaded": len(manifest), "failed": failed}
+
+
+def localize_assets(base_url, directory=DEFAULT_ASSETS_DIR, classes=None):
+    """
+    将 folium 元素类的 default_js / default_css 改为瓦片服务 base_url 下的本地地址
+
+    返回:
+        没有本地副本、仍从外网加载的资源名列表
+    """
+    path = os.path.join(directory, ASSET_MANIFEST)
+    manifest = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    remote = []
+    for cls in map_asset_classes() if classes is None else classes:
+        for attribute in ("default_js", "default_css"):
+            links = []
+            for name, url in getattr(cls, attribute):
+                if name in manifest:
+                    url = f"{base_url}/assets/{manifest[name]['文件']}"
+                else:
+                    remote.append(name)
+                links.append((name, url))
+            setattr(cls, attribute, links)
+    return remote
+
+
+# ---------- 预下载 ----------
+
+def _fetch(url, retries=3, timeout=20):
+    for attempt in range(retries):
+        try:
+            request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as exc:
+            if exc.code < 500:  # 瓦片不存在或请求被拒绝，不重试
+                return None
+            if attempt == retries - 1:
+                return None
+            time.sleep(2 ** attempt)
+        except OSError:
+            if attempt == retries - 1:
+                return None
+            time.sleep(2 ** attempt)
+
+
+def seed(output, bbox, zooms, source_url=DEFAULT_SOURCE_URL, workers=8, batch_size=256,
+         attribution=DEFAULT_ATTRIBUTION, progress=None):
+    """
+    下载范围内缺失的瓦片写入 MBTiles（已有瓦片跳过，可中断后继续）
+
+    返回:
+        {"total": 范围内瓦片数, "skipped": 已有, "downloaded": 新下载, "failed": 失败}
+    """
+    mbtiles = MBTiles(output)
+    zooms = list(zooms)
+    tile_format = source_url.rsplit(".", 1)[-1].split("?")[0].lower()
+    mbtiles.set_metadata(
+        name=os.path.splitext(os.path.basename(output))[0], type="baselayer", version="1",
+        format=tile_format if tile_format in CONTENT_TYPES else "png",
+        bounds=f"{bbox[1]},{bbox[0]},{bbox[3]},{bbox[2]}",
+        center=f"{(bbox[1] + bbox[3]) / 2},{(bbox[0] + bbox[2]) / 2},{zooms[0]}",
+        minzoom=min(zooms), maxzoom=max(zooms), attribution=attribution,
+    )
+    wanted = list(tiles_in_bbox(bbox, zooms))
+    existing = mbtiles.existing(zooms)
+    pending = [tile for tile in wanted if tile not in existing]
+    stats = {"total": len(wanted), "skipped": len(wanted) - len(pending), "downloaded": 0, "failed": 0}
+
+    def download(tile):
+        z, x, y = tile
+        url = source_url.format(s=SUBDOMAINS[(x + y) % len(SUBDOMAINS)], z=z, x=x, y=y, r="")
+        return tile, _fetch(url)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(pending), batch_size):
+            results = list(executor.map(download, pending[start:start + batch_size]))
+            fetched = [(z, x, y, data) for (z, x, y), data in results if data]
+            mbtiles.put_many(fetched)
+            stats["downloaded"] += len(fetched)
+            stats["failed"] += len(results) - len(fetched)
+            if progress:
+                progress(stats)
+    return stats
+
+
+def default_bbox(margin=0.2):
+    """鲁山县范围：各乡镇坐标外包矩形外扩 margin 度"""
+    from datasets import lushan_towns
+
+    lats, lons = zip(*lushan_towns.values())
+    return (min(lats) - margin, min(lons) - margin, max(lats) + margin, max(lons) + margin)
+
+
+def _parse_zooms(text):
+    low, _, high = text.partition("-")
+    return range(int(low), int(high or low) + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智慧植保离线底图瓦片：预下载与瓦片服务")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="预下载范围内的瓦片到 MBTiles")
+    seed_parser.add_argument("--output", default=DEFAULT_MBTILES_PATH or os.path.join("data", "tiles", "lushan.mbtiles"))
+    seed_parser.add_argument("--bbox", help="最小纬度,最小经度,最大纬度,最大经度（默认鲁山县范围）")
+    seed_parser.add_argument("--zoom", default="8-14", help="缩放级别范围，如 8-14")
+    seed_parser.add_argument("--url", default=DEFAULT_SOURCE_URL, help="瓦片源地址模板（{s} {z} {x} {y}）")
+    seed_parser.add_argument("--workers", type=int, default=8, help="并发下载数（请遵守瓦片服务商的使用条款）")
+    seed_parser.add_argument("--dry-run", action="store_true", help="只统计瓦片数量")
+
+    assets_parser = commands.add_parser("assets", help="下载地图脚本与样式（离线加载 Leaflet/folium）")
+    assets_parser.add_argument("--dir", default=DEFAULT_ASSETS_DIR)
+
+    serve_parser = commands.add_parser("serve", help="运行瓦片服务")
+    serve_parser.add_argument("--mbtiles", default=DEFAULT_MBTILES_PATH or os.path.join("data", "tiles", "lushan.mbtiles"))
+    serve_parser.add_argument("--host", default=DEFAULT_TILE_HOST, help="监听地址（默认仅本机，0.0.0.0 为所有网卡）")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_TILE_PORT)
+    serve_parser.add_argument("--assets", default=DEFAULT_ASSETS_DIR, help="地图脚本与样式目录")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        bbox = tuple(float(v) for v in args.bbox.split(",")) if args.bbox else default_bbox()
+        zooms = _parse_zooms(args.zoom)
+        if args.dry_run:
+            counts = {z: sum(1 for _ in tiles_in_bbox(bbox, [z])) for z in zooms}
+            print(json.dumps({"bbox": bbox, "tiles": counts, "total": sum(counts.values())}, ensure_ascii=False))
+            return
+        stats = seed(args.output, bbox, zooms, args.url, args.workers,
+                     progress=lambda s: print(f"\r已下载 {s['downloaded']} / 待下载 {s['total'] - s['skipped']}，失败 {s['failed']}", end=""))
+        print()
+        print(json.dumps(stats, ensure_ascii=False))
+    elif args.command == "assets":
+        print(json.dumps(vendor_assets(args.dir), ensure_ascii=False))
+    else:
+        server = make_server(args.mbtiles, args.host, args.port, args.assets)
+        print(f"瓦片服务已启动: http://{args.host}:{args.port}/tiles/{{z}}/{{x}}/{{y}}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+入库数据校验与隔离
+
+为各数据表定义校验规则：字段值为标量、必填字段、数值与日期类型、取值范围、县域坐标范围、
+乡镇/水果/病虫害注册表的引用完整性、水果与病虫害的对应关系，以及批次内的重复记录。
+每条规则在整列上一次计算出布尔掩码（不逐行执行 Python 代码），可放在接入写入的关键路径上；
+未通过的行连同原因写入隔离表，不会进入地图与 KPI。
+
+用法:
+    python validation.py observations.csv --table observations          # 校验并写入 SQLite 存储
+    python validation.py readings.csv --table sensor_readings --dry-run  # 只输出校验结果
+"""
+
+import argparse
+import json
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from schema import READING_TYPES
+
+REASON_COLUMN = "原因"
+COORD_MARGIN = 0.1  # 县域范围在各乡镇坐标外包矩形基础上外扩的度数
+
+# 各表的校验规则
+#   required: 必填字段
+#   dates: 日期时间列
+#   ranges: {列: (下限, 上限)}，None 表示不限；空值只由 required 检查
+#   references: {列: 注册表名}，注册表为 "乡镇" / "水果类型" / "病虫害类型" / "类型"
+#   pairs: 需与注册表对应的 (水果列, 病虫害列)
+#   coordinates: (纬度列, 经度列)，需位于县域范围内
+#   month_of: (月份列, 日期列)，月份需与日期一致
+#   unique: 批次内不允许重复的键
+# 传感器读数不做批次内去重：时间只精确到秒，读数也没有消息编号，同一设备同一秒内取值相同的
+# 多条读数无法与重复上报区分
+TABLE_RULES = {
+    "observations": {
+        "required": ["日期", "月份", "乡镇", "水果类型", "病虫害类型", "严重程度"],
+        "dates": ["日期"],
+        "ranges": {
+            "月份": (1, 12),
+            "严重程度": (1, 5),
+            "月均发生频次": (0, None),
+            "经济损失(元)": (0, None),
+            "防治成本(元)": (0, None),
+        },
+        "references": {"乡镇": "乡镇", "水果类型": "水果类型"},
+        "pairs": ("水果类型", "病虫害类型"),
+        "coordinates": ("纬度", "经度"),
+        "month_of": ("月份", "日期"),
+        "unique": ["日期", "乡镇", "水果类型", "病虫害类型"],
+    },
+    "market_prices": {
+        "required": ["日期", "月份", "水果类型", "价格(元/公斤)"],
+        "dates": ["日期"],
+        "ranges": {
+            "月份": (1, 12),
+            "价格(元/公斤)": (0, None),
+            "销量(吨)": (0, None),
+            "产量(吨)": (0, None),
+            "市场需求指数": (0, None),
+            "库存水平": (0, 1),
+        },
+        "references": {"水果类型": "水果类型"},
+        "month_of": ("月份", "日期"),
+        "unique": ["日期", "水果类型"],
+    },
+    "regional_market": {
+        "required": ["乡镇", "水果类型"],
+        "ranges": {
+            "区域产量(吨)": (0, None),
+            "品质等级": (1, 5),
+            "市场份额": (0, 1),
+            "运输成本(元/公斤)": (0, None),
+        },
+        "references": {"乡镇": "乡镇", "水果类型": "水果类型"},
+        "unique": ["乡镇", "水果类型"],
+    },
+    "sensor_readings": {
+        "required": ["时间", "类型", "乡镇"],
+        "dates": ["时间"],
+        "ranges": {
+            "诱捕数量": (0, 10000),
+            "温度(℃)": (-30, 50),
+            "相对湿度(%)": (0, 100),
+            "叶面湿润(小时)": (0, 24),
+            "降雨量(mm)": (0, 500),
+        },
+        "references": {"类型": "类型", "乡镇": "乡镇", "水果类型": "水果类型"},
+    },
+}
+
+
+def _non_scalar(values):
+    """object 列中为字典、列表等容器的取值（JSON 对象或数组），这类值无法参与比较与哈希"""
+    if values.dtype != object:
+        return np.zeros(len(values), dtype=bool)
+    return values.map(lambda v: isinstance(v, (dict, list, tuple, set))).to_numpy(dtype=bool)
+
+
+def _codes(values, categories):
+    """按给定类别编码，不在类别中的值（含空值）编码为 -1；先去重再映射，只对少量取值做查找"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.set_categories(categories).cat.codes.to_numpy()
+    codes, uniques = pd.factorize(values)
+    lookup = np.append(pd.Index(categories).get_indexer(uniques), -1)  # 空值编码 -1 取末位
+    return lookup[codes]
+
+
+class Validator:
+    """按 TABLE_RULES 对 DataFrame 做向量化校验"""
+
+    def __init__(self, towns, fruit_diseases, bounds=None):
+        """
+        参数:
+            towns: 乡镇名称列表
+            fruit_diseases: {水果类型: [病虫害类型]}
+            bounds: ((最小纬度, 最大纬度), (最小经度, 最大经度))，None 表示不检查坐标
+        """
+        self.fruits = list(fruit_diseases)
+        self.diseases = sorted({d for diseases in fruit_diseases.values() for d in diseases})
+        self.registries = {
+            "乡镇": list(towns),
+            "水果类型": self.fruits,
+            "病虫害类型": self.diseases,
+            "类型": sorted(READING_TYPES),
+        }
+        # 水果 × 病虫害 的对应关系矩阵，按编码查表
+        self.pair_matrix = np.zeros((len(self.fruits), len(self.diseases)), dtype=bool)
+        disease_index = {d: i for i, d in enumerate(self.diseases)}
+        for i, diseases in enumerate(fruit_diseases.values()):
+            self.pair_matrix[i, [disease_index[d] for d in diseases]] = True
+        self.bounds = bounds
+
+    @classmethod
+    def from_registries(cls, town_coords, fruit_diseases, margin=COORD_MARGIN):
+        """由乡镇坐标注册表构造，县域范围取各乡镇坐标外包矩形外扩 margin 度"""
+        lats, lons = zip(*town_coords.values())
+        bounds = ((min(lats) - margin, max(lats) + margin), (min(lons) - margin, max(lons) + margin))
+        return cls(town_coords, fruit_diseases, bounds)
+
+    def check(self, table, frame):
+        """
+        逐条规则计算未通过的行
+
+        返回:
+            {原因: 布尔数组}，只包含至少有一行未通过的规则
+        """
+        rules = TABLE_RULES[table]
+        failures = {}
+
+        def fail(reason, mask):
+            mask = np.asarray(mask, dtype=bool)
+            if mask.any():
+                failures[reason] = failures[reason] | mask if reason in failures else mask
+
+        # 容器取值先记为失败并置空，后续的去重、引用等规则只处理标量
+        non_scalar = {col: _non_scalar(frame[col]) for col in frame.columns}
+        non_scalar = {col: mask for col, mask in non_scalar.items() if mask.any()}
+        if non_scalar:
+            frame = frame.copy()
+            for col, mask in non_scalar.items():
+                fail(f"{col}不是标量值", mask)
+                frame[col] = frame[col].where(~mask, None)
+
+        for col in rules.get("required", []):
+            fail(f"缺少{col}", frame[col].isna() if col in frame else np.ones(len(frame), dtype=bool))
+
+        dates = {}
+        for col in rules.get("dates", []):
+            if col not in frame:
+                continue
+            values = frame[col]
+            if not pd.api.types.is_datetime64_any_dtype(values):
+                values = pd.to_datetime(values, errors="coerce", format="ISO8601")
+                fail(f"{col}格式错误", values.isna() & frame[col].notna())
+            dates[col] = values
+
+        for col, (low, high) in rules.get("ranges", {}).items():
+            if col not in frame:
+                continue
+            values = frame[col]
+            if not pd.api.types.is_numeric_dtype(values):
+                values = pd.to_numeric(values, errors="coerce")
+                fail(f"{col}不是数值", values.isna() & frame[col].notna())
+            values = values.to_numpy(dtype=float, na_value=np.nan)
+            # 空值比较结果为 False，不在此处拒绝
+            with np.errstate(invalid="ignore"):
+                out = np.zeros(len(values), dtype=bool)
+                if low is not None:
+                    out |= values < low
+                if high is not None:
+                    out |= values > high
+            label = f"[{low if low is not None else '-∞'}, {high if high is not None else '+∞'}]"
+            fail(f"{col}超出范围{label}", out)
+
+        for col, registry in rules.get("references", {}).items():
+            if col not in frame:
+                continue
+            unknown = (_codes(frame[col], self.registries[registry]) < 0) & frame[col].notna().to_numpy()
+            fail(f"{col}不在注册表中", unknown)
+
+        if "pairs" in rules and all(col in frame for col in rules["pairs"]):
+            fruit_col, disease_col = rules["pairs"]
+            fruit = _codes(frame[fruit_col], self.fruits)
+            disease = _codes(frame[disease_col], self.diseases)
+            known = (fruit >= 0) & (disease >= 0)
+            matched = np.zeros(len(frame), dtype=bool)
+            matched[known] = self.pair_matrix[fruit[known], disease[known]]
+            # 未知水果已由引用检查报告，这里只报告病虫害问题
+            fail(f"{disease_col}与{fruit_col}不匹配", (fruit >= 0) & ~matched & frame[disease_col].notna().to_numpy())
+
+        if self.bounds and "coordinates" in rules and all(col in frame for col in rules["coordinates"]):
+            out = np.zeros(len(frame), dtype=bool)
+            for col, (low, high) in zip(rules["coordinates"], self.bounds):
+                values = pd.to_numeric(frame[col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+                with np.errstate(invalid="ignore"):
+                    out |= (values < low) | (values > high)
+            fail("坐标超出县域范围", out)
+
+        if "month_of" in rules:
+            month_col, date_col = rules["month_of"]
+            if month_col in frame and date_col in dates:
+                months = pd.to_numeric(frame[month_col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+                date_months = dates[date_col].dt.month.to_numpy(dtype=float, na_value=np.nan)
+                fail(f"{month_col}与{date_col}不一致",
+                     ~np.isnan(months) & ~np.isnan(date_months) & (months != date_months))
+
+        keys = [col for col in rules.get("unique", []) if col in frame]
+        if keys:
+            fail("批次内重复记录", frame.duplicated(subset=keys, keep="first").to_numpy())
+        return failures
+
+    def split(self, table, frame):
+        """
+        将批次拆分为通过与未通过的行
+
+        返回:
+            (accepted, rejected)：rejected 附加 原因 列，多条原因以"；"连接
+        """
+        failures = self.check(table, frame)
+        if not failures:
+            return frame, frame.iloc[:0].assign(**{REASON_COLUMN: pd.Series(dtype=str)})
+        rejected_mask = np.logical_or.reduce(list(failures.values()))
+        rejected = frame[rejected_mask].copy()
+        # 只为未通过的行拼接原因
+        reasons = pd.Series("", index=rejected.index)
+        for reason, mask in failures.items():
+            hit = mask[rejected_mask]
+            reasons[hit] = reasons[hit] + np.where(reasons[hit] == "", "", "；") + reason
+        rejected[REASON_COLUMN] = reasons
+        return frame[~rejected_mask], rejected
+
+
+def quarantine_records(table, rejected, received_at=None):
+    """将未通过的行转换为隔离表记录：(接收时间, 表名, 原因, 数据JSON)"""
+    received_at = received_at or datetime.now().isoformat(timespec="seconds")
+    payloads = rejected.drop(columns=[REASON_COLUMN]).to_json(
+        orient="records", lines=True, force_ascii=False, date_format="iso"
+    ).splitlines()
+    return [(received_at, table, reason, payload)
+            for reason, payload in zip(rejected[REASON_COLUMN], payloads)]
+
+
+def default_validator():
+    """基于平台乡镇与病虫害注册表的校验器"""
+    from datasets import fruit_diseases, lushan_towns
+
+    return Validator.from_registries(lushan_towns, fruit_diseases)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智慧植保数据校验：校验 CSV 并写入存储，未通过的行进入隔离表")
+    parser.add_argument("path", help="CSV 文件路径")
+    parser.add_argument("--table", required=True, choices=sorted(TABLE_RULES))
+    parser.add_argument("--db", help="SQLite 数据库路径（默认使用 SPP_DB_PATH 或 data/plant_protection.db）")
+    parser.add_argument("--dry-run", action="store_true", help="只校验，不写入")
+    args = parser.parse_args()
+
+    frame = pd.read_csv(args.path)
+    accepted, rejected = default_validator().split(args.table, frame)
+    summary = {
+        "rows": len(frame),
+        "accepted": len(accepted),
+        "rejected": len(rejected),
+        "reasons": rejected[REASON_COLUMN].str.split("；").explode().value_counts().to_dict(),
+    }
+    if not args.dry_run:
+        from storage import DEFAULT_DB_PATH, PlantProtectionStore
+
+        store = PlantProtectionStore(args.db or DEFAULT_DB_PATH)
+        if not accepted.empty:
+            store.write_frame(args.table, accepted)
+        store.write_quarantine(args.table, rejected)
+        store.close()
+    print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+分版本物化视图
+
+每组筛选条件只计算一次完整结果：观测、市场、区域市场明细，以及按 (月份, 乡镇, 水果类型, 病虫害类型)
+汇总的立方体。基础版、专业版、企业版的受限结果都从这份完整结果派生：
+明细按版本可见范围做掩码投影，页面中的分组聚合由立方体上卷得到，不再扫描明细或查询存储。
+切换版本或不同版本的用户同时访问时共享同一次计算。
+"""
+
+import pandas as pd
+
+CUBE_KEYS = ["月份", "乡镇", "水果类型", "病虫害类型"]
+CUBE_MEASURES = ["月均发生频次", "严重程度", "经济损失(元)", "防治成本(元)"]
+COUNT_COLUMN = "记录数"
+
+# 各视图中可按版本范围投影的维度列
+VIEW_KEYS = {
+    "observations": CUBE_KEYS,
+    "cube": CUBE_KEYS,
+    "market": ["月份", "水果类型"],
+    "regional": ["乡镇", "水果类型"],
+}
+
+
+def build_cube(observations):
+    """按 CUBE_KEYS 汇总各度量的合计与记录数；均值由 合计/记录数 上卷得到"""
+    grouped = observations[CUBE_KEYS + CUBE_MEASURES].astype(
+        {col: float for col in CUBE_MEASURES}
+    ).groupby(CUBE_KEYS, observed=True)
+    cube = grouped[CUBE_MEASURES].sum()
+    cube[COUNT_COLUMN] = grouped.size()
+    return cube.reset_index()
+
+
+def materialize(observations, market, regional):
+    """一组筛选条件下的完整结果"""
+    return {
+        "observations": observations,
+        "market": market,
+        "regional": regional,
+        "cube": build_cube(observations),
+    }
+
+
+def rollup(cube, group_by, metrics):
+    """
+    从立方体上卷分组聚合，结果与在明细上 groupby(group_by).agg(metrics) 一致
+
+    参数:
+        metrics: {度量列: "sum" | "mean" | "count"}
+    """
+    columns = list(dict.fromkeys(col for col in metrics if col in CUBE_MEASURES))
+    grouped = cube.groupby(group_by, observed=True)[columns + [COUNT_COLUMN]].sum()
+    result = pd.DataFrame(index=grouped.index)
+    for col, how in metrics.items():
+        if how == "sum":
+            result[col] = grouped[col]
+        elif how == "mean":
+            result[col] = grouped[col] / grouped[COUNT_COLUMN]
+        elif how == "count":
+            result[col] = grouped[COUNT_COLUMN]
+        else:
+            raise ValueError(f"不支持的聚合方式: {how}")
+    return result.reset_index()
+
+
+def clip_filters(filters, scope):
+    """
+    将筛选条件裁剪到版本可见范围
+
+    参数:
+        filters: (月份, 乡镇, 水果类型, 病虫害类型) 的所选值
+        scope: {维度列: 允许值}，缺省或 None 表示不限
+    """
+    clipped = []
+    for col, values in zip(CUBE_KEYS, filters):
+        allowed = scope.get(col)
+        if allowed is not None:
+            allowed = set(allowed)
+            values = [value for value in values if value in allowed]
+        clipped.append(list(values))
+    return tuple(clipped)
+
+
+def project(views, filters, original=None):
+    """
+    按裁剪后的筛选条件从完整结果派生受限视图
+
+    参数:
+        filters: 裁剪后的 (月份, 乡镇, 水果类型, 病虫害类型)
+        original: 生成 views 时使用的筛选条件；某列裁剪前后相同时，结果中该列已全部满足条件，
+            不再为该列计算掩码。缺省时对所有维度列计算掩码
+    """
+    selected = dict(zip(CUBE_KEYS, filters))
+    unchanged = set()
+    if original is not None:
+        unchanged = {col for col, values in zip(CUBE_KEYS, original) if list(values) == list(selected[col])}
+    projected = {}
+    for name, frame in views.items():
+        mask = None
+        for col in VIEW_KEYS[name]:
+            if col in unchanged:
+                continue
+            condition = frame[col].isin(selected[col])
+            mask = condition if mask is None else mask & condition
+        projected[name] = frame if mask is None or mask.all() else frame[mask].reset_index(drop=True)
+    return projected
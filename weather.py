@@ -0,0 +1,235 @@
+"""
+气象驱动的病虫害风险模型
+
+读取本地气象站（CSV）或格点（NPZ）逐日气象数据（温度、相对湿度、叶面湿润时长、降雨），
+按乡镇与病虫害计算侵染风险指数与有效积温，输出逐日风险面，用于地图展示与预警。
+全部计算以 (日期, 乡镇, 病虫害) 三维数组向量化完成，多年逐日数据也可在秒级算完。
+
+气象站 CSV 列：日期, 乡镇（或 纬度/经度）, 平均温度(℃), 相对湿度(%), 叶面湿润(小时), 降雨量(mm)
+格点 NPZ 数组：dates[t], lats[y], lons[x], temperature/humidity/leaf_wetness/rainfall[t, y, x]
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+WEATHER_FIELDS = {
+    "temperature": "平均温度(℃)",
+    "humidity": "相对湿度(%)",
+    "leaf_wetness": "叶面湿润(小时)",
+    "rainfall": "降雨量(mm)",
+}
+
+# 病虫害气象参数
+#   类型: 病害按温度-湿润时长计算侵染风险，虫害按有效积温计算发育进度
+#   温度范围: (最低, 最适, 最高) 温度 ℃
+#   湿润时长: 达到侵染所需的叶面湿润小时数（病害）
+#   降雨敏感: 是否依赖雨水飞溅传播
+#   起点温度 / 世代积温: 虫害发育起点温度与完成一代所需积温（℃·日）
+DISEASE_WEATHER_PARAMS = {
+    "褐腐病":     {"类型": "病害", "温度范围": (10, 24, 32), "湿润时长": 6,  "降雨敏感": True},
+    "炭疽病":     {"类型": "病害", "温度范围": (12, 27, 35), "湿润时长": 8,  "降雨敏感": True},
+    "白粉病":     {"类型": "病害", "温度范围": (10, 22, 30), "湿润时长": 0,  "降雨敏感": False},
+    "霜霉病":     {"类型": "病害", "温度范围": (8, 22, 29),  "湿润时长": 4,  "降雨敏感": True},
+    "灰霉病":     {"类型": "病害", "温度范围": (5, 20, 28),  "湿润时长": 10, "降雨敏感": False},
+    "黑星病":     {"类型": "病害", "温度范围": (6, 20, 26),  "湿润时长": 9,  "降雨敏感": True},
+    "蚜虫":       {"类型": "虫害", "起点温度": 4.0,  "世代积温": 120.0, "温度范围": (8, 24, 30)},
+    "桃小食心虫": {"类型": "虫害", "起点温度": 10.0, "世代积温": 430.0, "温度范围": (15, 26, 33)},
+    "红蜘蛛":     {"类型": "虫害", "起点温度": 10.0, "世代积温": 180.0, "温度范围": (15, 30, 38)},
+    "透翅蛾":     {"类型": "虫害", "起点温度": 10.0, "世代积温": 600.0, "温度范围": (15, 25, 33)},
+    "梨木虱":     {"类型": "虫害", "起点温度": 5.0,  "世代积温": 350.0, "温度范围": (10, 22, 30)},
+}
+
+RISK_LEVELS = [(0.7, "高"), (0.4, "中"), (0.0, "低")]
+SMOOTHING_DAYS = 3
+
+
+# --------------------------
+# 气象数据读取
+# --------------------------
+
+def _nearest_town(lats, lons, towns):
+    """将坐标映射到最近的乡镇（向量化）"""
+    names = list(towns)
+    town_lat = np.array([towns[t][0] for t in names])
+    town_lon = np.array([towns[t][1] for t in names])
+    dist = (lats[:, None] - town_lat) ** 2 + (lons[:, None] - town_lon) ** 2
+    return np.array(names, dtype=object)[dist.argmin(axis=1)]
+
+
+def load_station_csv(path, towns):
+    """读取气象站 CSV，返回 (日期索引, 乡镇列表, {要素: 数组[日期, 乡镇]})"""
+    frame = pd.read_csv(path, parse_dates=["日期"])
+    if "乡镇" not in frame.columns:
+        frame["乡镇"] = _nearest_town(frame["纬度"].to_numpy(), frame["经度"].to_numpy(), towns)
+    columns = [c for c in WEATHER_FIELDS.values() if c in frame.columns]
+    # 同一乡镇多个站点取平均，缺测日期按时间插值
+    daily = frame.groupby(["日期", "乡镇"])[columns].mean().unstack("乡镇")
+    dates = pd.date_range(daily.index.min(), daily.index.max(), freq="D")
+    daily = daily.reindex(dates).interpolate(limit_direction="both")
+    town_names = [t for t in towns if t in daily.columns.get_level_values(1)]
+    fields = {
+        key: daily[column][town_names].to_numpy(dtype=np.float32)
+        for key, column in WEATHER_FIELDS.items() if column in columns
+    }
+    return dates, town_names, fields
+
+
+def load_grid_npz(path, towns):
+    """读取格点 NPZ，按最近格点取样到各乡镇"""
+    grid = np.load(path)
+    lats, lons = grid["lats"], grid["lons"]
+    town_names = list(towns)
+    yi = np.abs(lats[:, None] - np.array([towns[t][0] for t in town_names])).argmin(axis=0)
+    xi = np.abs(lons[:, None] - np.array([towns[t][1] for t in town_names])).argmin(axis=0)
+    fields = {key: grid[key][:, yi, xi].astype(np.float32) for key in WEATHER_FIELDS if key in grid}
+    return pd.DatetimeIndex(grid["dates"]), town_names, fields
+
+
+def load_weather(path, towns):
+    """根据文件扩展名读取气象站或格点数据"""
+    if os.path.splitext(path)[1].lower() == ".npz":
+        return load_grid_npz(path, towns)
+    return load_station_csv(path, towns)
+
+
+def generate_weather(towns, start="2023-01-01", end="2024-12-31", seed=42):
+    """生成模拟逐日气象数据（无本地气象文件时使用）"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, end, freq="D")
+    town_names = list(towns)
+    n_days, n_towns = len(dates), len(town_names)
+    day_of_year = dates.dayofyear.to_numpy()[:, None]
+    # 海拔较高（纬度偏南的山区乡镇）温度略低
+    offset = np.array([(towns[t][0] - 33.65) * 8 for t in town_names])[None, :]
+
+    season = -np.cos(2 * np.pi * (day_of_year - 15) / 365)
+    temperature = 14.5 + 13 * season + offset + rng.normal(0, 2.5, (n_days, n_towns))
+    rain_event = rng.random((n_days, n_towns)) < (0.18 + 0.12 * np.clip(season, 0, None))
+    rainfall = np.where(rain_event, rng.gamma(1.5, 6.0, (n_days, n_towns)), 0.0)
+    humidity = np.clip(62 + 12 * season + 25 * rain_event + rng.normal(0, 8, (n_days, n_towns)), 20, 100)
+    leaf_wetness = np.clip((humidity - 70) / 30 * 12 + 6 * rain_event + rng.normal(0, 1.5, (n_days, n_towns)), 0, 24)
+
+    fields = {
+        "temperature": temperature,
+        "humidity": humidity,
+        "leaf_wetness": leaf_wetness,
+        "rainfall": rainfall,
+    }
+    return dates, town_names, {k: v.astype(np.float32) for k, v in fields.items()}
+
+
+# --------------------------
+# 风险计算
+# --------------------------
+
+def _temperature_response(temperature, t_min, t_opt, t_max):
+    """温度响应函数（Beta 型），最适温度为 1，范围外为 0；参数为按病虫害广播的数组"""
+    t = np.clip(temperature, t_min, t_max)
+    exponent = (t_max - t_opt) / (t_opt - t_min)
+    response = ((t - t_min) / (t_opt - t_min)) * ((t_max - t) / (t_max - t_opt)) ** exponent
+    return np.nan_to_num(response, nan=0.0)
+
+
+def _rolling_mean(values, window):
+    """沿日期轴的滑动平均（累加和实现，适用于任意维数组）"""
+    cumsum = np.cumsum(values, axis=0, dtype=np.float64)
+    result = cumsum.copy()
+    result[window:] = cumsum[window:] - cumsum[:-window]
+    counts = np.minimum(np.arange(1, values.shape[0] + 1), window)
+    return (result / counts.reshape((-1,) + (1,) * (values.ndim - 1))).astype(np.float32)
+
+
+def compute_risk(dates, town_names, fields, diseases=None):
+    """
+    计算逐日风险面
+
+    返回:
+        DataFrame，列为 日期, 乡镇, 病虫害类型, 风险指数(0-1), 风险等级, 有效积温(℃·日)
+    """
+    diseases = [d for d in (diseases or DISEASE_WEATHER_PARAMS) if d in DISEASE_WEATHER_PARAMS]
+    params = [DISEASE_WEATHER_PARAMS[d] for d in diseases]
+
+    def param_array(getter):
+        return np.array([getter(p) for p in params], dtype=np.float32)[None, None, :]
+
+    temperature = fields["temperature"][:, :, None]
+    humidity = fields.get("humidity", np.full_like(fields["temperature"], 70.0))[:, :, None]
+    if "leaf_wetness" in fields:
+        wetness = fields["leaf_wetness"][:, :, None]
+    else:  # 缺少叶面湿润观测时由相对湿度估算
+        wetness = np.clip((humidity - 70) / 30 * 12, 0, 24)
+    rainfall = fields.get("rainfall", np.zeros_like(fields["temperature"]))[:, :, None]
+
+    t_min = param_array(lambda p: p["温度范围"][0])
+    t_opt = param_array(lambda p: p["温度范围"][1])
+    t_max = param_array(lambda p: p["温度范围"][2])
+    temp_response = _temperature_response(temperature, t_min, t_opt, t_max)
+
+    is_fungal = param_array(lambda p: p["类型"] == "病害").astype(bool)
+    wet_hours = param_array(lambda p: p.get("湿润时长", 0))
+    rain_sensitive = param_array(lambda p: p.get("降雨敏感", False)).astype(bool)
+    base_temp = param_array(lambda p: p.get("起点温度", 10.0))
+    generation_dd = param_array(lambda p: p.get("世代积温", 1.0))
+
+    # 病害：温度适宜度 × 湿润满足度；雨传病害再乘降雨因子
+    wet_factor = np.where(wet_hours > 0, np.clip(wetness / np.maximum(wet_hours, 1e-6), 0, 1),
+                          np.clip((humidity - 50) / 40, 0, 1))
+    rain_factor = np.where(rain_sensitive, 0.6 + 0.4 * np.clip(rainfall / 5.0, 0, 1), 1.0)
+    fungal_risk = temp_response * wet_factor * rain_factor
+
+    # 有效积温：按自然年累计
+    degree_days = np.clip(temperature - base_temp, 0, None)
+    years = dates.year.to_numpy()
+    gdd = np.cumsum(degree_days, axis=0)
+    year_changed = np.r_[False, np.diff(years) != 0]
+    year_start = np.flatnonzero(np.r_[True, year_changed[1:]])
+    year_id = np.cumsum(year_changed)
+    before = np.concatenate([np.zeros_like(gdd[:1]), gdd[:-1]])
+    gdd = gdd - before[year_start][year_id]
+
+    # 虫害：世代发育进度接近完成（成虫羽化/产卵高峰）时风险最高，再乘温度适宜度
+    progress = (gdd % generation_dd) / generation_dd
+    emergence = np.clip(1 - np.abs(progress - 0.85) / 0.35, 0, 1)
+    insect_risk = temp_response * (0.5 + 0.5 * emergence) * (gdd > 0.5 * generation_dd)
+
+    risk = np.where(is_fungal, fungal_risk, insect_risk)
+    risk = _rolling_mean(risk, SMOOTHING_DAYS).clip(0, 1)
+
+    n_days, n_towns, n_diseases = risk.shape
+    town_codes = np.arange(n_towns, dtype=np.int16).repeat(n_diseases)
+    disease_codes = np.arange(n_diseases, dtype=np.int8)
+    level_labels = [label for _, label in reversed(RISK_LEVELS)]
+    level_bins = [threshold for threshold, _ in reversed(RISK_LEVELS)][1:]
+    risk = risk.reshape(-1)
+    frame = pd.DataFrame({
+        "日期": np.repeat(dates.to_numpy(), n_towns * n_diseases),
+        "乡镇": pd.Categorical.from_codes(np.tile(town_codes, n_days), categories=town_names),
+        "病虫害类型": pd.Categorical.from_codes(np.tile(disease_codes, n_days * n_towns), categories=diseases),
+        "风险指数": risk,
+        "风险等级": pd.Categorical.from_codes(
+            np.digitize(risk, level_bins).astype(np.int8), categories=level_labels, ordered=True
+        ),
+        "有效积温(℃·日)": gdd.reshape(-1).astype(np.float32),
+    })
+    return frame
+
+
+def risk_alerts(risk, as_of, lead_days=7, threshold=0.7):
+    """
+    预警列表：as_of 起 lead_days 天内风险指数达到阈值的 (乡镇, 病虫害)
+
+    返回首次达到阈值的日期、窗口内最高风险指数与提前天数，按风险降序排列
+    """
+    as_of = pd.Timestamp(as_of)
+    window = risk[(risk["日期"] >= as_of) & (risk["日期"] < as_of + pd.Timedelta(days=lead_days))]
+    hits = window[window["风险指数"] >= threshold]
+    if hits.empty:
+        return pd.DataFrame(columns=["乡镇", "病虫害类型", "预警日期", "最高风险指数", "提前天数"])
+    alerts = hits.groupby(["乡镇", "病虫害类型"], observed=True).agg(
+        预警日期=("日期", "min"),
+        最高风险指数=("风险指数", "max"),
+    ).reset_index()
+    alerts["提前天数"] = (alerts["预警日期"] - as_of).dt.days
+    return alerts.sort_values("最高风险指数", ascending=False).reset_index(drop=True)
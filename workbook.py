@@ -0,0 +1,259 @@
+"""
+Excel 分析工作簿
+
+用 xlsxwriter 生成包含以下工作表的工作簿：
+
+    汇总_乡镇 / 汇总_病虫害 / 汇总_月份   由汇总立方体上卷的分组指标，附 Excel 原生图表
+    汇总_市场                            各水果逐月价格、销量、产量，附价格走势与销量图表
+    明细 / 明细_2 ...                    原始观测（超过单表行数上限时自动分表）
+
+汇总表在写入前已聚合完成，打开工作簿时 Excel 只需渲染小表与图表，不必在明细上重建数据透视表。
+明细按行流式写入（constant_memory），内存占用与行数无关。生成在后台线程中进行，
+submit_workbook 返回 Future，页面脚本线程不被阻塞。本模块不依赖 Streamlit。
+"""
+
+import io
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from views import build_cube, rollup
+
+MAX_SHEET_ROWS = 1_048_576 - 1   # Excel 单表行数上限（不含表头）
+PROGRESS_EVERY = 10_000
+
+SUMMARY_METRICS = {
+    "经济损失(元)": "sum",
+    "防治成本(元)": "sum",
+    "严重程度": "mean",
+    "月均发生频次": "mean",
+    "记录数": "count",
+}
+# 工作表名: (分组列, 排序列, 是否降序)
+SUMMARY_SHEETS = {
+    "汇总_乡镇": ("乡镇", "经济损失(元)", True),
+    "汇总_病虫害": ("病虫害类型", "经济损失(元)", True),
+    "汇总_月份": ("月份", "月份", False),
+}
+MARKET_SHEET = "汇总_市场"
+MARKET_METRICS = {"价格(元/公斤)": "mean", "销量(吨)": "sum", "产量(吨)": "sum"}
+DETAIL_SHEET = "明细"
+# 后台生成工作簿的线程数；每个任务持有一份筛选结果的副本，线程数同时限制了导出占用的内存
+WORKBOOK_WORKERS = int(os.environ.get("SPP_WORKBOOK_WORKERS", "2"))
+
+_executor = None
+
+
+def summary_tables(cube):
+    """各汇总工作表的数据：{工作表名: DataFrame}"""
+    tables = {}
+    for sheet, (key, sort_by, descending) in SUMMARY_SHEETS.items():
+        table = rollup(cube, [key], SUMMARY_METRICS)
+        table[key] = table[key].astype(str) if key != "月份" else table[key].astype(int)
+        table["投资回报率"] = table["经济损失(元)"] / table["防治成本(元)"].where(table["防治成本(元)"] > 0)
+        tables[sheet] = table.sort_values(sort_by, ascending=not descending).reset_index(drop=True)
+    return tables
+
+
+def market_table(market):
+    """逐月市场宽表：月份 × (水果类型 × 指标)，列名为 "水果类型·指标" """
+    if market.empty:
+        return pd.DataFrame(columns=["月份"])
+    monthly = market.groupby(["月份", "水果类型"], observed=True).agg(MARKET_METRICS)
+    wide = monthly.unstack("水果类型")
+    wide.columns = [f"{fruit}·{metric}" for metric, fruit in wide.columns]
+    ordered = [f"{fruit}·{metric}" for metric in MARKET_METRICS
+               for fruit in monthly.index.get_level_values("水果类型").unique()]
+    wide = wide[[col for col in ordered if col in wide.columns]]
+    wide.index = wide.index.astype(int)
+    return wide.sort_index().reset_index()
+
+
+class _Formats:
+    """工作簿内复用的单元格格式"""
+
+    def __init__(self, workbook):
+        self.header = workbook.add_format({"bold": True, "bg_color": "#E2EFDA", "border": 1})
+        self.money = workbook.add_format({"num_format": "#,##0"})
+        self.decimal = workbook.add_format({"num_format": "0.00"})
+        self.date = workbook.add_format({"num_format": "yyyy-mm-dd"})
+
+    def for_column(self, name, dtype):
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            return self.date
+        if "(元)" in name:
+            return self.money
+        if pd.api.types.is_float_dtype(dtype):
+            return self.decimal
+        return None
+
+
+def _write_table(workbook, sheet, frame, formats):
+    """新建工作表写入小表（表头 + 数据），设置列宽并冻结表头"""
+    worksheet = workbook.add_worksheet(sheet)
+    for col, name in enumerate(frame.columns):
+        worksheet.set_column(col, col, max(10, 2 * len(str(name)) + 2))
+    worksheet.write_row(0, 0, list(frame.columns), formats.header)
+    worksheet.freeze_panes(1, 0)
+    _write_rows(worksheet, frame, formats)
+    return worksheet
+
+
+def _add_summary_chart(workbook, worksheet, sheet, table):
+    """分组损失/成本柱状图（月份表为折线图），严重程度均值画在次坐标轴"""
+    n = len(table)
+    if n == 0:
+        return
+    columns = list(table.columns)
+    is_month = table.columns[0] == "月份"
+    chart = workbook.add_chart({"type": "line" if is_month else "column"})
+    for metric in ("经济损失(元)", "防治成本(元)"):
+        col = columns.index(metric)
+        chart.add_series({
+            "name": [sheet, 0, col],
+            "categories": [sheet, 1, 0, n, 0],
+            "values": [sheet, 1, col, n, col],
+        })
+    severity = workbook.add_chart({"type": "line"})
+    col = columns.index("严重程度")
+    severity.add_series({
+        "name": [sheet, 0, col],
+        "categories": [sheet, 1, 0, n, 0],
+        "values": [sheet, 1, col, n, col],
+        "y2_axis": True,
+        "marker": {"type": "circle"},
+    })
+    chart.combine(severity)
+    chart.set_title({"name": f"按{table.columns[0]}的经济损失与防治成本"})
+    chart.set_y_axis({"name": "元", "num_format": "#,##0"})
+    severity.set_y2_axis({"name": "严重程度均值"})
+    chart.set_size({"width": 720, "height": 360})
+    worksheet.insert_chart(1, len(columns) + 1, chart)
+
+
+def _add_market_charts(workbook, worksheet, table):
+    """各水果价格走势折线图与销量柱状图"""
+    n = len(table)
+    if n == 0:
+        return
+    columns = list(table.columns)
+    for index, (metric, chart_type) in enumerate((("价格(元/公斤)", "line"), ("销量(吨)", "column"))):
+        chart = workbook.add_chart({"type": chart_type})
+        for col, name in enumerate(columns):
+            if name.endswith(f"·{metric}"):
+                chart.add_series({
+                    "name": name.split("·", 1)[0],
+                    "categories": [MARKET_SHEET, 1, 0, n, 0],
+                    "values": [MARKET_SHEET, 1, col, n, col],
+                })
+        chart.set_title({"name": f"各水果逐月{metric}"})
+        chart.set_x_axis({"name": "月份"})
+        chart.set_size({"width": 720, "height": 320})
+        worksheet.insert_chart(n + 2 + 17 * index, 0, chart)
+
+
+def _cell_writers(worksheet, frame, formats):
+    """每列的单元格写入函数与待写入的 Python 值（NaN / NaT 为 None）"""
+    writers, columns = [], []
+    for name in frame.columns:
+        series = frame[name]
+        fmt = formats.for_column(name, series.dtype)
+        if pd.api.types.is_datetime64_any_dtype(series.dtype):
+            values = [None if pd.isna(v) else v for v in series.dt.to_pydatetime()]
+            writers.append((worksheet.write_datetime, fmt))
+        elif pd.api.types.is_bool_dtype(series.dtype):
+            values = series.tolist()
+            writers.append((worksheet.write_boolean, fmt))
+        elif pd.api.types.is_numeric_dtype(series.dtype):
+            array = series.to_numpy(dtype=float, na_value=np.nan)
+            values = [None if math.isnan(v) else v for v in array.tolist()]
+            writers.append((worksheet.write_number, fmt))
+        else:
+            values = [None if pd.isna(v) else str(v) for v in series.tolist()]
+            writers.append((worksheet.write_string, fmt))
+        columns.append(values)
+    return writers, columns
+
+
+def _write_rows(worksheet, frame, formats, progress=None, done=0, total=None):
+    """按行顺序写入数据（constant_memory 模式要求逐行写完），返回累计写入行数"""
+    writers, columns = _cell_writers(worksheet, frame, formats)
+    for offset, row in enumerate(zip(*columns), start=1):
+        for col, (value, (write, fmt)) in enumerate(zip(row, writers)):
+            if value is not None:
+                write(offset, col, value, fmt)
+        done += 1
+        if progress is not None and done % PROGRESS_EVERY == 0:
+            progress(done, total)
+    return done
+
+
+def _write_detail(workbook, frame, formats, progress):
+    """明细按行流式写入；超过单表行数上限时续写到 明细_2、明细_3 ..."""
+    total = len(frame)
+    n_sheets = max(1, math.ceil(total / MAX_SHEET_ROWS))
+    done = 0
+    for part in range(n_sheets):
+        name = DETAIL_SHEET if part == 0 else f"{DETAIL_SHEET}_{part + 1}"
+        chunk = frame.iloc[part * MAX_SHEET_ROWS:(part + 1) * MAX_SHEET_ROWS]
+        worksheet = workbook.add_worksheet(name)
+        for col, column in enumerate(frame.columns):
+            worksheet.set_column(col, col, max(10, 2 * len(str(column)) + 2))
+        worksheet.write_row(0, 0, list(frame.columns), formats.header)
+        worksheet.freeze_panes(1, 0)
+        done = _write_rows(worksheet, chunk, formats, progress, done, total)
+        if len(frame.columns):
+            worksheet.autofilter(0, 0, len(chunk), len(frame.columns) - 1)
+    if progress is not None:
+        progress(total, total)
+
+
+def build_workbook(observations, market, cube=None, output=None, progress=None):
+    """
+    生成分析工作簿
+
+    参数:
+        observations: 观测明细
+        market: 市场价格明细
+        cube: observations 的汇总立方体（views.build_cube），缺省时现算
+        output: 文件路径或可写的二进制流，缺省时返回 bytes
+        progress: 回调 progress(已写明细行数, 明细总行数)
+
+    返回:
+        output 缺省时为工作簿内容（bytes），否则为 None
+    """
+    buffer = io.BytesIO() if output is None else output
+    cube = build_cube(observations) if cube is None else cube
+    workbook = xlsxwriter.Workbook(buffer, {"constant_memory": True})
+    workbook.set_properties({"title": "病虫害数据分析", "created": datetime.now()})
+    formats = _Formats(workbook)
+
+    # constant_memory 模式下每张表必须按行顺序写完，因此先写汇总表，最后流式写明细
+    for sheet, table in summary_tables(cube).items():
+        worksheet = _write_table(workbook, sheet, table, formats)
+        _add_summary_chart(workbook, worksheet, sheet, table)
+    table = market_table(market)
+    worksheet = _write_table(workbook, MARKET_SHEET, table, formats)
+    _add_market_charts(workbook, worksheet, table)
+    _write_detail(workbook, observations, formats, progress)
+
+    workbook.close()
+    return buffer.getvalue() if output is None else None
+
+
+def _get_executor():
+    """模块级小线程池：多个会话的导出任务并行生成，超出线程数时排队，不占用页面脚本线程"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=WORKBOOK_WORKERS, thread_name_prefix="workbook")
+    return _executor
+
+
+def submit_workbook(observations, market, cube=None, progress=None):
+    """在后台线程中生成工作簿，返回结果为 bytes 的 Future"""
+    return _get_executor().submit(build_workbook, observations, market, cube, None, progress)